@@ -0,0 +1,141 @@
+"""Benchmark harness of the chunked parallel copy engine `clusterlib.file.copy_file`. The benchmark copies a test
+file within each given directory, e.g. a local disk and a tmpfs, with `shutil.copy` and with the chunked copy for
+a grid of chunk sizes and numbers of threads. For example,
+
+    python -m clusterlib.copybench --size-MB 2048 --dir /scratch/$USER --dir /dev/shm
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Dict, List
+from clusterlib.file import copy_file
+
+DEFAULT_CHUNK_MB_INT_LST = [16, 64, 256]
+DEFAULT_NR_THREADS_INT_LST = [1, 2, 4, 8]
+
+
+def _get_default_dirP_str_lst() -> List[str]:
+    dirP_str_lst = [tempfile.gettempdir()]
+    if os.path.isdir('/dev/shm') is True:
+        dirP_str_lst.append('/dev/shm')
+
+    return dirP_str_lst
+
+
+def benchmark_copy(dirP_str: str,
+                   size_MB_int: int = 1024,
+                   chunk_MB_int_lst: List[int] = None,
+                   nr_threads_int_lst: List[int] = None,
+                   repeat_int: int = 3) -> List[Dict[str, object]]:
+    """Benchmark the copy of a file within a directory.
+
+    Parameters
+    ----------
+    dirP_str: str
+        The directory wherein the test file is created and copied.
+    size_MB_int: int
+        The size of the test file in mega-bytes.
+    chunk_MB_int_lst: list of int
+        The chunk sizes in mega-bytes that are benchmarked.
+    nr_threads_int_lst: list of int
+        The numbers of threads that are benchmarked.
+    repeat_int: int
+        The number of times each copy is repeated; the fastest copy is reported.
+
+    Returns
+    -------
+    list of dict:
+        For each benchmark, the method, chunk size, number of threads, duration and throughput."""
+
+    if chunk_MB_int_lst is None:
+        chunk_MB_int_lst = DEFAULT_CHUNK_MB_INT_LST
+    if nr_threads_int_lst is None:
+        nr_threads_int_lst = DEFAULT_NR_THREADS_INT_LST
+
+    result_dct_lst = []
+    with tempfile.TemporaryDirectory(dir=dirP_str) as tmp_dirP_str:
+        src_fileP_str = os.path.join(tmp_dirP_str, 'src.bin')
+        dst_fileP_str = os.path.join(tmp_dirP_str, 'dst.bin')
+
+        # Create the test file
+        block_bytes = os.urandom(1024 ** 2)
+        with open(src_fileP_str, 'wb') as file_obj:
+            for _ in range(size_MB_int):
+                file_obj.write(block_bytes)
+
+        def _time_copy(_copy_func_obj) -> float:
+            _duration_sec_flt = float('inf')
+            for _ in range(repeat_int):
+                if os.path.exists(dst_fileP_str) is True:
+                    os.remove(dst_fileP_str)
+
+                _start_sec_flt = time.perf_counter()
+                _copy_func_obj()
+                _duration_sec_flt = min(_duration_sec_flt, time.perf_counter() - _start_sec_flt)
+
+            return _duration_sec_flt
+
+        config_tpl_lst = [('shutil.copy', None, None)]
+        for chunk_MB_int in chunk_MB_int_lst:
+            for nr_threads_int in nr_threads_int_lst:
+                config_tpl_lst.append(('copy_file', chunk_MB_int, nr_threads_int))
+
+        for method_str, chunk_MB_int, nr_threads_int in config_tpl_lst:
+            if method_str == 'shutil.copy':
+                duration_sec_flt = _time_copy(lambda: shutil.copy(src_fileP_str, dst_fileP_str))
+            else:
+                duration_sec_flt = _time_copy(lambda: copy_file(src_fileP_str, dst_fileP_str,
+                                                                chunk_bytes_int=chunk_MB_int * 1024 ** 2,
+                                                                nr_threads_int=nr_threads_int,
+                                                                threshold_bytes_int=0))
+
+            result_dct_lst.append({
+                'dirP_str': dirP_str,
+                'method_str': method_str,
+                'chunk_MB_int': chunk_MB_int,
+                'nr_threads_int': nr_threads_int,
+                'duration_sec_flt': duration_sec_flt,
+                'throughput_MBps_flt': size_MB_int / duration_sec_flt
+            })
+
+    return result_dct_lst
+
+
+def main(arg_str_lst: List[str] = None):
+    parser_obj = argparse.ArgumentParser(description='Benchmark the chunked parallel copy engine of clusterlib.')
+    parser_obj.add_argument('--dir', dest='dirP_str_lst', action='append',
+                            help='A directory to benchmark; can be repeated. Default: the temporary directory '
+                                 + 'and /dev/shm.')
+    parser_obj.add_argument('--size-MB', dest='size_MB_int', type=int, default=1024)
+    parser_obj.add_argument('--chunk-MB', dest='chunk_MB_int_lst', type=int, action='append')
+    parser_obj.add_argument('--threads', dest='nr_threads_int_lst', type=int, action='append')
+    parser_obj.add_argument('--repeat', dest='repeat_int', type=int, default=3)
+    args_obj = parser_obj.parse_args(arg_str_lst)
+
+    dirP_str_lst = args_obj.dirP_str_lst
+    if dirP_str_lst is None:
+        dirP_str_lst = _get_default_dirP_str_lst()
+
+    sys.stdout.write('{:<24s} {:<12s} {:>9s} {:>8s} {:>10s} {:>10s}\n'.format('directory', 'method', 'chunk MB',
+                                                                             'threads', 'seconds', 'MB/s'))
+    for dirP_str in dirP_str_lst:
+        for result_dct in benchmark_copy(dirP_str,
+                                         size_MB_int=args_obj.size_MB_int,
+                                         chunk_MB_int_lst=args_obj.chunk_MB_int_lst,
+                                         nr_threads_int_lst=args_obj.nr_threads_int_lst,
+                                         repeat_int=args_obj.repeat_int):
+            sys.stdout.write('{:<24s} {:<12s} {:>9s} {:>8s} {:>10.3f} {:>10.1f}\n'.format(
+                result_dct['dirP_str'],
+                result_dct['method_str'],
+                str(result_dct['chunk_MB_int'] or '-'),
+                str(result_dct['nr_threads_int'] or '-'),
+                result_dct['duration_sec_flt'],
+                result_dct['throughput_MBps_flt']))
+
+
+if __name__ == '__main__':
+    main()
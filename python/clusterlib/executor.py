@@ -1,44 +1,139 @@
 import os
+import re
 import stat
-import copy
+import heapq
+import pickle
+import logging
+import tempfile
 import yaml
 import inspect
 import secrets
-import importlib
 import clusterlib.file as Tfile
+import clusterlib.runtime as runtime
 import clusterlib.makeflow as makeflow
+from array import array
 from clusterlib.utilities import flatten_list_dict
-from typing import Callable, Dict, List, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Tuple, Union
 
 
+log_obj = logging.getLogger(__name__)
+
 HASH_STRING_LENGTH_INT = 32
+DEFAULT_STAGE_RUNTIME_SEC_FLT = 1.0
+# The argument of the wrapper scripts that only unpacks the packages; refer to the templates in clusterlib/templates
+PRESTAGE_ARG_STR = '--prestage'
+PRESTAGE_CATEGORY_NAME_STR = 'prestage'
+DEFAULT_PRESTAGE_CORES_INT = 1
+DEFAULT_PRESTAGE_MEM_MB_INT = 1024
+WALL_CLOCK_RE_OBJ = re.compile(r'\s*Elapsed \(wall clock\) time \(h:mm:ss or m:ss\):\s*(?P<elapsed>[0-9:.]+)')
 
 
 class StageFile:
-    def __init__(self, fileP_str: str):
+    __slots__ = ('fileP_str', 'tfile_kwargs_dct')
+
+    def __init__(self, fileP_str: str, tfile_kwargs_dct: dict = None):
+        """
+
+        Parameters
+        ----------
+        fileP_str: str
+            The file path.
+        tfile_kwargs_dct: dict
+            Extra keyword arguments of the `clusterlib.file` TFile object that stages the file when the stage is
+            executed; optional."""
+
         self.fileP_str = fileP_str
+        self.tfile_kwargs_dct = tfile_kwargs_dct
 
     def __str__(self):
         raise NotImplementedError()
 
 
 class StageInputFile(StageFile):
-    def __init__(self, fileP_str: str):
-        super(StageInputFile, self).__init__(fileP_str)
+    __slots__ = ()
+
+    def __init__(self, fileP_str: str, strategy_str: str = None, access_str: str = None,
+                 archive_str: str = None, tfile_kwargs_dct: dict = None):
+        """
+
+        Parameters
+        ----------
+        fileP_str: str
+            The file path.
+        strategy_str: str
+            How the file is staged: 'copy', 'direct' or 'auto'; refer to `clusterlib.file.TFileFrom`. The stage
+            function gets the file path, so a file is never memory mapped for it; the 'mmap' strategy only applies
+            to the direct use of `clusterlib.file.TFileFrom`, and 'auto' chooses 'direct' instead.
+        access_str: str
+            The declared access pattern of the file: 'full', 'partial' or 'random'; refer to
+            `clusterlib.file.TFileFrom`.
+        archive_str: str
+            Either 'tar' or 'tar.gz' if the file is a directory archive, which is extracted to a local directory;
+            refer to `StageOutputFile`. The archive type of the output file of an input stage is set by `Stage`.
+        tfile_kwargs_dct: dict
+            Extra keyword arguments of the `clusterlib.file.TFileFrom` object; optional."""
+
+        if strategy_str == 'mmap':
+            err_str = 'The "mmap" strategy is not supported for the input file of a stage, since the stage ' \
+                + 'function only gets the file path; use "direct" instead.'
+            raise ValueError(err_str)
+
+        for key_str, value_obj in (('strategy_str', strategy_str), ('access_str', access_str),
+                                   ('archive_str', archive_str)):
+            if value_obj is not None:
+                tfile_kwargs_dct = dict() if tfile_kwargs_dct is None else dict(tfile_kwargs_dct)
+                tfile_kwargs_dct[key_str] = value_obj
+
+        super(StageInputFile, self).__init__(fileP_str, tfile_kwargs_dct)
 
     def __str__(self):
         return self.fileP_str
 
 
 class StageOutputFile(StageFile):
-    def __init__(self, fileP_str: str):
-        super(StageOutputFile, self).__init__(fileP_str)
+    __slots__ = ()
+
+    def __init__(self, fileP_str: str, archive_str: str = None, tfile_kwargs_dct: dict = None):
+        """
+
+        Parameters
+        ----------
+        fileP_str: str
+            The file path.
+        archive_str: str
+            If either 'tar' or 'tar.gz' and the stage function creates a directory at the local path, the directory
+            is stored at `fileP_str` as a single archive file, which is extracted again when it is the input
+            of another stage; refer to `clusterlib.file.write_dir_archive`. The archive type is recorded with
+            the input files of the stages that depend on this stage, instead of detected from the file.
+        tfile_kwargs_dct: dict
+            Extra keyword arguments of the `clusterlib.file.TFileTo` object; optional."""
+
+        if archive_str is not None:
+            tfile_kwargs_dct = dict() if tfile_kwargs_dct is None else dict(tfile_kwargs_dct)
+            tfile_kwargs_dct['archive_str'] = archive_str
+
+        super(StageOutputFile, self).__init__(fileP_str, tfile_kwargs_dct)
 
     def __str__(self):
         return self.fileP_str
 
 
+def _iter_stage_files(parm_obj) -> Iterator[StageFile]:
+    """Iterate over the StageFile objects in a (nested) list, tuple or dictionary of parameters."""
+
+    if isinstance(parm_obj, StageFile) is True:
+        yield parm_obj
+    elif (isinstance(parm_obj, list) is True) or (isinstance(parm_obj, tuple) is True):
+        for _parm_obj in parm_obj:
+            yield from _iter_stage_files(_parm_obj)
+    elif isinstance(parm_obj, dict) is True:
+        for _parm_obj in parm_obj.values():
+            yield from _iter_stage_files(_parm_obj)
+
+
 class StageAbstract:
+    __slots__ = ('name_str',)
+
     def __init__(self, name_str: str):
         self.name_str = name_str
 
@@ -79,9 +174,12 @@ StageAbstractCollection_type = Union[
 class Stage(StageAbstract):
     """Execution stage."""
 
+    __slots__ = ('py_func', 'input_parm_obj_dct', 'output_file_dct', 'log_fileN_str', 'nr_cores_int', 'mem_MB_int')
+
     def __init__(self,
                  input_stage_obj: StageAbstractCollection_type,
-                 graph_stage_dct: Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]],
+                 graph_stage_dct: Union[Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]],
+                                        'StageGraph'],
                  name_str: str,
                  py_func: Callable,
                  input_parm_obj_dct: Dict[str, Union[int, float, str, StageFile, List[StageFile]]],
@@ -95,7 +193,7 @@ class Stage(StageAbstract):
         ---------
         input_stage_obj: StageAbstractCollection_type
             The previous stage object or objects.
-        graph_stage_dct: dict of StageAbstract
+        graph_stage_dct: dict of StageAbstract or StageGraph
             This dictionary keeps track of the stage graph.
         name_str: str
             The name of this stage.
@@ -152,10 +250,39 @@ class Stage(StageAbstract):
             else:
                 raise NotImplementedError()
 
-            graph_stage_dct[name_str] = (self, input_stage_obj)
+        # The stage is complete before it is added to the graph, since a spilling graph pickles it when it is added
+        self._set_input_archive_str(input_stage_obj)
 
+        graph_stage_dct[name_str] = (self, input_stage_obj)
+
+    def _set_input_archive_str(self, input_stage_obj: StageAbstractCollection_type):
+        """Record the archive type of the archived output files of the input stages with the input files of this
+        stage that have the same file path, so that they are extracted without detecting the archive type."""
+
+        if isinstance(input_stage_obj, StageAbstract) is True:
+            input_stage_obj_lst = [input_stage_obj]
+        elif isinstance(input_stage_obj, dict) is True:
+            input_stage_obj_lst = list(input_stage_obj.values())
+        elif input_stage_obj is None:
+            input_stage_obj_lst = []
         else:
-            graph_stage_dct[name_str] = (self, None)
+            input_stage_obj_lst = list(input_stage_obj)
+
+        archive_str_dct = dict()
+        for _input_stage_obj in input_stage_obj_lst:
+            for output_obj in _iter_stage_files([getattr(_input_stage_obj, 'input_parm_obj_dct', None),
+                                                 getattr(_input_stage_obj, 'output_file_dct', None)]):
+                if (isinstance(output_obj, StageOutputFile) is True) and (output_obj.tfile_kwargs_dct is not None) \
+                        and ('archive_str' in output_obj.tfile_kwargs_dct):
+                    archive_str_dct[str(output_obj)] = output_obj.tfile_kwargs_dct['archive_str']
+
+        for input_obj in _iter_stage_files(self.input_parm_obj_dct):
+            if (isinstance(input_obj, StageInputFile) is False) or (str(input_obj) not in archive_str_dct):
+                continue
+
+            tfile_kwargs_dct = dict() if input_obj.tfile_kwargs_dct is None else dict(input_obj.tfile_kwargs_dct)
+            tfile_kwargs_dct.setdefault('archive_str', archive_str_dct[str(input_obj)])
+            input_obj.tfile_kwargs_dct = tfile_kwargs_dct
 
     def crt_makeflow_rule(self,
                           parm_dirP_fileP_str: str,
@@ -195,7 +322,8 @@ class Stage(StageAbstract):
             'function': self.py_func.__name__,
             'function_kwargs': dict(),
             'input_fileP_str_dct': dict(),
-            'output_fileP_str_dct': dict()
+            'output_fileP_str_dct': dict(),
+            'tfile_kwargs_dct': dict()
         }
 
         def transform_StageFile_objects(input_name_str, input_obj):
@@ -203,6 +331,9 @@ class Stage(StageAbstract):
             _input_fileP_str_obj = None
             _output_fileP_str_obj = None
 
+            if (isinstance(input_obj, StageFile) is True) and (input_obj.tfile_kwargs_dct is not None):
+                parm_dct['tfile_kwargs_dct'][str(input_obj)] = dict(input_obj.tfile_kwargs_dct)
+
             if isinstance(input_obj, StageInputFile) is True:
                 _output_obj = str(input_obj)
                 _input_fileP_str_obj = str(input_obj)
@@ -273,8 +404,9 @@ class Stage(StageAbstract):
             if output_fileP_str_obj is not None:
                 parm_dct['output_fileP_str_dct'][input_parm_name_str] = output_fileP_str_obj
 
-        # Write out the parameter yaml file
-        with Tfile.TFileTo(fileP_str=parm_fileP_str) as tfile_obj:
+        # Write out the parameter yaml file; it has to exist before the makeflow file is submitted, so it is never
+        # written behind
+        with Tfile.TFileTo(fileP_str=parm_fileP_str, write_behind_bl=False) as tfile_obj:
             with open(tfile_obj.local_fileP_str, 'w') as file_obj:
                 yaml.dump(parm_dct, stream=file_obj)
 
@@ -285,9 +417,8 @@ class Stage(StageAbstract):
 
         # Create the python wrapper script
         with open(py_caller_script_fileP_str, 'w') as file_obj:
-            file_obj.write('import sys\n')
-            file_obj.write('import clusterlib.executor as executor\n')
-            file_obj.write('executor.Stage.execute(sys.argv[1])\n')
+            file_obj.write('import clusterlib.runtime as runtime\n')
+            file_obj.write('runtime.main()\n')
 
         # Create the command string
         cmd_str = f'/bin/bash {wrapper_bash_scrpt_fileP_str} {py_caller_script_fileP_str}' \
@@ -324,75 +455,480 @@ class Stage(StageAbstract):
 
     @staticmethod
     def execute(parm_fileP_str: str):
-        # Load the yaml parameter config file
-        param_dct = None
-        with Tfile.TFileFrom(fileP_str=parm_fileP_str) as tfile_obj:
-            with open(tfile_obj.local_fileP_str, 'r') as file_obj:
-                param_dct = yaml.load(stream=file_obj, Loader=yaml.FullLoader)
+        """Execute the stage; refer to `clusterlib.runtime.execute_stage`."""
 
-        # Load the appropriate module
-        module_obj = importlib.import_module(param_dct['module_path'])
+        runtime.execute_stage(parm_fileP_str)
 
-        # Get the function object
-        func_obj = getattr(module_obj, param_dct['function'])
 
-        # Create the yaml parameter config file that has the local file paths
-        local_kwargs_param_dct = copy.deepcopy(param_dct['function_kwargs'])
+def get_input_stage_name_lst(input_stage_obj: StageAbstractCollection_type) -> List[str]:
+    """Get the names of the input stages of a stage graph entry.
 
-        def tfile_from_flatten_list_dict(_itr_obj):
-            _tfile_obj_lst = []
+    Parameters
+    ----------
+    input_stage_obj: StageAbstractCollection_type
+        The previous stage object or objects.
 
-            if isinstance(_itr_obj, dict) is True:
-                _rtn_itr_obj = dict()
-                for _key_str, _value_obj in _itr_obj.items():
-                    _new_value_obj, __tfile_obj_lst = \
-                        tfile_from_flatten_list_dict(_value_obj)
+    Returns
+    -------
+    list of str:
+        The names of the input stages."""
 
-                    _rtn_itr_obj[_key_str] = _new_value_obj
-                    _tfile_obj_lst += __tfile_obj_lst
+    if input_stage_obj is None:
+        return []
 
-                return _rtn_itr_obj, _tfile_obj_lst
+    elif isinstance(input_stage_obj, StageAbstract) is True:
+        return [input_stage_obj.name_str]
 
-            elif isinstance(_itr_obj, list) is True:
-                _rtn_itr_obj = list()
-                for __itr_obj in _itr_obj:
-                    _new_itr_obj, __tfile_obj_lst = \
-                        tfile_from_flatten_list_dict(__itr_obj)
+    elif isinstance(input_stage_obj, dict) is True:
+        return [_input_stage_obj.name_str for _input_stage_obj in input_stage_obj.values()]
 
-                    _rtn_itr_obj.append(_new_itr_obj)
-                    _tfile_obj_lst += __tfile_obj_lst
+    elif (isinstance(input_stage_obj, list) is True) or (isinstance(input_stage_obj, tuple) is True):
+        return [_input_stage_obj.name_str for _input_stage_obj in input_stage_obj]
 
-                return _rtn_itr_obj, _tfile_obj_lst
+    else:
+        raise NotImplementedError()
 
-            elif isinstance(_itr_obj, str) is True:
-                _tfile_obj = Tfile.TFileFrom(fileP_str=_itr_obj)
 
-                _tfile_obj_lst = [_tfile_obj]
-                _rtn_itr_obj = _tfile_obj.local_fileP_str
+def read_stage_runtimes(graph_stage_dct: Union[Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]],
+                                               'StageGraph']) -> Dict[str, float]:
+    """Read the historical wall clock runtimes of the stages from their log files; the wrapper scripts execute
+    python with `/usr/bin/time -v`, which writes the elapsed wall clock time to the log file.
+
+    Parameters
+    ----------
+    graph_stage_dct: Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]] or StageGraph
+        The graph of the stages.
+
+    Returns
+    -------
+    dict of float:
+        The runtime in seconds of each stage for which the log file had a runtime."""
+
+    runtime_sec_dct = dict()
+    for name_str in graph_stage_dct:
+        stage_obj = get_graph_stage(graph_stage_dct, name_str)
+        log_fileN_str = getattr(stage_obj, 'log_fileN_str', None)
+        if (log_fileN_str is None) or (os.path.isfile(log_fileN_str) is False):
+            continue
+
+        with open(log_fileN_str, 'r', errors='replace') as file_obj:
+            for line_str in file_obj:
+                match_obj = WALL_CLOCK_RE_OBJ.match(line_str)
+                if match_obj is not None:
+                    runtime_sec_flt = 0.0
+                    for part_str in match_obj.group('elapsed').split(':'):
+                        runtime_sec_flt = 60.0 * runtime_sec_flt + float(part_str)
+                    runtime_sec_dct[name_str] = runtime_sec_flt
+
+    return runtime_sec_dct
+
+
+def read_io_summaries(graph_stage_dct: Union[Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]],
+                                             'StageGraph'],
+                      top_int: int = 10) -> dict:
+    """Read and aggregate the I/O summaries of the TFile operations that the stages wrote to their log files, e.g.
+    to find slow mount points and oversized intermediate files.
+
+    Parameters
+    ----------
+    graph_stage_dct: Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]] or StageGraph
+        The graph of the stages.
+    top_int: int
+        The number of largest transfers that are kept.
+
+    Returns
+    -------
+    dict:
+        The aggregated summary; refer to `clusterlib.file.aggregate_io_summaries`."""
+
+    summary_dct_lst = []
+    for name_str in graph_stage_dct:
+        stage_obj = get_graph_stage(graph_stage_dct, name_str)
+        log_fileN_str = getattr(stage_obj, 'log_fileN_str', None)
+        if (log_fileN_str is None) or (os.path.isfile(log_fileN_str) is False):
+            continue
+
+        summary_dct = Tfile.read_io_summary(log_fileN_str)
+        if summary_dct is not None:
+            summary_dct_lst.append(summary_dct)
+
+    return Tfile.aggregate_io_summaries(summary_dct_lst, top_int=top_int)
+
+
+def predict_makespan(order_key_lst: list,
+                     input_key_lst_dct: dict,
+                     runtime_sec_dct: dict,
+                     nr_workers_int: int = None) -> float:
+    """Predict the makespan of a stage graph for a dispatcher that starts the ready stages in the given order.
+
+    Parameters
+    ----------
+    order_key_lst: list
+        The stage keys in the order in which the rules are emitted; has to be a topological order.
+    input_key_lst_dct: dict
+        The input stage keys of each stage key.
+    runtime_sec_dct: dict
+        The runtime in seconds of each stage key.
+    nr_workers_int: int
+        The number of stages that can be executed concurrently; if None, then there is no limit.
+
+    Returns
+    -------
+    float:
+        The predicted makespan in seconds."""
+
+    position_dct = {key_obj: idx for idx, key_obj in enumerate(order_key_lst)}
+    remaining_int_dct = {key_obj: len(input_key_lst_dct[key_obj]) for key_obj in order_key_lst}
+    output_key_lst_dct = {key_obj: [] for key_obj in order_key_lst}
+    for key_obj in order_key_lst:
+        for input_key_obj in input_key_lst_dct[key_obj]:
+            output_key_lst_dct[input_key_obj].append(key_obj)
+
+    ready_tpl_lst = [(position_dct[key_obj], key_obj) for key_obj in order_key_lst if remaining_int_dct[key_obj] == 0]
+    heapq.heapify(ready_tpl_lst)
+    running_tpl_lst = []
+    time_sec_flt = 0.0
+
+    while True:
+        while (len(ready_tpl_lst) > 0) and ((nr_workers_int is None) or (len(running_tpl_lst) < nr_workers_int)):
+            position_int, key_obj = heapq.heappop(ready_tpl_lst)
+            heapq.heappush(running_tpl_lst, (time_sec_flt + runtime_sec_dct[key_obj], position_int, key_obj))
+
+        if len(running_tpl_lst) == 0:
+            break
+
+        time_sec_flt, _, key_obj = heapq.heappop(running_tpl_lst)
+        for output_key_obj in output_key_lst_dct[key_obj]:
+            remaining_int_dct[output_key_obj] -= 1
+            if remaining_int_dct[output_key_obj] == 0:
+                heapq.heappush(ready_tpl_lst, (position_dct[output_key_obj], output_key_obj))
+
+    return time_sec_flt
+
+
+def order_by_critical_path(order_key_lst: list,
+                           input_key_lst_dct: dict,
+                           runtime_sec_dct: dict) -> Tuple[list, dict]:
+    """Order the stages longest-remaining-path first; i.e. by the runtime of the longest chain of stages from
+    the stage to the end of the graph, including the stage itself.
+
+    Parameters
+    ----------
+    order_key_lst: list
+        The stage keys in a topological order.
+    input_key_lst_dct: dict
+        The input stage keys of each stage key.
+    runtime_sec_dct: dict
+        The runtime in seconds of each stage key; the runtimes cannot be negative.
+
+    Returns
+    -------
+    list:
+        The reordered stage keys; this is still a topological order.
+    dict of float:
+        The longest remaining path in seconds of each stage key."""
+
+    output_key_lst_dct = {key_obj: [] for key_obj in order_key_lst}
+    for key_obj in order_key_lst:
+        for input_key_obj in input_key_lst_dct[key_obj]:
+            output_key_lst_dct[input_key_obj].append(key_obj)
+
+    # Walk the graph in reverse topological order so that all descendants are done first
+    remaining_path_sec_dct = dict()
+    for key_obj in reversed(order_key_lst):
+        max_output_sec_flt = 0.0
+        for output_key_obj in output_key_lst_dct[key_obj]:
+            max_output_sec_flt = max(max_output_sec_flt, remaining_path_sec_dct[output_key_obj])
+        remaining_path_sec_dct[key_obj] = runtime_sec_dct[key_obj] + max_output_sec_flt
+
+    # Ties are broken by the original order, which keeps the order topological for zero runtimes
+    position_dct = {key_obj: idx for idx, key_obj in enumerate(order_key_lst)}
+    crit_order_key_lst = sorted(order_key_lst, key=lambda _key_obj: (-remaining_path_sec_dct[_key_obj],
+                                                                     position_dct[_key_obj]))
+
+    return crit_order_key_lst, remaining_path_sec_dct
+
+
+class StageGraph:
+    """Compact stage graph for very large numbers of stages. The stages have integer node IDs, in the order in
+    which they were added, and the input edges are kept in append-only arrays in compressed sparse row format;
+    the output edges are derived from the input edges when they are needed. The stage objects can optionally be
+    pickled to a file in a spill directory, so that only their file offsets are kept in memory.
+
+    The graph can be used in place of the dictionary `graph_stage_dct` of `Stage` and `MakeflowFromStages`."""
+
+    def __init__(self, spill_dirP_str: str = None):
+        """
 
-                return _rtn_itr_obj, _tfile_obj_lst
+        Parameters
+        ----------
+        spill_dirP_str: str
+            If set, the stage objects are pickled to a temporary file in this directory instead of being kept
+            in memory; optional.
+        """
 
-            else:
-                err_str = 'The given object has to be either a str, lst or dict.'
+        self.name_str_lst: List[str] = []
+        self._id_dct: Dict[str, int] = dict()
+
+        # Input edges in compressed sparse row format; the inputs of node i are
+        # self._input_id_arr[self._input_offset_arr[i]:self._input_offset_arr[i + 1]]
+        self._input_id_arr = array('q')
+        self._input_offset_arr = array('q', [0])
+
+        # The output edges are created from the input edges when they are needed
+        self._output_id_arr = None
+        self._output_offset_arr = None
+
+        if spill_dirP_str is None:
+            self._stage_obj_lst = []
+            self._spill_file_obj = None
+            self._spill_offset_arr = None
+        else:
+            os.makedirs(spill_dirP_str, exist_ok=True)
+            self._stage_obj_lst = None
+            self._spill_file_obj = tempfile.TemporaryFile(dir=spill_dirP_str)
+            self._spill_offset_arr = array('q')
+            self._spill_end_int = 0
+            self._spill_read_bl = False
+
+    def __len__(self):
+        return len(self.name_str_lst)
+
+    def __contains__(self, name_str: str):
+        return name_str in self._id_dct
+
+    def __iter__(self):
+        return iter(self.name_str_lst)
+
+    def keys(self):
+        return iter(self.name_str_lst)
+
+    def add_stage(self, stage_obj: StageAbstract, input_stage_obj: StageAbstractCollection_type = None) -> int:
+        """Add a stage to the graph.
+
+        Parameters
+        ----------
+        stage_obj: StageAbstract
+            The stage object.
+        input_stage_obj: StageAbstractCollection_type
+            The previous stage object or objects, which have to be present in the graph.
+
+        Returns
+        -------
+        int:
+            The node ID of the stage."""
+
+        name_str = stage_obj.name_str
+        if name_str in self._id_dct:
+            err_str = f'A stage with name "{name_str}" already exists in the graph.'
+            raise ValueError(err_str)
+
+        input_id_lst = []
+        for input_name_str in get_input_stage_name_lst(input_stage_obj):
+            if input_name_str not in self._id_dct:
+                err_str = f'The stage with name "{input_name_str}" does not exists in the graph.'
                 raise ValueError(err_str)
+            input_id_lst.append(self._id_dct[input_name_str])
+
+        node_id = len(self.name_str_lst)
+        self.name_str_lst.append(name_str)
+        self._id_dct[name_str] = node_id
+        self._input_id_arr.extend(input_id_lst)
+        self._input_offset_arr.append(len(self._input_id_arr))
+        self._output_id_arr = None
+        self._output_offset_arr = None
+
+        if self._spill_file_obj is None:
+            self._stage_obj_lst.append(stage_obj)
+        else:
+            # Only seek when a stage has been loaded in between, since seeking flushes the write buffer
+            if self._spill_read_bl is True:
+                self._spill_file_obj.seek(self._spill_end_int)
+                self._spill_read_bl = False
+
+            stage_bytes = pickle.dumps(stage_obj, protocol=pickle.HIGHEST_PROTOCOL)
+            self._spill_file_obj.write(stage_bytes)
+            self._spill_offset_arr.append(self._spill_end_int)
+            self._spill_end_int += len(stage_bytes)
+
+        return node_id
+
+    def __setitem__(self, name_str: str, stage_input_tpl: Tuple[StageAbstract, StageAbstractCollection_type]):
+        stage_obj, input_stage_obj = stage_input_tpl
+        if stage_obj.name_str != name_str:
+            err_str = f'The stage name "{stage_obj.name_str}" does not match the key "{name_str}".'
+            raise ValueError(err_str)
+
+        self.add_stage(stage_obj, input_stage_obj)
+
+    def __getitem__(self, name_str: str) -> Tuple[StageAbstract, Union[List[StageAbstract], None]]:
+        node_id = self._id_dct[name_str]
+        input_id_lst = self.get_input_id_lst(node_id)
+        if len(input_id_lst) == 0:
+            return self.get_stage(node_id), None
+
+        return self.get_stage(node_id), [self.get_stage(input_id) for input_id in input_id_lst]
+
+    def items(self):
+        for name_str in self.name_str_lst:
+            yield name_str, self[name_str]
+
+    def values(self):
+        for name_str in self.name_str_lst:
+            yield self[name_str]
+
+    def get_id(self, name_str: str) -> int:
+        return self._id_dct[name_str]
+
+    def get_name(self, node_id: int) -> str:
+        return self.name_str_lst[node_id]
+
+    def get_stage(self, node_id: int) -> StageAbstract:
+        """Get the stage object of a node; a spilled stage is loaded from the spill file."""
+
+        if self._spill_file_obj is None:
+            return self._stage_obj_lst[node_id]
+
+        self._spill_read_bl = True
+        self._spill_file_obj.seek(self._spill_offset_arr[node_id])
+
+        return pickle.load(self._spill_file_obj)
+
+    def get_input_id_lst(self, node_id: int) -> array:
+        return self._input_id_arr[self._input_offset_arr[node_id]:self._input_offset_arr[node_id + 1]]
+
+    def get_output_id_lst(self, node_id: int) -> array:
+        self._build_output_arr()
+
+        return self._output_id_arr[self._output_offset_arr[node_id]:self._output_offset_arr[node_id + 1]]
+
+    def _build_output_arr(self):
+        """Create the output edges from the input edges with a counting sort."""
+
+        if self._output_id_arr is not None:
+            return
+
+        nr_nodes_int = len(self.name_str_lst)
+        output_offset_arr = array('q', bytes(8 * (nr_nodes_int + 1)))
+        for input_id in self._input_id_arr:
+            output_offset_arr[input_id + 1] += 1
+        for node_id in range(nr_nodes_int):
+            output_offset_arr[node_id + 1] += output_offset_arr[node_id]
+
+        output_id_arr = array('q', bytes(8 * len(self._input_id_arr)))
+        position_arr = array('q', output_offset_arr[:-1])
+        for node_id in range(nr_nodes_int):
+            for input_id in self._input_id_arr[self._input_offset_arr[node_id]:self._input_offset_arr[node_id + 1]]:
+                output_id_arr[position_arr[input_id]] = node_id
+                position_arr[input_id] += 1
 
-        input_fileP_str_dct, in_tfile_obj_lst = tfile_from_flatten_list_dict(param_dct['input_fileP_str_dct'])
-        for key_str, value_obj in input_fileP_str_dct.items():
-            local_kwargs_param_dct[key_str] = value_obj
+        self._output_id_arr = output_id_arr
+        self._output_offset_arr = output_offset_arr
 
-        # Create a list of transcended output files
-        out_tfile_obj_lst = []
-        for name_str, output_fileP_str in param_dct['output_fileP_str_dct'].items():
-            tfile_obj = Tfile.TFileTo(fileP_str=output_fileP_str)
-            out_tfile_obj_lst.append(tfile_obj)
+    def topological_order(self) -> array:
+        """Sort the node IDs topologically with Kahn's algorithm in O(V+E).
 
-            if name_str in local_kwargs_param_dct:
-                local_kwargs_param_dct[name_str] = tfile_obj.local_fileP_str
+        Raises
+        ------
+        ValueError:
+            If the graph has a cycle."""
 
-        # Call the function
-        with Tfile.TFileCollection(in_tfile_obj_lst):
-            with Tfile.TFileCollection(out_tfile_obj_lst):
-                func_obj(**local_kwargs_param_dct)
+        self._build_output_arr()
+
+        nr_nodes_int = len(self.name_str_lst)
+        remaining_arr = array('q', [self._input_offset_arr[node_id + 1] - self._input_offset_arr[node_id]
+                                    for node_id in range(nr_nodes_int)])
+        order_id_arr = array('q', [node_id for node_id in range(nr_nodes_int) if remaining_arr[node_id] == 0])
+
+        idx = 0
+        while idx < len(order_id_arr):
+            node_id = order_id_arr[idx]
+            for output_id in self._output_id_arr[self._output_offset_arr[node_id]:
+                                                 self._output_offset_arr[node_id + 1]]:
+                remaining_arr[output_id] -= 1
+                if remaining_arr[output_id] == 0:
+                    order_id_arr.append(output_id)
+            idx += 1
+
+        if len(order_id_arr) != nr_nodes_int:
+            err_str = f'The stage graph has a cycle: {[self.name_str_lst[_id] for _id in self.find_cycle()]}.'
+            raise ValueError(err_str)
+
+        return order_id_arr
+
+    def find_cycle(self) -> Union[List[int], None]:
+        """Find a cycle with an iterative depth first search in O(V+E).
+
+        Returns
+        -------
+        list of int:
+            The node IDs of the cycle, or None if the graph has no cycle."""
+
+        self._build_output_arr()
+
+        # 0: not visited, 1: on the stack, 2: done
+        state_arr = bytearray(len(self.name_str_lst))
+        for start_id in range(len(self.name_str_lst)):
+            if state_arr[start_id] != 0:
+                continue
+
+            stack_tpl_lst = [(start_id, self._output_offset_arr[start_id])]
+            state_arr[start_id] = 1
+            while len(stack_tpl_lst) > 0:
+                node_id, position_int = stack_tpl_lst[-1]
+                if position_int == self._output_offset_arr[node_id + 1]:
+                    state_arr[node_id] = 2
+                    stack_tpl_lst.pop()
+                    continue
+
+                stack_tpl_lst[-1] = (node_id, position_int + 1)
+                output_id = self._output_id_arr[position_int]
+                if state_arr[output_id] == 1:
+                    cycle_id_lst = [_node_id for _node_id, _ in stack_tpl_lst]
+                    return cycle_id_lst[cycle_id_lst.index(output_id):]
+
+                if state_arr[output_id] == 0:
+                    state_arr[output_id] = 1
+                    stack_tpl_lst.append((output_id, self._output_offset_arr[output_id]))
+
+        return None
+
+    def get_descendant_id_lst(self, node_id: int) -> List[int]:
+        """Get the node IDs of all the stages that directly or indirectly depend on a stage, in O(V+E)."""
+
+        self._build_output_arr()
+
+        visited_arr = bytearray(len(self.name_str_lst))
+        visited_arr[node_id] = 1
+        descendant_id_lst = []
+        stack_id_lst = [node_id]
+        while len(stack_id_lst) > 0:
+            _node_id = stack_id_lst.pop()
+            for output_id in self._output_id_arr[self._output_offset_arr[_node_id]:
+                                                 self._output_offset_arr[_node_id + 1]]:
+                if visited_arr[output_id] == 0:
+                    visited_arr[output_id] = 1
+                    descendant_id_lst.append(output_id)
+                    stack_id_lst.append(output_id)
+
+        return descendant_id_lst
+
+    def close(self):
+        """Remove the spill file, if any."""
+
+        if self._spill_file_obj is not None:
+            self._spill_file_obj.close()
+
+
+def get_graph_stage(graph_stage_dct: Union[Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]], StageGraph],
+                    name_str: str) -> StageAbstract:
+    """Get a stage object by name from either a stage graph dictionary or a StageGraph; for a StageGraph the
+    input stages are not loaded."""
+
+    if isinstance(graph_stage_dct, StageGraph) is True:
+        return graph_stage_dct.get_stage(graph_stage_dct.get_id(name_str))
+
+    return graph_stage_dct[name_str][0]
 
 
 class MakeflowFromStages:
@@ -401,7 +937,7 @@ class MakeflowFromStages:
     def __init__(self,
                  parm_dirP_str: str,
                  wrapper_bash_scrpt_fileP_str: str,
-                 graph_stage_dct: Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]],
+                 graph_stage_dct: Union[Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]], StageGraph],
                  makeflow_out_fileP_str: str,
                  py_caller_script_fileP_str: str,
                  cat_obj: Union[makeflow.Category, None] = None,
@@ -414,7 +950,7 @@ class MakeflowFromStages:
             The parameter directory path of where to archive the parameter YAML files for the stage execution.
         wrapper_bash_scrpt_fileP_str: str
             The iris bash wrapper script executable for the python script.
-        graph_stage_dct: Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]]
+        graph_stage_dct: Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]] or StageGraph
             The graph of the stages.
         makeflow_out_fileP_str: str
             The output file path of the makeflow file.
@@ -455,14 +991,312 @@ class MakeflowFromStages:
         self.py_caller_script_fileP_str_lst.extend(makeflow_stages_obj.py_caller_script_fileP_str_lst)
         self.yaml_cfg_dct_lst.extend(makeflow_stages_obj.yaml_cfg_dct_lst)
 
-    def create(self, makeflow_out_fileP_str: str = None):
+    def create(self,
+               makeflow_out_fileP_str: str = None,
+               critical_path_bl: bool = False,
+               runtime_sec_dct: Dict[str, float] = None,
+               nr_workers_int: int = None,
+               priority_hints_bl: bool = False,
+               nr_prestage_int: int = 0,
+               prestage_cat_obj: makeflow.Category = None) -> Union[dict, None]:
         """Create the Makeflow JX file.
 
         Parameters
         ----------
         makeflow_out_fileP_str: str
-            The output file path of the makeflow file."""
+            The output file path of the makeflow file.
+        critical_path_bl: bool
+            If True, the rules are emitted longest-remaining-path first instead of in the insertion order
+            of the stage graphs.
+        runtime_sec_dct: dict of float
+            The estimated or historical runtime in seconds of the stages by stage name, which is used to
+            weight the stages. If None, the historical runtimes are read from the log files of the stages;
+            refer to `read_stage_runtimes`. Stages that are not present are weighted with the mean of the
+            given runtimes.
+        nr_workers_int: int
+            The number of stages that can be executed concurrently, which is used to predict the makespan;
+            if None, then there is no limit.
+        priority_hints_bl: bool
+            If True and if `critical_path_bl` is True, then a priority is also set for each makeflow rule. Every
+            rule gets a different priority, so priority hints and the collapsing of homogeneous rules into rules
+            with a range (`makeflow.JxMakeflow`) are mutually exclusive; the makeflow file then has a rule for
+            every stage.
+        nr_prestage_int: int
+            The number of prestage rules per wrapper script. A prestage rule executes the wrapper script with
+            the argument "--prestage", which only unpacks the packages, and the stages without input stages
+            depend on the prestage rules of their wrapper script; so the packages are unpacked on a few nodes
+            before the first wave of stages is dispatched, instead of by every stage of the first wave at once.
+            E.g. set it to the number of nodes. If 0, no prestage rules are created.
+        prestage_cat_obj: makeflow.Category
+            The resources category of the prestage rules; by default the category "prestage" with
+            `DEFAULT_PRESTAGE_CORES_INT` cores and `DEFAULT_PRESTAGE_MEM_MB_INT` MB of memory.
+
+        Returns
+        -------
+        dict:
+            If `critical_path_bl` is True, the predicted makespans in seconds, with the keys
+            "insertion_order_sec", "critical_path_sec" and "critical_path_length_sec"."""
+
+        makeflow_out_fileP_str = self._get_makeflow_out_fileP(makeflow_out_fileP_str)
+
+        # Create the makeflow JX file creator
+        makeflow_jx_creator_obj = makeflow.JxMakeflow()
+        for cat_obj in self.cat_obj_lst:
+            makeflow_jx_creator_obj.add_category(cat_obj)
+
+        order_key_lst, input_key_lst_dct, stage_kwargs_tpl_dct = self._collect_stages()
+
+        # The prestage rules come first, so that they are dispatched first
+        prestage_fileP_str_lst_dct = dict()
+        if nr_prestage_int > 0:
+            prestage_rule_obj_lst, prestage_fileP_str_lst_dct = self._crt_prestage_rules(makeflow_out_fileP_str,
+                                                                                         nr_prestage_int,
+                                                                                         prestage_cat_obj)
+            for rule_obj in prestage_rule_obj_lst:
+                makeflow_jx_creator_obj.add_rule(rule_obj)
+
+        elif nr_prestage_int < 0:
+            err_str = f'The number of prestage rules has to be zero or more, but got {nr_prestage_int}.'
+            raise ValueError(err_str)
+
+        makespan_dct = None
+        priority_int_dct = dict()
+        if critical_path_bl is True:
+            if runtime_sec_dct is None:
+                runtime_sec_dct = dict()
+                for graph_stage_dct in self.graph_stage_dct_lst:
+                    runtime_sec_dct.update(read_stage_runtimes(graph_stage_dct))
+
+            if len(runtime_sec_dct) > 0:
+                default_runtime_sec_flt = sum(runtime_sec_dct.values()) / len(runtime_sec_dct)
+            else:
+                default_runtime_sec_flt = DEFAULT_STAGE_RUNTIME_SEC_FLT
+
+            key_runtime_sec_dct = {key_tpl: runtime_sec_dct.get(key_tpl[1], default_runtime_sec_flt)
+                                   for key_tpl in order_key_lst}
+
+            crit_order_key_lst, remaining_path_sec_dct = order_by_critical_path(order_key_lst,
+                                                                                input_key_lst_dct,
+                                                                                key_runtime_sec_dct)
+
+            makespan_dct = {
+                'insertion_order_sec': predict_makespan(order_key_lst, input_key_lst_dct,
+                                                        key_runtime_sec_dct, nr_workers_int),
+                'critical_path_sec': predict_makespan(crit_order_key_lst, input_key_lst_dct,
+                                                      key_runtime_sec_dct, nr_workers_int),
+                'critical_path_length_sec': max(remaining_path_sec_dct.values(), default=0.0)
+            }
+
+            log_str = 'Predicted makespan with {:s} workers: {:.1f} s in insertion order, {:.1f} s in ' \
+                + 'critical path order; the critical path is {:.1f} s'
+            log_obj.info(log_str.format(str(nr_workers_int),
+                                        makespan_dct['insertion_order_sec'],
+                                        makespan_dct['critical_path_sec'],
+                                        makespan_dct['critical_path_length_sec']))
+
+            order_key_lst = crit_order_key_lst
+            if priority_hints_bl is True:
+                log_obj.warning('The rules have priority hints, so they are not collapsed into rules with a range')
+                priority_int_dct = {key_tpl: len(order_key_lst) - idx for idx, key_tpl in enumerate(order_key_lst)}
+
+        # Add the rules to the makeflow JX file creator
+        for key_tpl in order_key_lst:
+            graph_stage_dct, kwargs_dct = stage_kwargs_tpl_dct[key_tpl]
+            rule_obj = get_graph_stage(graph_stage_dct, key_tpl[1]).crt_makeflow_rule(**kwargs_dct)
+            if key_tpl in priority_int_dct:
+                rule_obj.priority_int = priority_int_dct[key_tpl]
+
+            # The other stages depend on the prestage rules through their input stages
+            if (len(input_key_lst_dct[key_tpl]) == 0) and (len(prestage_fileP_str_lst_dct) > 0):
+                rule_obj.input_fileP_str_lst = rule_obj.input_fileP_str_lst \
+                    + prestage_fileP_str_lst_dct[kwargs_dct['wrapper_bash_scrpt_fileP_str']]
+
+            makeflow_jx_creator_obj.add_rule(rule_obj)
+
+        self._write_makeflow(makeflow_jx_creator_obj, makeflow_out_fileP_str)
+
+        return makespan_dct
+
+    def create_sharded(self,
+                       makeflow_out_fileP_str: str = None,
+                       shard_by_str: str = 'graph',
+                       min_shard_stages_int: int = 1) -> List[str]:
+        """Create a top-level Makeflow JX file that executes sub-makeflows, which are the shards of the
+        combined stage graphs, as nested makeflow rules. Each shard has its own makeflow log and bash
+        script that executes the shard, so that it can be restarted independently.
+
+        Parameters
+        ----------
+        makeflow_out_fileP_str: str
+            The output file path of the top-level makeflow file; e.g. for "jar.makeflow" the shards are
+            written to the sibling directory "jar_shards".
+        shard_by_str: str
+            Either "graph", then there is one shard per stage graph (i.e. per pickle jar), or "component",
+            then there is one shard per weakly connected component of the stage graphs.
+        min_shard_stages_int: int
+            For `shard_by_str` equal to "component", consecutive components are combined into a shard until
+            the shard has at least this number of stages.
 
+        Returns
+        -------
+        list of str:
+            The file paths of the shard makeflow files."""
+
+        makeflow_out_fileP_str = self._get_makeflow_out_fileP(makeflow_out_fileP_str)
+
+        order_key_lst, input_key_lst_dct, stage_kwargs_tpl_dct = self._collect_stages()
+
+        # Assign a shard to each stage
+        if shard_by_str == 'graph':
+            shard_idx_dct = {key_tpl: key_tpl[0] for key_tpl in order_key_lst}
+
+        elif shard_by_str == 'component':
+            # Union-find of the stages that are connected by an edge
+            parent_key_dct = {key_tpl: key_tpl for key_tpl in order_key_lst}
+
+            def _find(_key_tpl):
+                while parent_key_dct[_key_tpl] != _key_tpl:
+                    parent_key_dct[_key_tpl] = parent_key_dct[parent_key_dct[_key_tpl]]
+                    _key_tpl = parent_key_dct[_key_tpl]
+
+                return _key_tpl
+
+            for key_tpl in order_key_lst:
+                for input_key_tpl in input_key_lst_dct[key_tpl]:
+                    root_key_tpl = _find(key_tpl)
+                    input_root_key_tpl = _find(input_key_tpl)
+                    if root_key_tpl != input_root_key_tpl:
+                        parent_key_dct[root_key_tpl] = input_root_key_tpl
+
+            # Number the components in the order of their first stage
+            component_idx_dct = dict()
+            component_size_int_lst = []
+            for key_tpl in order_key_lst:
+                root_key_tpl = _find(key_tpl)
+                if root_key_tpl not in component_idx_dct:
+                    component_idx_dct[root_key_tpl] = len(component_size_int_lst)
+                    component_size_int_lst.append(0)
+                component_size_int_lst[component_idx_dct[root_key_tpl]] += 1
+
+            # Combine consecutive components into shards
+            shard_of_component_int_lst = []
+            shard_idx = 0
+            shard_size_int = 0
+            for component_size_int in component_size_int_lst:
+                if shard_size_int >= min_shard_stages_int:
+                    shard_idx += 1
+                    shard_size_int = 0
+                shard_of_component_int_lst.append(shard_idx)
+                shard_size_int += component_size_int
+
+            shard_idx_dct = {key_tpl: shard_of_component_int_lst[component_idx_dct[_find(key_tpl)]]
+                             for key_tpl in order_key_lst}
+
+        else:
+            err_str = f'The shard type "{shard_by_str}" is not supported; use either "graph" or "component".'
+            raise ValueError(err_str)
+
+        # Create the rules of each shard
+        shard_idx_lst = sorted(set(shard_idx_dct.values()))
+        shard_jx_creator_obj_dct = {shard_idx: makeflow.JxMakeflow() for shard_idx in shard_idx_lst}
+        shard_rule_obj_lst_dct = {shard_idx: [] for shard_idx in shard_idx_lst}
+        for key_tpl in order_key_lst:
+            graph_stage_dct, kwargs_dct = stage_kwargs_tpl_dct[key_tpl]
+            rule_obj = get_graph_stage(graph_stage_dct, key_tpl[1]).crt_makeflow_rule(**kwargs_dct)
+
+            shard_jx_creator_obj_dct[shard_idx_dct[key_tpl]].add_rule(rule_obj)
+            shard_rule_obj_lst_dct[shard_idx_dct[key_tpl]].append(rule_obj)
+
+        # Find the files that are passed between the shards
+        producer_shard_idx_dct = dict()
+        for shard_idx, rule_obj_lst in shard_rule_obj_lst_dct.items():
+            for rule_obj in rule_obj_lst:
+                for output_fileP_str in (rule_obj.output_fileP_str_lst or []):
+                    producer_shard_idx_dct[output_fileP_str] = shard_idx
+
+        shard_input_fileP_str_lst_dct = {shard_idx: [] for shard_idx in shard_idx_lst}
+        shard_output_fileP_str_lst_dct = {shard_idx: [] for shard_idx in shard_idx_lst}
+        for shard_idx, rule_obj_lst in shard_rule_obj_lst_dct.items():
+            for rule_obj in rule_obj_lst:
+                for input_fileP_str in (rule_obj.input_fileP_str_lst or []):
+                    producer_shard_idx = producer_shard_idx_dct.get(input_fileP_str, shard_idx)
+                    if producer_shard_idx == shard_idx:
+                        continue
+
+                    if input_fileP_str not in shard_input_fileP_str_lst_dct[shard_idx]:
+                        shard_input_fileP_str_lst_dct[shard_idx].append(input_fileP_str)
+                    if input_fileP_str not in shard_output_fileP_str_lst_dct[producer_shard_idx]:
+                        shard_output_fileP_str_lst_dct[producer_shard_idx].append(input_fileP_str)
+
+        # Write out the shards and create the top-level rules that execute them
+        base_fileN_str, ext_str = os.path.splitext(os.path.basename(makeflow_out_fileP_str))
+        shard_dirP_str = os.path.join(os.path.dirname(makeflow_out_fileP_str), f'{base_fileN_str}_shards')
+        top_jx_creator_obj = makeflow.JxMakeflow(compress_ranges_bl=False)
+        shard_fileP_str_lst = []
+        for shard_idx in shard_idx_lst:
+            shard_fileP_str = os.path.join(shard_dirP_str, f'{base_fileN_str}_shard_{shard_idx}{ext_str}')
+            shard_done_fileP_str = os.path.join(shard_dirP_str, f'{base_fileN_str}_shard_{shard_idx}.done')
+            bash_makeflow_fileP_str = self._write_makeflow(shard_jx_creator_obj_dct[shard_idx], shard_fileP_str)
+            shard_fileP_str_lst.append(shard_fileP_str)
+
+            rule_obj = makeflow.Rule(local_job_bl=True)
+            rule_obj.set_command(f'/bin/bash {bash_makeflow_fileP_str} && touch {shard_done_fileP_str}',
+                                 [shard_fileP_str, bash_makeflow_fileP_str]
+                                 + shard_input_fileP_str_lst_dct[shard_idx],
+                                 [shard_done_fileP_str] + shard_output_fileP_str_lst_dct[shard_idx])
+            top_jx_creator_obj.add_rule(rule_obj)
+
+        self._write_makeflow(top_jx_creator_obj, makeflow_out_fileP_str)
+
+        return shard_fileP_str_lst
+
+    def _crt_prestage_rules(self,
+                            makeflow_out_fileP_str: str,
+                            nr_prestage_int: int,
+                            prestage_cat_obj: makeflow.Category = None) -> Tuple[List[makeflow.Rule],
+                                                                                  Dict[str, List[str]]]:
+        """Create the prestage rules of every wrapper script; refer to `create`.
+
+        Returns
+        -------
+        list of makeflow.Rule:
+            The prestage rules.
+        dict of list of str:
+            The files that the prestage rules of a wrapper script create, by wrapper script file path."""
+
+        if prestage_cat_obj is None:
+            prestage_cat_obj = makeflow.Category(category_name_str=PRESTAGE_CATEGORY_NAME_STR,
+                                                 cores_int=DEFAULT_PRESTAGE_CORES_INT,
+                                                 mem_MB_int=DEFAULT_PRESTAGE_MEM_MB_INT)
+
+        # The logs and the files that mark the completed prestage rules
+        base_fileN_str = os.path.splitext(os.path.basename(makeflow_out_fileP_str))[0]
+        prestage_dirP_str = os.path.join(os.path.dirname(makeflow_out_fileP_str), f'{base_fileN_str}_prestage')
+        os.makedirs(prestage_dirP_str, exist_ok=True)
+
+        rule_obj_lst = []
+        prestage_fileP_str_lst_dct = dict()
+        for wrapper_bash_scrpt_fileP_str in self.wrapper_bash_scrpt_fileP_str_lst:
+            if wrapper_bash_scrpt_fileP_str in prestage_fileP_str_lst_dct:
+                continue
+
+            wrapper_idx = len(prestage_fileP_str_lst_dct)
+            prestage_fileP_str_lst_dct[wrapper_bash_scrpt_fileP_str] = []
+            for prestage_idx in range(nr_prestage_int):
+                prestage_fileN_str = os.path.join(prestage_dirP_str, f'prestage_{wrapper_idx}_{prestage_idx}')
+                done_fileP_str = prestage_fileN_str + '.done'
+
+                rule_obj = makeflow.Rule(category_obj=prestage_cat_obj)
+                rule_obj.set_command(f'/bin/bash {wrapper_bash_scrpt_fileP_str} {PRESTAGE_ARG_STR}'
+                                     + f' > {prestage_fileN_str}.log 2>&1 && touch {done_fileP_str}',
+                                     [wrapper_bash_scrpt_fileP_str],
+                                     [done_fileP_str])
+                rule_obj_lst.append(rule_obj)
+                prestage_fileP_str_lst_dct[wrapper_bash_scrpt_fileP_str].append(done_fileP_str)
+
+        return rule_obj_lst, prestage_fileP_str_lst_dct
+
+    def _get_makeflow_out_fileP(self, makeflow_out_fileP_str: Union[str, None]) -> str:
         if (makeflow_out_fileP_str is None) and (len(self.makeflow_out_fileP_str_lst) == 1):
             makeflow_out_fileP_str = self.makeflow_out_fileP_str_lst[0]
 
@@ -470,15 +1304,30 @@ class MakeflowFromStages:
             err_str = 'Since multiple MakeflowFromStages objects have been combined, an output file has to be given'
             raise ValueError(err_str)
 
-        # Create the makeflow JX file creator
-        makeflow_jx_creator_obj = makeflow.JxMakeflow()
+        return makeflow_out_fileP_str
 
-        for parm_dirP_str, wrapper_bash_scrpt_fileP_str, cat_obj, graph_stage_dct, \
-            py_caller_script_fileP_str in zip(self.parm_dirP_str_lst,
-                                              self.wrapper_bash_scrpt_fileP_str_lst,
-                                              self.cat_obj_lst,
-                                              self.graph_stage_dct_lst,
-                                              self.py_caller_script_fileP_str_lst):
+    def _collect_stages(self) -> Tuple[list, dict, dict]:
+        """Collect the stages of all the stage graphs; the stages are keyed by the graph index and the stage name.
+
+        Returns
+        -------
+        list of tuple:
+            The stage keys in insertion order.
+        dict:
+            The input stage keys of each stage key.
+        dict:
+            The stage graph and the keyword arguments of the makeflow rule function of each stage key."""
+
+        order_key_lst = []
+        input_key_lst_dct = dict()
+        stage_kwargs_tpl_dct = dict()
+
+        for graph_idx, (parm_dirP_str, wrapper_bash_scrpt_fileP_str, cat_obj, graph_stage_dct,
+                        py_caller_script_fileP_str) in enumerate(zip(self.parm_dirP_str_lst,
+                                                                     self.wrapper_bash_scrpt_fileP_str_lst,
+                                                                     self.cat_obj_lst,
+                                                                     self.graph_stage_dct_lst,
+                                                                     self.py_caller_script_fileP_str_lst)):
 
             # Create the keyword dictionary for the makeflow rule function
             kwargs_dct = {
@@ -488,11 +1337,27 @@ class MakeflowFromStages:
                 'cat_obj': cat_obj
             }
 
-            makeflow_jx_creator_obj.add_category(cat_obj)
+            if isinstance(graph_stage_dct, StageGraph) is True:
+                # Use the node IDs directly; the stage objects are only loaded when the rules are created
+                for node_id, name_str in enumerate(graph_stage_dct.name_str_lst):
+                    key_tpl = (graph_idx, name_str)
+                    order_key_lst.append(key_tpl)
+                    input_key_lst_dct[key_tpl] = [(graph_idx, graph_stage_dct.name_str_lst[input_id])
+                                                  for input_id in graph_stage_dct.get_input_id_lst(node_id)]
+                    stage_kwargs_tpl_dct[key_tpl] = (graph_stage_dct, kwargs_dct)
 
-            # Add the rules to the makeflow JX file creator
-            for stage_obj, _ in graph_stage_dct.values():
-                makeflow_jx_creator_obj.add_rule(stage_obj.crt_makeflow_rule(**kwargs_dct))
+            else:
+                for name_str, (stage_obj, input_stage_obj) in graph_stage_dct.items():
+                    key_tpl = (graph_idx, name_str)
+                    order_key_lst.append(key_tpl)
+                    input_key_lst_dct[key_tpl] = [(graph_idx, input_name_str)
+                                                  for input_name_str in get_input_stage_name_lst(input_stage_obj)]
+                    stage_kwargs_tpl_dct[key_tpl] = (graph_stage_dct, kwargs_dct)
+
+        return order_key_lst, input_key_lst_dct, stage_kwargs_tpl_dct
+
+    def _write_makeflow(self, makeflow_jx_creator_obj: makeflow.JxMakeflow, makeflow_out_fileP_str: str) -> str:
+        """Write out the makeflow file and the bash script that executes it; returns the bash script file path."""
 
         # Write out the makeflow file
         os.makedirs(os.path.dirname(makeflow_out_fileP_str), exist_ok=True)
@@ -509,6 +1374,8 @@ class MakeflowFromStages:
         st_obj = os.stat(bash_makeflow_fileP_str)
         os.chmod(bash_makeflow_fileP_str, st_obj.st_mode | stat.S_IXUSR)
 
+        return bash_makeflow_fileP_str
+
     def _get_command_options(self) -> dict:
         return_dct = dict()
 
@@ -1,12 +1,50 @@
 import os
+import sys
+import stat
+import fcntl
+import json
+import time
+import gzip
+import errno
+import atexit
 import shutil
+import tarfile
+import hashlib
+import mmap
+import socket
 import logging
 import getpass
 import tempfile
-from typing import List, Union
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple, Union
 
 log_obj = logging.getLogger(__name__)
 
+DEFAULT_MAX_WORKERS_INT = 8
+DEFAULT_CACHE_BUDGET_BYTES_INT = 10 * 1024 ** 3
+CACHE_BUDGET_ENV_NAME_STR = 'CLUSTERLIB_TFILE_CACHE_BYTES'
+WRITE_BEHIND_ENV_NAME_STR = 'CLUSTERLIB_TFILE_WRITE_BEHIND'
+DEFAULT_COPY_CHUNK_BYTES_INT = 64 * 1024 ** 2
+DEFAULT_COPY_THREADS_INT = 4
+DEFAULT_COPY_THRESHOLD_BYTES_INT = 256 * 1024 ** 2
+COPY_BUFFER_BYTES_INT = 8 * 1024 ** 2
+ARCHIVE_MARKER_STR = '.clusterlib_tfile_dir'
+ARCHIVE_STR_LST = ['tar', 'tar.gz']
+ARCHIVE_GZIP_LEVEL_INT = 1
+STRATEGY_ENV_NAME_STR = 'CLUSTERLIB_TFILE_STRATEGY'
+STRATEGY_STR_LST = ['copy', 'direct', 'mmap', 'auto']
+ACCESS_STR_LST = ['full', 'partial', 'random']
+DEFAULT_DIRECT_THRESHOLD_BYTES_INT = 1024 ** 3
+DEFAULT_SCRATCH_FRACTION_FLT = 0.5
+SCRATCH_BUDGET_ENV_NAME_STR = 'CLUSTERLIB_SCRATCH_BUDGET_BYTES'
+SCRATCH_WAIT_ENV_NAME_STR = 'CLUSTERLIB_SCRATCH_WAIT_SEC'
+DEFAULT_SCRATCH_BUDGET_FRACTION_FLT = 0.9
+DEFAULT_SCRATCH_WAIT_SEC_FLT = 600.0
+SCRATCH_POLL_SEC_FLT = 1.0
+IO_SUMMARY_MARKER_STR = 'CLUSTERLIB_IO_SUMMARY '
+
 
 def get_scratch_dirP(add_pid_bl = True):
     """Print the location of the scatch directory. If the environment variable SCRATCHDIR exists, it will be used
@@ -38,6 +76,1095 @@ def get_scratch_dirP(add_pid_bl = True):
     return dirP_str
 
 
+def _copy_range(src_fd: int, dst_fd: int, offset_int: int, length_int: int):
+    """Copy a byte range between two file descriptors with positional I/O, so that ranges can be copied
+    concurrently. `os.copy_file_range` is used if the kernel and the file systems support it, otherwise
+    positional reads and writes."""
+
+    end_int = offset_int + length_int
+
+    if hasattr(os, 'copy_file_range') is True:
+        try:
+            while offset_int < end_int:
+                copied_int = os.copy_file_range(src_fd, dst_fd, end_int - offset_int, offset_int, offset_int)
+                if copied_int == 0:
+                    break
+                offset_int += copied_int
+
+            return
+
+        except OSError as exception_obj:
+            if exception_obj.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+
+    while offset_int < end_int:
+        buffer_bytes = os.pread(src_fd, min(COPY_BUFFER_BYTES_INT, end_int - offset_int), offset_int)
+        if len(buffer_bytes) == 0:
+            break
+
+        written_int = 0
+        while written_int < len(buffer_bytes):
+            written_int += os.pwrite(dst_fd, buffer_bytes[written_int:], offset_int + written_int)
+        offset_int += len(buffer_bytes)
+
+
+def copy_file(src_fileP_str: str, dst_fileP_str: str, chunk_bytes_int: int = None, nr_threads_int: int = None,
+              threshold_bytes_int: int = None) -> str:
+    """Copy a file, including its permission bits. A file that is larger than the threshold is split into chunks,
+    which are copied concurrently; a single stream is limited to the bandwidth of one storage target on e.g. a
+    Lustre file system. Smaller files are copied with `shutil.copy`. The modification time is not copied; refer to
+    `copy_file_with_stat` for copying trees.
+
+    Parameters
+    ----------
+    src_fileP_str: str
+        The source file path.
+    dst_fileP_str: str
+        The destination file path.
+    chunk_bytes_int: int
+        The number of bytes of a chunk; by default the environmental variable CLUSTERLIB_COPY_CHUNK_BYTES or
+        64 MiB.
+    nr_threads_int: int
+        The number of chunks that are copied concurrently; by default the environmental variable
+        CLUSTERLIB_COPY_THREADS or 4.
+    threshold_bytes_int: int
+        The minimum file size for the chunked copy; by default the environmental variable
+        CLUSTERLIB_COPY_THRESHOLD_BYTES or 256 MiB.
+
+    Returns
+    -------
+    str:
+        The destination file path.
+
+    Raises
+    ------
+    IOError:
+        If the size of the copied file does not match the size of the source file."""
+
+    if chunk_bytes_int is None:
+        chunk_bytes_int = int(os.getenv('CLUSTERLIB_COPY_CHUNK_BYTES', DEFAULT_COPY_CHUNK_BYTES_INT))
+    if nr_threads_int is None:
+        nr_threads_int = int(os.getenv('CLUSTERLIB_COPY_THREADS', DEFAULT_COPY_THREADS_INT))
+    if threshold_bytes_int is None:
+        threshold_bytes_int = int(os.getenv('CLUSTERLIB_COPY_THRESHOLD_BYTES', DEFAULT_COPY_THRESHOLD_BYTES_INT))
+
+    if os.path.isdir(dst_fileP_str) is True:
+        dst_fileP_str = os.path.join(dst_fileP_str, os.path.basename(src_fileP_str))
+
+    size_int = os.stat(src_fileP_str).st_size
+    if (size_int < threshold_bytes_int) or (nr_threads_int <= 1) or (size_int <= chunk_bytes_int):
+        return shutil.copy(src_fileP_str, dst_fileP_str)
+
+    src_fd = os.open(src_fileP_str, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst_fileP_str, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(dst_fd, size_int)
+
+            with ThreadPoolExecutor(max_workers=nr_threads_int) as executor_obj:
+                future_obj_lst = [executor_obj.submit(_copy_range, src_fd, dst_fd, offset_int,
+                                                      min(chunk_bytes_int, size_int - offset_int))
+                                  for offset_int in range(0, size_int, chunk_bytes_int)]
+                for future_obj in future_obj_lst:
+                    future_obj.result()
+
+            dst_size_int = os.fstat(dst_fd).st_size
+
+        finally:
+            os.close(dst_fd)
+
+    finally:
+        os.close(src_fd)
+
+    if dst_size_int != size_int:
+        err_str = 'The copy "{:s}" has {:d} bytes, whereas the source "{:s}" has {:d} bytes.'
+        raise IOError(err_str.format(dst_fileP_str, dst_size_int, src_fileP_str, size_int))
+
+    shutil.copymode(src_fileP_str, dst_fileP_str)
+    log_obj.debug('Copied {:d} bytes in {:d} byte chunks with {:d} threads from "{:s}" to "{:s}"'.format(
+        size_int, chunk_bytes_int, nr_threads_int, src_fileP_str, dst_fileP_str))
+
+    return dst_fileP_str
+
+
+def copy_file_with_stat(src_fileP_str: str, dst_fileP_str: str) -> str:
+    """Copy a file with `copy_file`, including its modification time and other metadata, like `shutil.copy2`. This
+    is the `copy_function` of `shutil.copytree`, which keeps the modification times of the copied trees.
+
+    Parameters
+    ----------
+    src_fileP_str: str
+        The source file path.
+    dst_fileP_str: str
+        The destination file path.
+
+    Returns
+    -------
+    str:
+        The destination file path."""
+
+    dst_fileP_str = copy_file(src_fileP_str, dst_fileP_str)
+    shutil.copystat(src_fileP_str, dst_fileP_str)
+
+    return dst_fileP_str
+
+
+def _get_publish_tmp_fileP(fileP_str: str, tag_str: str = 'tmp') -> str:
+    """A hidden temporary path next to a destination path, which is unique per node, process and thread."""
+
+    dirP_str, fileN_str = os.path.split(fileP_str)
+
+    return os.path.join(dirP_str, '.{:s}.{:s}-{:d}-{:d}.{:s}'.format(fileN_str, socket.gethostname(), os.getpid(),
+                                                                     threading.get_ident(), tag_str))
+
+
+def _fsync_path(fileP_str: str):
+    """Flush a file or directory to the storage device; ignored by file systems that do not support it."""
+
+    fd = os.open(fileP_str, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError as exception_obj:
+        if exception_obj.errno not in (errno.EINVAL, errno.EBADF, errno.ENOTSUP):
+            raise
+    finally:
+        os.close(fd)
+
+
+def _swap_into_place(new_fileP_str: str, dst_fileP_str: str):
+    """Move a complete file or directory to its destination. A file replaces a file atomically. Otherwise the
+    existing destination is first renamed away and removed after the new one is in place, so the destination is
+    only missing between two renames, and never partially written."""
+
+    if (os.path.lexists(dst_fileP_str) is False) \
+            or ((os.path.isdir(new_fileP_str) is False) and (os.path.isdir(dst_fileP_str) is False)):
+        os.replace(new_fileP_str, dst_fileP_str)
+    else:
+        old_fileP_str = _get_publish_tmp_fileP(dst_fileP_str, 'old')
+        os.rename(dst_fileP_str, old_fileP_str)
+        try:
+            os.rename(new_fileP_str, dst_fileP_str)
+        except BaseException:
+            os.rename(old_fileP_str, dst_fileP_str)
+            raise
+
+        if os.path.isdir(old_fileP_str) is True:
+            shutil.rmtree(old_fileP_str)
+        else:
+            os.remove(old_fileP_str)
+
+    _fsync_path(os.path.dirname(os.path.abspath(dst_fileP_str)))
+
+
+def publish_file(src_fileP_str: str, dst_fileP_str: str):
+    """Copy a file to a temporary name in the destination directory, flush it to the storage device and then move
+    it to the destination, so that the destination is either the old or the complete new file.
+
+    Parameters
+    ----------
+    src_fileP_str: str
+        The source file path.
+    dst_fileP_str: str
+        The destination file path."""
+
+    tmp_fileP_str = _get_publish_tmp_fileP(dst_fileP_str)
+    try:
+        copy_file(src_fileP_str, tmp_fileP_str)
+        _fsync_path(tmp_fileP_str)
+        _swap_into_place(tmp_fileP_str, dst_fileP_str)
+
+    except BaseException:
+        if os.path.lexists(tmp_fileP_str) is True:
+            os.remove(tmp_fileP_str)
+        raise
+
+
+def publish_tree(src_dirP_str: str, dst_dirP_str: str):
+    """Copy a directory tree to a temporary name in the destination's parent directory, flush it to the storage
+    device and then swap it with the destination; see `publish_file`.
+
+    Parameters
+    ----------
+    src_dirP_str: str
+        The source directory path.
+    dst_dirP_str: str
+        The destination directory path."""
+
+    tmp_dirP_str = _get_publish_tmp_fileP(dst_dirP_str)
+    try:
+        shutil.copytree(src_dirP_str, tmp_dirP_str, copy_function=copy_file_with_stat)
+        for dirP_str, _, fileN_str_lst in os.walk(tmp_dirP_str):
+            for fileN_str in fileN_str_lst:
+                _fsync_path(os.path.join(dirP_str, fileN_str))
+            _fsync_path(dirP_str)
+
+        _swap_into_place(tmp_dirP_str, dst_dirP_str)
+
+    except BaseException:
+        shutil.rmtree(tmp_dirP_str, ignore_errors=True)
+        raise
+
+
+def _get_file_digest(fileP_str: str) -> str:
+    """The BLAKE2b digest of a file's content."""
+
+    hash_obj = hashlib.blake2b(digest_size=16)
+    with open(fileP_str, 'rb') as file_obj:
+        for buffer_bytes in iter(lambda: file_obj.read(COPY_BUFFER_BYTES_INT), b''):
+            hash_obj.update(buffer_bytes)
+
+    return hash_obj.hexdigest()
+
+
+def snapshot_path(fileP_str: str, digest_bl: bool = False) -> dict:
+    """Record the state of a file or directory tree, in order to detect later which entries changed.
+
+    Parameters
+    ----------
+    fileP_str: str
+        The file or directory path.
+    digest_bl: bool
+        If True, the digest of the content of each file is recorded as well, so that a modification that
+        preserves both the size and the modification time is detected.
+
+    Returns
+    -------
+    dict:
+        The keys are the paths relative to `fileP_str`, where the path of a file itself is ''. The values are
+        None for directories, and (size, modification time in ns, digest or None) for files."""
+
+    def _get_state(_fileP_str: str) -> Tuple[int, int, Union[str, None]]:
+        _stat_obj = os.stat(_fileP_str)
+        _digest_str = _get_file_digest(_fileP_str) if digest_bl is True else None
+
+        return _stat_obj.st_size, _stat_obj.st_mtime_ns, _digest_str
+
+    if os.path.isdir(fileP_str) is False:
+        return {'': _get_state(fileP_str)}
+
+    snapshot_dct = {'': None}
+    for dirP_str, dirN_str_lst, fileN_str_lst in os.walk(fileP_str):
+        rel_dirP_str = os.path.relpath(dirP_str, fileP_str)
+        if rel_dirP_str == '.':
+            rel_dirP_str = ''
+
+        for dirN_str in dirN_str_lst:
+            snapshot_dct[os.path.join(rel_dirP_str, dirN_str)] = None
+        for fileN_str in fileN_str_lst:
+            snapshot_dct[os.path.join(rel_dirP_str, fileN_str)] = _get_state(os.path.join(dirP_str, fileN_str))
+
+    return snapshot_dct
+
+
+def write_dir_archive(dirP_str: str, archive_fileP_str: str, archive_str: str = 'tar'):
+    """Stream a directory into a single tar archive, of which the first member is the marker file
+    ARCHIVE_MARKER_STR. The archive is first written to a temporary file next to `archive_fileP_str` and then
+    renamed, so that a reader never sees a partial archive; see `publish_file`.
+
+    Parameters
+    ----------
+    dirP_str: str
+        The directory path.
+    archive_fileP_str: str
+        The archive file path.
+    archive_str: str
+        Either 'tar' or 'tar.gz'."""
+
+    if archive_str not in ARCHIVE_STR_LST:
+        err_str = 'The archive type "{:s}" is not one of {:s}.'
+        raise ValueError(err_str.format(str(archive_str), str(ARCHIVE_STR_LST)))
+
+    tmp_fileP_str = _get_publish_tmp_fileP(archive_fileP_str)
+    try:
+        with open(tmp_fileP_str, 'wb', buffering=COPY_BUFFER_BYTES_INT) as raw_file_obj:
+            if archive_str == 'tar.gz':
+                file_obj = gzip.GzipFile(fileobj=raw_file_obj, mode='wb', compresslevel=ARCHIVE_GZIP_LEVEL_INT)
+            else:
+                file_obj = raw_file_obj
+
+            try:
+                with tarfile.open(fileobj=file_obj, mode='w|', bufsize=COPY_BUFFER_BYTES_INT) as tar_obj:
+                    tar_obj.addfile(tarfile.TarInfo(ARCHIVE_MARKER_STR))
+                    for fileN_str in sorted(os.listdir(dirP_str)):
+                        tar_obj.add(os.path.join(dirP_str, fileN_str), arcname=fileN_str)
+            finally:
+                if file_obj is not raw_file_obj:
+                    file_obj.close()
+
+            raw_file_obj.flush()
+            os.fsync(raw_file_obj.fileno())
+
+        _swap_into_place(tmp_fileP_str, archive_fileP_str)
+
+    except BaseException:
+        if os.path.exists(tmp_fileP_str) is True:
+            os.remove(tmp_fileP_str)
+        raise
+
+
+def extract_dir_archive(archive_fileP_str: str, dirP_str: str):
+    """Stream a directory archive that was written by `write_dir_archive` into a directory.
+
+    Parameters
+    ----------
+    archive_fileP_str: str
+        The archive file path.
+    dirP_str: str
+        The directory path."""
+
+    os.makedirs(dirP_str, exist_ok=True)
+
+    with open(archive_fileP_str, 'rb', buffering=COPY_BUFFER_BYTES_INT) as file_obj:
+        with tarfile.open(fileobj=file_obj, mode='r|*', bufsize=COPY_BUFFER_BYTES_INT) as tar_obj:
+            member_obj_gen = (tarinfo_obj for tarinfo_obj in tar_obj if tarinfo_obj.name != ARCHIVE_MARKER_STR)
+            if hasattr(tarfile, 'data_filter') is True:
+                tar_obj.extractall(dirP_str, members=member_obj_gen, filter='data')
+            else:
+                tar_obj.extractall(dirP_str, members=member_obj_gen)
+
+
+class TFileCache:
+    """Node-local, content-addressed read cache for TFileFrom. The cache entries are keyed by the real path of the
+    remote file and either its size and modification time or its checksum. The entries are placed into the
+    temporary directory of a TFile with a reflink, a hard link or a copy, in that order of preference; since
+    hard links share the file, the cache entries are read-only. The entries are evicted least recently used
+    first when the cache exceeds its byte budget. Multiple processes can share the cache; file locks protect the
+    creation and eviction of the entries."""
+
+    # The Linux ioctl request number to clone a file (reflink)
+    FICLONE_INT = 0x40049409
+
+    def __init__(self, cache_dirP_str: str = None, budget_bytes_int: int = DEFAULT_CACHE_BUDGET_BYTES_INT,
+                 checksum_bl: bool = False):
+        """
+
+        Parameters
+        ----------
+        cache_dirP_str: str
+            The cache directory; by default the directory "TFileCache" in the scratch directory.
+        budget_bytes_int: int
+            The maximum number of bytes of the cache entries.
+        checksum_bl: bool
+            If True, the entries are keyed by the real path and the SHA-256 checksum of the remote file, instead
+            of by the real path, size and modification time. Note that computing the checksum reads the remote
+            file.
+        """
+
+        if cache_dirP_str is None:
+            cache_dirP_str = os.path.join(get_scratch_dirP(add_pid_bl=False), 'TFileCache')
+        os.makedirs(cache_dirP_str, exist_ok=True)
+
+        self.cache_dirP_str = cache_dirP_str
+        self.budget_bytes_int = budget_bytes_int
+        self.checksum_bl = checksum_bl
+
+        self.hit_int = 0
+        self.miss_int = 0
+        self._lock_obj = threading.Lock()
+
+    def _get_key(self, src_fileP_str: str) -> str:
+        real_fileP_str = os.path.realpath(src_fileP_str)
+
+        hash_obj = hashlib.sha256(real_fileP_str.encode())
+        if self.checksum_bl is True:
+            with open(real_fileP_str, 'rb') as file_obj:
+                for chunk_bytes in iter(lambda: file_obj.read(1 << 20), b''):
+                    hash_obj.update(chunk_bytes)
+        else:
+            stat_obj = os.stat(real_fileP_str)
+            hash_obj.update(f'\0{stat_obj.st_size:d}\0{stat_obj.st_mtime_ns:d}'.encode())
+
+        return hash_obj.hexdigest()
+
+    def _place(self, entry_fileP_str: str, dst_fileP_str: str):
+        """Place the cache entry at the destination as a reflink, hard link or copy."""
+
+        try:
+            with open(entry_fileP_str, 'rb') as src_file_obj, open(dst_fileP_str, 'wb') as dst_file_obj:
+                fcntl.ioctl(dst_file_obj.fileno(), self.FICLONE_INT, src_file_obj.fileno())
+            return
+
+        except OSError:
+            if os.path.exists(dst_fileP_str) is True:
+                os.remove(dst_fileP_str)
+
+        try:
+            os.link(entry_fileP_str, dst_fileP_str)
+
+        except OSError:
+            shutil.copyfile(entry_fileP_str, dst_fileP_str)
+
+    def fetch(self, src_fileP_str: str, dst_fileP_str: str):
+        """Place the remote file at the destination through the cache.
+
+        Parameters
+        ----------
+        src_fileP_str: str
+            The remote file path.
+        dst_fileP_str: str
+            The local file path."""
+
+        entry_fileP_str = os.path.join(self.cache_dirP_str, self._get_key(src_fileP_str))
+
+        # A shared lock on the entry keeps it from being evicted while it is placed; only one process creates the
+        # entry, under an exclusive lock, and the others wait for it
+        hit_bl = True
+        with open(entry_fileP_str + '.lck', 'a') as lock_file_obj:
+            fcntl.flock(lock_file_obj, fcntl.LOCK_SH)
+            try:
+                try:
+                    self._place(entry_fileP_str, dst_fileP_str)
+
+                except FileNotFoundError:
+                    hit_bl = False
+                    fcntl.flock(lock_file_obj, fcntl.LOCK_EX)
+                    if os.path.exists(entry_fileP_str) is False:
+                        tmp_fileP_str = '{:s}.tmp.{:d}.{:d}'.format(entry_fileP_str, os.getpid(),
+                                                                    threading.get_ident())
+                        copy_file(src_fileP_str, tmp_fileP_str)
+                        os.chmod(tmp_fileP_str, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                        os.replace(tmp_fileP_str, entry_fileP_str)
+
+                    self._place(entry_fileP_str, dst_fileP_str)
+
+                else:
+                    # The modification time of an entry is its last access time for the eviction
+                    os.utime(entry_fileP_str)
+
+            finally:
+                fcntl.flock(lock_file_obj, fcntl.LOCK_UN)
+
+        with self._lock_obj:
+            if hit_bl is True:
+                self.hit_int += 1
+            else:
+                self.miss_int += 1
+        log_obj.debug('Cache {:s} for "{:s}"'.format('hit' if hit_bl is True else 'miss', src_fileP_str))
+
+        if hit_bl is False:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is within its byte budget. An entry is only
+        removed while its lock is held exclusively, so entries that are being created or placed are skipped. The
+        lock files are never removed, since another process may hold or wait for them."""
+
+        with open(os.path.join(self.cache_dirP_str, 'evict.lck'), 'w') as lock_file_obj:
+            fcntl.flock(lock_file_obj, fcntl.LOCK_EX)
+            try:
+                entry_tpl_lst = []
+                total_bytes_int = 0
+                for dir_entry_obj in os.scandir(self.cache_dirP_str):
+                    if (len(dir_entry_obj.name) != 64) or (dir_entry_obj.is_file() is False):
+                        continue
+                    stat_obj = dir_entry_obj.stat()
+                    entry_tpl_lst.append((stat_obj.st_mtime, stat_obj.st_size, dir_entry_obj.path))
+                    total_bytes_int += stat_obj.st_size
+
+                entry_tpl_lst.sort()
+                for _, size_int, entry_fileP_str in entry_tpl_lst:
+                    if total_bytes_int <= self.budget_bytes_int:
+                        break
+
+                    with open(entry_fileP_str + '.lck', 'a') as entry_lock_file_obj:
+                        try:
+                            fcntl.flock(entry_lock_file_obj, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            log_obj.debug('Skipping the busy cache entry "{:s}"'.format(entry_fileP_str))
+                            continue
+
+                        try:
+                            log_obj.debug('Evicting cache entry "{:s}"'.format(entry_fileP_str))
+                            os.remove(entry_fileP_str)
+                            total_bytes_int -= size_int
+                        except FileNotFoundError:
+                            pass
+                        finally:
+                            fcntl.flock(entry_lock_file_obj, fcntl.LOCK_UN)
+
+            finally:
+                fcntl.flock(lock_file_obj, fcntl.LOCK_UN)
+
+    def log_stats(self):
+        """Log the number of cache hits and misses."""
+
+        log_obj.info('TFileCache "{:s}": {:d} hit(s), {:d} miss(es)'.format(self.cache_dirP_str,
+                                                                            self.hit_int,
+                                                                            self.miss_int))
+
+
+_tfile_cache_obj = None
+
+
+def get_tfile_cache() -> Union[TFileCache, None]:
+    """Get the process wide TFileCache. The cache is enabled by setting the environmental variable
+    CLUSTERLIB_TFILE_CACHE_BYTES to the byte budget of the cache; if it is not set, None is returned."""
+
+    global _tfile_cache_obj
+
+    if _tfile_cache_obj is None:
+        budget_str = os.getenv(CACHE_BUDGET_ENV_NAME_STR, '')
+        if budget_str != '':
+            _tfile_cache_obj = TFileCache(budget_bytes_int=int(budget_str))
+
+    return _tfile_cache_obj
+
+
+def _get_tfile_dirP() -> str:
+    """The directory in the scratch directory wherein the TFile temporary directories are created."""
+
+    dirP_str = os.path.join(get_scratch_dirP(add_pid_bl=False), 'TFile')
+    os.makedirs(dirP_str, exist_ok=True)
+
+    return dirP_str
+
+
+def _get_tfile_dir_prefix_str(pid_int: int = None) -> str:
+    """The prefix of the TFile temporary directory names, which identifies the node and the process that owns the
+    directory, so that `sweep_orphaned_tfile_dirs` can remove the directories of processes that were killed."""
+
+    if pid_int is None:
+        pid_int = os.getpid()
+
+    return '{:s}-{:d}-'.format(socket.gethostname(), pid_int)
+
+
+def _is_pid_alive(pid_int: int) -> bool:
+    try:
+        os.kill(pid_int, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def sweep_orphaned_tfile_dirs(tfile_dirP_str: str = None) -> int:
+    """Remove the TFile temporary directories of this node whose owning process no longer exists, e.g. because
+    the task was killed by the batch system.
+
+    Parameters
+    ----------
+    tfile_dirP_str: str
+        The directory of the TFile temporary directories; by default the directory "TFile" in the scratch
+        directory.
+
+    Returns
+    -------
+    int:
+        The number of removed directories."""
+
+    if tfile_dirP_str is None:
+        tfile_dirP_str = _get_tfile_dirP()
+
+    host_prefix_str = socket.gethostname() + '-'
+
+    nr_removed_int = 0
+    for dir_entry_obj in os.scandir(tfile_dirP_str):
+        if (dir_entry_obj.name.startswith(host_prefix_str) is False) or (dir_entry_obj.is_dir() is False):
+            continue
+
+        pid_str = dir_entry_obj.name[len(host_prefix_str):].split('-', 1)[0]
+        if (pid_str.isdigit() is False) or (_is_pid_alive(int(pid_str)) is True):
+            continue
+
+        log_obj.info('Removing the orphaned TFile directory "{:s}"'.format(dir_entry_obj.path))
+        shutil.rmtree(dir_entry_obj.path, ignore_errors=True)
+        nr_removed_int += 1
+
+    return nr_removed_int
+
+
+class ScratchAccountant:
+    """Node-level admission control of the scratch space. Before a file is staged, its size is reserved in a ledger
+    that is shared by all processes of the node and protected by a file lock; the reservation is marked as written
+    once the file has been staged, and it is released when the staged file is removed. A reservation is admitted
+    if the total of the reservations stays within the byte budget. The reservations of processes that no longer
+    exist are dropped from the ledger."""
+
+    def __init__(self, tfile_dirP_str: str = None, budget_bytes_int: int = None):
+        """
+
+        Parameters
+        ----------
+        tfile_dirP_str: str
+            The directory of the TFile temporary directories, which also holds the ledger; by default the directory
+            "TFile" in the scratch directory.
+        budget_bytes_int: int
+            The maximum number of reserved bytes. By default, the budget is 90% of the free space plus the
+            reserved bytes that have already been written, at the moment of the reservation; the reservations that
+            have not been written yet are not taken from the free space yet, so they only count against the
+            budget.
+        """
+
+        if tfile_dirP_str is None:
+            tfile_dirP_str = _get_tfile_dirP()
+        os.makedirs(tfile_dirP_str, exist_ok=True)
+
+        self.tfile_dirP_str = tfile_dirP_str
+        self.budget_bytes_int = budget_bytes_int
+        self.ledger_fileP_str = os.path.join(tfile_dirP_str, 'ledger.json')
+
+        self._counter_int = 0
+        self._lock_obj = threading.Lock()
+
+    def _update_ledger(self, update_func_obj: Callable[[dict], object]) -> object:
+        """Apply a function to the ledger dictionary while holding the ledger lock; the reservations of dead
+        processes of this node are dropped first."""
+
+        with open(self.ledger_fileP_str + '.lck', 'w') as lock_file_obj:
+            fcntl.flock(lock_file_obj, fcntl.LOCK_EX)
+            try:
+                ledger_dct = dict()
+                if os.path.exists(self.ledger_fileP_str) is True:
+                    with open(self.ledger_fileP_str, 'r') as file_obj:
+                        ledger_dct = json.load(file_obj)
+
+                host_str = socket.gethostname()
+                for token_str, entry_lst in list(ledger_dct.items()):
+                    if (entry_lst[0] == host_str) and (_is_pid_alive(entry_lst[1]) is False):
+                        del ledger_dct[token_str]
+
+                rtn_obj = update_func_obj(ledger_dct)
+
+                tmp_fileP_str = '{:s}.{:d}.tmp'.format(self.ledger_fileP_str, os.getpid())
+                with open(tmp_fileP_str, 'w') as file_obj:
+                    json.dump(ledger_dct, file_obj)
+                os.replace(tmp_fileP_str, self.ledger_fileP_str)
+
+            finally:
+                fcntl.flock(lock_file_obj, fcntl.LOCK_UN)
+
+        return rtn_obj
+
+    def _get_budget_tpl(self, ledger_dct: dict) -> Tuple[int, int]:
+        """The total of the reservations and the byte budget; the entries of the ledger are
+        [host, pid, bytes, written]."""
+
+        reserved_int = sum([entry_lst[2] for entry_lst in ledger_dct.values()])
+
+        budget_int = self.budget_bytes_int
+        if budget_int is None:
+            written_int = sum([entry_lst[2] for entry_lst in ledger_dct.values()
+                               if (len(entry_lst) > 3) and (entry_lst[3] is True)])
+            free_int = shutil.disk_usage(self.tfile_dirP_str).free
+            budget_int = int(DEFAULT_SCRATCH_BUDGET_FRACTION_FLT * (free_int + written_int))
+
+        return reserved_int, budget_int
+
+    def _try_reserve_lst(self, size_int_lst: List[int]) -> Union[List[str], bool]:
+        """Reserve the bytes of several files at once, or none of them.
+
+        Returns
+        -------
+        list of str or bool:
+            The reservation tokens; False if the reservations were not admitted now, or True if they can never be
+            admitted, since they exceed the budget on their own."""
+
+        token_str_lst = []
+        with self._lock_obj:
+            for _ in size_int_lst:
+                self._counter_int += 1
+                token_str_lst.append('{:s}{:d}'.format(_get_tfile_dir_prefix_str(), self._counter_int))
+
+        def _reserve(_ledger_dct: dict) -> Union[List[str], bool]:
+            _reserved_int, _budget_int = self._get_budget_tpl(_ledger_dct)
+
+            if _reserved_int + sum(size_int_lst) > _budget_int:
+                # The reservations of the other processes are released eventually, but not those of this process
+                _own_int = sum([_entry_lst[2] for _entry_lst in _ledger_dct.values()
+                                if (_entry_lst[0] == socket.gethostname()) and (_entry_lst[1] == os.getpid())])
+                return _own_int + sum(size_int_lst) > _budget_int
+
+            for _token_str, _size_int in zip(token_str_lst, size_int_lst):
+                _ledger_dct[_token_str] = [socket.gethostname(), os.getpid(), _size_int, False]
+            return token_str_lst
+
+        return self._update_ledger(_reserve)
+
+    def try_reserve(self, size_int: int) -> Union[str, None]:
+        """Reserve bytes if the budget allows it.
+
+        Parameters
+        ----------
+        size_int: int
+            The number of bytes.
+
+        Returns
+        -------
+        str or None:
+            The reservation token, or None if the reservation was not admitted."""
+
+        token_str_lst = self._try_reserve_lst([size_int])
+        if isinstance(token_str_lst, list) is True:
+            return token_str_lst[0]
+
+        return None
+
+    def reserve_lst(self, size_int_lst: List[int], wait_sec_flt: float = None) -> Union[List[str], None]:
+        """Reserve the bytes of several files at once, waiting until the budget allows it; either all or none of
+        the reservations are made, so that a process never holds a part of the reservations while it waits for the
+        rest. Reservations that exceed the budget on their own are rejected immediately.
+
+        Parameters
+        ----------
+        size_int_lst: list of int
+            The number of bytes of every file.
+        wait_sec_flt: float
+            The maximum number of seconds to wait; None waits indefinitely.
+
+        Returns
+        -------
+        list of str or None:
+            The reservation tokens, or None if the reservations were not admitted in time."""
+
+        start_sec_flt = time.monotonic()
+        while True:
+            token_str_lst = self._try_reserve_lst(size_int_lst)
+            if isinstance(token_str_lst, list) is True:
+                return token_str_lst
+
+            if token_str_lst is True:
+                log_obj.warning('The reservation of {:d} bytes of scratch space exceeds the budget'.format(
+                    sum(size_int_lst)))
+                return None
+
+            if (wait_sec_flt is not None) and (time.monotonic() - start_sec_flt >= wait_sec_flt):
+                log_obj.warning('Could not reserve {:d} bytes of scratch space within {:.0f} seconds'.format(
+                    sum(size_int_lst), wait_sec_flt))
+                return None
+
+            time.sleep(SCRATCH_POLL_SEC_FLT)
+
+    def reserve(self, size_int: int, wait_sec_flt: float = None) -> Union[str, None]:
+        """Reserve bytes, waiting until the budget allows it; see `reserve_lst`.
+
+        Parameters
+        ----------
+        size_int: int
+            The number of bytes.
+        wait_sec_flt: float
+            The maximum number of seconds to wait; None waits indefinitely.
+
+        Returns
+        -------
+        str or None:
+            The reservation token, or None if the reservation was not admitted in time."""
+
+        token_str_lst = self.reserve_lst([size_int], wait_sec_flt)
+        if token_str_lst is None:
+            return None
+
+        return token_str_lst[0]
+
+    def mark_written(self, token_str: str):
+        """Mark a reservation as written, i.e. its bytes have been taken from the free space.
+
+        Parameters
+        ----------
+        token_str: str
+            The reservation token."""
+
+        def _mark(_ledger_dct: dict):
+            if token_str in _ledger_dct:
+                _ledger_dct[token_str] = _ledger_dct[token_str][:3] + [True]
+
+        self._update_ledger(_mark)
+
+    def release(self, token_str: str):
+        """Release a reservation.
+
+        Parameters
+        ----------
+        token_str: str
+            The reservation token."""
+
+        self._update_ledger(lambda _ledger_dct: _ledger_dct.pop(token_str, None))
+
+    def get_reserved_bytes(self) -> int:
+        """The total number of reserved bytes of the node."""
+
+        return self._update_ledger(lambda _ledger_dct: sum([_entry_lst[2] for _entry_lst in _ledger_dct.values()]))
+
+
+_scratch_accountant_obj = None
+
+
+def get_scratch_accountant() -> Union[ScratchAccountant, None]:
+    """Get the process wide ScratchAccountant. The accountant is enabled by setting the environmental variable
+    CLUSTERLIB_SCRATCH_BUDGET_BYTES to either the byte budget or "auto", for a budget based on the free space; if it
+    is not set, None is returned. The orphaned TFile directories are swept when the accountant is created."""
+
+    global _scratch_accountant_obj
+
+    if _scratch_accountant_obj is None:
+        budget_str = os.getenv(SCRATCH_BUDGET_ENV_NAME_STR, '')
+        if budget_str not in ('', '0'):
+            budget_bytes_int = None if budget_str == 'auto' else int(budget_str)
+            _scratch_accountant_obj = ScratchAccountant(budget_bytes_int=budget_bytes_int)
+            sweep_orphaned_tfile_dirs(_scratch_accountant_obj.tfile_dirP_str)
+
+    return _scratch_accountant_obj
+
+
+def get_path_size(fileP_str: str) -> int:
+    """The number of bytes of a file, or of all the files in a directory tree; 0 if the path does not exist."""
+
+    if os.path.isdir(fileP_str) is False:
+        try:
+            return os.stat(fileP_str).st_size
+        except FileNotFoundError:
+            return 0
+
+    size_int = 0
+    for dirP_str, _, fileN_str_lst in os.walk(fileP_str):
+        for fileN_str in fileN_str_lst:
+            try:
+                size_int += os.stat(os.path.join(dirP_str, fileN_str)).st_size
+            except FileNotFoundError:
+                pass
+
+    return size_int
+
+
+_mount_tpl_lst = None
+
+
+def get_mount_str(fileP_str: str) -> str:
+    """The mount point and file system type of a path, e.g. "/scratch (xfs)", from /proc/mounts."""
+
+    global _mount_tpl_lst
+
+    if _mount_tpl_lst is None:
+        mount_tpl_lst = []
+        try:
+            with open('/proc/mounts', 'r') as file_obj:
+                for line_str in file_obj:
+                    part_str_lst = line_str.split()
+                    if len(part_str_lst) >= 3:
+                        # Spaces and other characters in the mount point are octal escaped
+                        mount_dirP_str = part_str_lst[1].encode().decode('unicode_escape')
+                        mount_tpl_lst.append((mount_dirP_str, part_str_lst[2]))
+        except OSError:
+            pass
+        # The longest mount points first, so that the first match is the deepest mount
+        mount_tpl_lst.sort(key=lambda _mount_tpl: len(_mount_tpl[0]), reverse=True)
+        _mount_tpl_lst = mount_tpl_lst
+
+    realP_str = os.path.realpath(fileP_str)
+    for mount_dirP_str, fs_type_str in _mount_tpl_lst:
+        if (realP_str == mount_dirP_str) or (realP_str.startswith(mount_dirP_str.rstrip('/') + '/') is True):
+            return '{:s} ({:s})'.format(mount_dirP_str, fs_type_str)
+
+    return 'unknown'
+
+
+class IOStats:
+    """Per-process collector of the I/O records of the TFile operations. Each record holds the operation, the
+    source and destination paths and file systems, the number of bytes and the duration."""
+
+    def __init__(self):
+        self.record_dct_lst = []
+        self._lock_obj = threading.Lock()
+
+    def add(self, op_str: str, src_fileP_str: str, dst_fileP_str: str, bytes_int: int, duration_sec_flt: float):
+        """Add a record.
+
+        Parameters
+        ----------
+        op_str: str
+            The operation, e.g. 'copyfrom', 'copyto' or 'cleanup'.
+        src_fileP_str: str
+            The source path.
+        dst_fileP_str: str
+            The destination path; an empty string if there is none.
+        bytes_int: int
+            The number of bytes that were moved or removed.
+        duration_sec_flt: float
+            The duration of the operation in seconds."""
+
+        record_dct = {
+            'op_str': op_str,
+            'src_fileP_str': src_fileP_str,
+            'dst_fileP_str': dst_fileP_str,
+            'src_fs_str': get_mount_str(src_fileP_str),
+            'dst_fs_str': get_mount_str(dst_fileP_str) if dst_fileP_str != '' else '',
+            'bytes_int': bytes_int,
+            'duration_sec_flt': duration_sec_flt,
+            'throughput_MBps_flt': bytes_int / 1024 ** 2 / max(duration_sec_flt, 1e-9)
+        }
+        log_obj.debug('I/O record: {:s}'.format(str(record_dct)))
+
+        with self._lock_obj:
+            self.record_dct_lst.append(record_dct)
+
+    def get_summary_dct(self, top_int: int = 5) -> dict:
+        """Summarize the records per operation and source and destination file system.
+
+        Parameters
+        ----------
+        top_int: int
+            The number of largest transfers that are listed.
+
+        Returns
+        -------
+        dict:
+            The summary; refer to `aggregate_io_summaries` for the format."""
+
+        with self._lock_obj:
+            record_dct_lst = list(self.record_dct_lst)
+
+        summary_dct = {
+            'op_dct_lst': [],
+            'largest_lst': [],
+        }
+        for record_dct in record_dct_lst:
+            summary_dct['op_dct_lst'].append({
+                'op_str': record_dct['op_str'],
+                'src_fs_str': record_dct['src_fs_str'],
+                'dst_fs_str': record_dct['dst_fs_str'],
+                'count_int': 1,
+                'bytes_int': record_dct['bytes_int'],
+                'duration_sec_flt': record_dct['duration_sec_flt']
+            })
+            if record_dct['op_str'] != 'cleanup':
+                summary_dct['largest_lst'].append([record_dct['op_str'],
+                                                   record_dct['src_fileP_str'],
+                                                   record_dct['dst_fileP_str'],
+                                                   record_dct['bytes_int']])
+
+        return aggregate_io_summaries([summary_dct], top_int=top_int)
+
+    def dump(self, file_obj):
+        """Write the summary as a single JSON line, prefixed by IO_SUMMARY_MARKER_STR, e.g. to the job log.
+
+        Parameters
+        ----------
+        file_obj: file object
+            The text file object, e.g. `sys.stdout`."""
+
+        file_obj.write(IO_SUMMARY_MARKER_STR + json.dumps(self.get_summary_dct()) + '\n')
+        file_obj.flush()
+
+
+def aggregate_io_summaries(summary_dct_lst: List[dict], top_int: int = 10) -> dict:
+    """Aggregate I/O summaries, e.g. of all the stages of a jar.
+
+    Parameters
+    ----------
+    summary_dct_lst: list of dict
+        The summaries of `IOStats.get_summary_dct` or `read_io_summary`.
+    top_int: int
+        The number of largest transfers that are kept.
+
+    Returns
+    -------
+    dict:
+        'op_dct_lst': the count, bytes, duration and throughput per operation and source and destination file
+        system, sorted from the lowest to the highest throughput;
+        'largest_lst': the largest transfers as [operation, source path, destination path, bytes];
+        'total_bytes_int' and 'total_duration_sec_flt': the totals of the copy operations."""
+
+    op_dct_dct = dict()
+    largest_lst = []
+    for summary_dct in summary_dct_lst:
+        for op_dct in summary_dct['op_dct_lst']:
+            key_tpl = (op_dct['op_str'], op_dct['src_fs_str'], op_dct['dst_fs_str'])
+            if key_tpl not in op_dct_dct:
+                op_dct_dct[key_tpl] = {'op_str': key_tpl[0], 'src_fs_str': key_tpl[1], 'dst_fs_str': key_tpl[2],
+                                       'count_int': 0, 'bytes_int': 0, 'duration_sec_flt': 0.0}
+            for name_str in ('count_int', 'bytes_int', 'duration_sec_flt'):
+                op_dct_dct[key_tpl][name_str] += op_dct[name_str]
+        largest_lst += summary_dct['largest_lst']
+
+    op_dct_lst = list(op_dct_dct.values())
+    for op_dct in op_dct_lst:
+        op_dct['throughput_MBps_flt'] = op_dct['bytes_int'] / 1024 ** 2 / max(op_dct['duration_sec_flt'], 1e-9)
+    op_dct_lst.sort(key=lambda _op_dct: _op_dct['throughput_MBps_flt'])
+
+    largest_lst.sort(key=lambda _largest_obj: _largest_obj[3], reverse=True)
+
+    copy_op_dct_lst = [op_dct for op_dct in op_dct_lst if op_dct['op_str'] != 'cleanup']
+
+    return {
+        'op_dct_lst': op_dct_lst,
+        'largest_lst': largest_lst[:top_int],
+        'total_bytes_int': sum([op_dct['bytes_int'] for op_dct in copy_op_dct_lst]),
+        'total_duration_sec_flt': sum([op_dct['duration_sec_flt'] for op_dct in copy_op_dct_lst])
+    }
+
+
+def read_io_summary(log_fileP_str: str) -> Union[dict, None]:
+    """Read the last I/O summary that `IOStats.dump` wrote to a job log file.
+
+    Parameters
+    ----------
+    log_fileP_str: str
+        The log file path.
+
+    Returns
+    -------
+    dict or None:
+        The summary, or None if the log file has no summary."""
+
+    summary_dct = None
+    with open(log_fileP_str, 'r', errors='replace') as file_obj:
+        for line_str in file_obj:
+            if line_str.startswith(IO_SUMMARY_MARKER_STR) is True:
+                try:
+                    summary_dct = json.loads(line_str[len(IO_SUMMARY_MARKER_STR):])
+                except ValueError:
+                    pass
+
+    return summary_dct
+
+
+_io_stats_obj = IOStats()
+
+
+def get_io_stats() -> IOStats:
+    """Get the process wide I/O collector of the TFile operations."""
+
+    return _io_stats_obj
+
+
+def _record_io(op_str: str):
+    """Decorator of the TFile copy and cleanup methods that adds a record to the process wide I/O collector."""
+
+    def _decorator(method_obj):
+        @functools.wraps(method_obj)
+        def _wrapper(self, *args, **kwargs):
+            if (self.do_nothing_bl is True) or (self.strategy_str != 'copy'):
+                return method_obj(self, *args, **kwargs)
+
+            if op_str == 'copyfrom':
+                src_fileP_str, dst_fileP_str = self.transcended_fileP_str, self.local_fileP_str
+            elif op_str == 'copyto':
+                src_fileP_str, dst_fileP_str = self.local_fileP_str, self.transcended_fileP_str
+            else:
+                src_fileP_str, dst_fileP_str = self.local_fileP_str, ''
+
+            if op_str == 'cleanup':
+                bytes_int = get_path_size(src_fileP_str)
+
+            start_sec_flt = time.perf_counter()
+            rtn_obj = method_obj(self, *args, **kwargs)
+            duration_sec_flt = time.perf_counter() - start_sec_flt
+
+            if op_str != 'cleanup':
+                bytes_int = get_path_size(self.local_fileP_str)
+
+            if bytes_int > 0:
+                get_io_stats().add(op_str, src_fileP_str, dst_fileP_str, bytes_int, duration_sec_flt)
+
+            return rtn_obj
+
+        return _wrapper
+
+    return _decorator
+
+
 class TFile:
     """TFile stands for TranscendedFile. The idea is the while the file is being read or written to, the operations are
     done a local file system. Once the file has been closed, the file is moved to its actual destination.
@@ -46,7 +1173,7 @@ class TFile:
     large volume data transfer, but not for small volume data transfer."""
 
     def __init__(self, fileP_str: str, tmp_dirP_str: str = None, base_dirP_str: str = None, overwrite_bl: bool = True,
-                 do_nothing_bl: bool = False):
+                 do_nothing_bl: bool = False, archive_str: str = None):
         """
 
         Parameters
@@ -63,13 +1190,21 @@ class TFile:
             TODO
         do_nothing_bl: bool
             If True, no files are copied or deleted.
+        archive_str: str
+            If either 'tar' or 'tar.gz', a local directory is copied to the remote file system as a single archive
+            file; see `write_dir_archive`. This turns the many metadata operations of copying a directory of small
+            files into one sequential transfer. A remote file at `fileP_str` is then also a directory archive of
+            this type, which `copyfrom` extracts to the local directory.
         """
 
+        if (archive_str is not None) and (archive_str not in ARCHIVE_STR_LST):
+            err_str = 'The archive type "{:s}" is not one of {:s}.'
+            raise ValueError(err_str.format(str(archive_str), str(ARCHIVE_STR_LST)))
+
         self.transcended_fileP_str = fileP_str
         if (tmp_dirP_str is None) or (isinstance(tmp_dirP_str, str) is False):
-            _tmp_str = os.path.join(get_scratch_dirP(add_pid_bl=False), 'TFile')
-            os.makedirs(_tmp_str, exist_ok=True)
-            self.temp_dirP_obj = tempfile.TemporaryDirectory(dir=_tmp_str)
+            self.temp_dirP_obj = tempfile.TemporaryDirectory(prefix=_get_tfile_dir_prefix_str(),
+                                                             dir=_get_tfile_dirP())
             self.temp_dirP_str = self.temp_dirP_obj.name
         else:
             self.temp_dirP_obj = None
@@ -82,10 +1217,19 @@ class TFile:
 
         self.overwrite_bl = overwrite_bl
         self.do_nothing_bl = do_nothing_bl
+        self.archive_str = archive_str
+        self.strategy_str = 'copy'
+        self.mmap_obj = None
+        self.scratch_obj = None
+        self.scratch_token_str = None
+        self.scratch_pending_bl = False
+        self.snapshot_dct = None
+        self.snapshot_digest_bl = False
 
     def __str__(self):
         return self.local_fileP_str
 
+    @_record_io('copyfrom')
     def copyfrom(self):
         """Copy the file from the remote file system."""
 
@@ -96,16 +1240,19 @@ class TFile:
                 if os.path.isdir(self.transcended_fileP_str) is True:
                     log_obj.debug('Copying from directory "{:s}" to "{:s}"'.format(self.transcended_fileP_str,
                                                                                    self.local_fileP_str))
-                    shutil.copytree(self.transcended_fileP_str, self.local_fileP_str)
-                else:
+                    shutil.copytree(self.transcended_fileP_str, self.local_fileP_str, copy_function=copy_file_with_stat)
+                elif self.unpack_archive(self.transcended_fileP_str) is False:
                     log_obj.debug('Copying from file "{:s}" to "{:s}"'.format(self.transcended_fileP_str,
                                                                               self.local_fileP_str))
-                    shutil.copy(self.transcended_fileP_str, self.local_fileP_str)
+                    copy_file(self.transcended_fileP_str, self.local_fileP_str)
             else:
                 log_obj.error('The file "{:s}" does not exists'.format(self.transcended_fileP_str))
 
+    @_record_io('copyto')
     def copyto(self):
-        """Copy the file to the remote file system."""
+        """Copy the file to the remote file system. The file or directory is published atomically: it is copied to
+        a temporary name in the destination directory, flushed to the storage device and then moved into place, so
+        that readers never see a partially written file; see `publish_file` and `publish_tree`."""
 
         if self.do_nothing_bl is False:
             if os.path.exists(self.transcended_fileP_str) is True and self.overwrite_bl is False:
@@ -117,29 +1264,174 @@ class TFile:
             os.makedirs(os.path.dirname(self.transcended_fileP_str), exist_ok = True)
 
             if os.path.exists(self.local_fileP_str) is True:
-                if os.path.isdir(self.local_fileP_str) is True:
-                    if os.path.exists(self.transcended_fileP_str) is True and self.overwrite_bl is True:
-                        log_obj.debug('Removing existing directory "{:s}"'.format(self.transcended_fileP_str))
-                        shutil.rmtree(self.transcended_fileP_str)
-
+                if (os.path.isdir(self.local_fileP_str) is True) and (self.archive_str is not None):
+                    log_obj.debug('Archiving directory "{:s}" to "{:s}"'.format(self.local_fileP_str,
+                                                                                self.transcended_fileP_str))
+                    write_dir_archive(self.local_fileP_str, self.transcended_fileP_str, archive_str=self.archive_str)
+                elif os.path.isdir(self.local_fileP_str) is True:
                     log_obj.debug('Copying to directory "{:s}" from "{:s}"'.format(self.local_fileP_str,
                                                                                    self.transcended_fileP_str))
-                    shutil.copytree(self.local_fileP_str, self.transcended_fileP_str)
+                    publish_tree(self.local_fileP_str, self.transcended_fileP_str)
                 else:
-                    if os.path.exists(self.transcended_fileP_str) is True and self.overwrite_bl is True:
-                        log_obj.debug('Removing existing file "{:s}"'.format(self.transcended_fileP_str))
-                        os.remove(self.transcended_fileP_str)
-
                     log_obj.debug('Copying to file "{:s}" from "{:s}"'.format(self.local_fileP_str,
                                                                               self.transcended_fileP_str))
-                    shutil.copy(self.local_fileP_str, self.transcended_fileP_str)
+                    publish_file(self.local_fileP_str, self.transcended_fileP_str)
             else:
                 log_obj.error('The file "{:s}" does not exists'.format(self.local_fileP_str))
 
+    def unpack_archive(self, archive_fileP_str: str) -> bool:
+        """If the file is a directory archive, i.e. `archive_str` is set, extract it to the local directory; the
+        archive type is recorded with the file, e.g. by `clusterlib.executor.StageOutputFile`, instead of detected
+        from the content of the file.
+
+        Parameters
+        ----------
+        archive_fileP_str: str
+            The file path of either the remote file or a local copy of it.
+
+        Returns
+        -------
+        bool:
+            True if the file was a directory archive and it has been extracted."""
+
+        if self.archive_str is None:
+            return False
+
+        log_obj.debug('Extracting directory archive "{:s}" to "{:s}"'.format(archive_fileP_str,
+                                                                            self.local_fileP_str))
+        extract_dir_archive(archive_fileP_str, self.local_fileP_str)
+
+        return True
+
+    def record_snapshot(self, digest_bl: bool = False):
+        """Record the state of the local file or directory, so that `copyback` only copies what changed.
+
+        Parameters
+        ----------
+        digest_bl: bool
+            If True, the content digests of the files are recorded as well; see `snapshot_path`."""
+
+        self.snapshot_dct = None
+        self.snapshot_digest_bl = digest_bl
+        if (self.do_nothing_bl is False) and (os.path.exists(self.local_fileP_str) is True):
+            self.snapshot_dct = snapshot_path(self.local_fileP_str, digest_bl=digest_bl)
+
+    def copyback(self):
+        """Copy the local modifications back to the remote file system. Without a snapshot from
+        `record_snapshot`, or if the remote file or the type of the local file changed, this is the same as
+        `copyto`. Otherwise an unchanged file is not copied, and for a directory only the changed and new files
+        are copied: the new tree is built next to the remote directory, with hard links to the unchanged remote
+        files, and swapped into place, like `publish_tree`."""
+
+        snapshot_dct = self.snapshot_dct
+        if (self.do_nothing_bl is False) and (snapshot_dct is not None) and (snapshot_dct[''] is None) \
+                and (self.archive_str is not None) and (os.path.isdir(self.local_fileP_str) is True) \
+                and (os.path.isfile(self.transcended_fileP_str) is True):
+            # The whole archive is rewritten if any entry changed
+            if snapshot_path(self.local_fileP_str, digest_bl=self.snapshot_digest_bl) == snapshot_dct:
+                log_obj.debug('Skipping the unchanged directory "{:s}"'.format(self.local_fileP_str))
+                return None
+
+            return self.copyto()
+
+        if (self.do_nothing_bl is True) or (snapshot_dct is None) or (self.overwrite_bl is False) \
+                or (os.path.exists(self.local_fileP_str) is False) \
+                or (os.path.exists(self.transcended_fileP_str) is False) \
+                or (os.path.isdir(self.local_fileP_str) != (snapshot_dct[''] is None)) \
+                or (os.path.isdir(self.transcended_fileP_str) != (snapshot_dct[''] is None)):
+            return self.copyto()
+
+        new_snapshot_dct = snapshot_path(self.local_fileP_str, digest_bl=self.snapshot_digest_bl)
+
+        if snapshot_dct[''] is not None:
+            if new_snapshot_dct == snapshot_dct:
+                log_obj.debug('Skipping the unchanged file "{:s}"'.format(self.local_fileP_str))
+            else:
+                self.copyto()
+
+            return None
+
+        nr_copied_int = 0
+        nr_linked_int = 0
+        copied_bytes_int = 0
+        start_sec_flt = time.perf_counter()
+
+        # Build the new tree next to the remote directory, with hard links to the unchanged remote files and copies
+        # of the changed and new files, and swap it into place; readers never see a mix of old and new entries and
+        # an interrupted synchronization leaves the remote directory untouched
+        tmp_dirP_str = _get_publish_tmp_fileP(self.transcended_fileP_str)
+        try:
+            for relP_str in sorted(new_snapshot_dct):
+                state_tpl = new_snapshot_dct[relP_str]
+                tmpP_str = os.path.join(tmp_dirP_str, relP_str)
+                if state_tpl is None:
+                    os.makedirs(tmpP_str, exist_ok=True)
+                    continue
+
+                remoteP_str = os.path.join(self.transcended_fileP_str, relP_str)
+                if (snapshot_dct.get(relP_str) == state_tpl) and (os.path.isfile(remoteP_str) is True):
+                    try:
+                        os.link(remoteP_str, tmpP_str)
+                        nr_linked_int += 1
+                        continue
+                    except OSError:
+                        # E.g. a file system without hard links; the file is copied instead
+                        pass
+
+                copy_file_with_stat(os.path.join(self.local_fileP_str, relP_str), tmpP_str)
+                _fsync_path(tmpP_str)
+                nr_copied_int += 1
+                copied_bytes_int += state_tpl[0]
+
+            for dirP_str, _, _ in os.walk(tmp_dirP_str, topdown=False):
+                _fsync_path(dirP_str)
+
+            _swap_into_place(tmp_dirP_str, self.transcended_fileP_str)
+
+        except BaseException:
+            shutil.rmtree(tmp_dirP_str, ignore_errors=True)
+            raise
+
+        if copied_bytes_int > 0:
+            get_io_stats().add('copyto', self.local_fileP_str, self.transcended_fileP_str, copied_bytes_int,
+                               time.perf_counter() - start_sec_flt)
+
+        log_obj.debug('Synchronized directory "{:s}" to "{:s}": {:d} file(s) copied, {:d} file(s) linked'.format(
+            self.local_fileP_str, self.transcended_fileP_str, nr_copied_int, nr_linked_int))
+
+    def mmap(self) -> mmap.mmap:
+        """A read-only memory map of the local file, which is closed by `cleanup`. The pages are read on demand
+        from the page cache; for the 'direct' and 'mmap' strategies of TFileFrom this is the remote file.
+
+        Returns
+        -------
+        mmap.mmap:
+            The memory map object."""
+
+        if self.mmap_obj is None:
+            with open(self.local_fileP_str, 'rb') as file_obj:
+                self.mmap_obj = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self.mmap_obj
+
+    @_record_io('cleanup')
     def cleanup(self):
         """Remove the temporary directory."""
 
-        if self.do_nothing_bl is False:
+        if self.mmap_obj is not None:
+            self.mmap_obj.close()
+            self.mmap_obj = None
+
+        if self.scratch_token_str is not None:
+            self.scratch_obj.release(self.scratch_token_str)
+            self.scratch_token_str = None
+
+        if (self.do_nothing_bl is False) and (self.strategy_str != 'copy'):
+            # The local file path is the remote file path; only remove the empty temporary directory
+            if self.temp_dirP_obj is not None:
+                self.temp_dirP_obj.cleanup()
+
+        elif self.do_nothing_bl is False:
             if os.path.exists(self.local_fileP_str) is True:
                 if self.temp_dirP_obj is not None:
                     self.temp_dirP_obj.cleanup()
@@ -155,7 +1447,12 @@ class TFile:
 
 class TFileFrom(TFile):
     def __init__(self, fileP_str: str, return_file_bl: bool = False, tmp_dirP_str: str = None,
-                 base_dirP_str: str = None, do_nothing_bl: bool = False):
+                 base_dirP_str: str = None, do_nothing_bl: bool = False, cache_obj: TFileCache = None,
+                 skip_unchanged_bl: bool = True, digest_bl: bool = False, archive_str: str = None,
+                 strategy_str: str = None, access_str: str = 'full',
+                 direct_threshold_bytes_int: int = DEFAULT_DIRECT_THRESHOLD_BYTES_INT,
+                 scratch_obj: ScratchAccountant = None, scratch_wait_sec_flt: float = None,
+                 defer_scratch_bl: bool = False, mmap_bl: bool = True):
         """
 
         Parameters
@@ -173,29 +1470,246 @@ class TFileFrom(TFile):
             find the temporary file when debugging the software.
         do_nothing_bl: bool
             If True, no files are copied or deleted.
+        cache_obj: TFileCache
+            The node-local read cache through which the file is copied; by default the process wide cache of
+            `get_tfile_cache`, if any. The cache is not used for directories or if `return_file_bl` is True,
+            since the cached files are read-only.
+        skip_unchanged_bl: bool
+            If True and `return_file_bl` is True, the state of the local file is recorded after it is copied from
+            the remote system, and only what changed is copied back; see `TFile.copyback`.
+        digest_bl: bool
+            If True, the content digests are also used to detect the changes; see `snapshot_path`.
+        archive_str: str
+            Either 'tar' or 'tar.gz' if the remote file is a directory archive, which is extracted to the local
+            directory, and copied back as an archive; see `TFile`. The archive type is not detected from the file.
+        strategy_str: str
+            How the file is staged:
+                'copy': the file is copied to the temporary location;
+                'direct': the file is not copied and `local_fileP_str` is the remote file path;
+                'mmap': as 'direct', but the file is memory mapped read-only when the context is entered; see
+                `TFile.mmap`;
+                'auto': the strategy is chosen by `choose_strategy`.
+            By default the environmental variable CLUSTERLIB_TFILE_STRATEGY or 'copy'. Directories and files that
+            are copied back (`return_file_bl` is True) are always copied.
+        access_str: str
+            The declared access pattern of the file for the 'auto' strategy: 'full' if the file is read entirely,
+            'partial' if only a small part of the file is read, e.g. a few datasets of a HDF5 file, and 'random'
+            if the file is read at random offsets.
+        direct_threshold_bytes_int: int
+            The 'auto' strategy only avoids the copy of files of at least this size; default is 1 GiB.
+        scratch_obj: ScratchAccountant
+            The scratch accountant with which the size of a file is reserved before it is copied; by default the
+            process wide accountant of `get_scratch_accountant`, if any. Directories are not accounted for.
+        scratch_wait_sec_flt: float
+            The maximum number of seconds to wait for the reservation, after which the file is accessed directly
+            instead; by default the environmental variable CLUSTERLIB_SCRATCH_WAIT_SEC or 600 seconds. A file that
+            is copied back (`return_file_bl` is True) is copied without a reservation instead.
+        defer_scratch_bl: bool
+            If True, the reservation is not made when the object is created, but together with the reservations of
+            the other files of a collection by `reserve_scratch_all`; `local_fileP_str` is only final after that.
+        mmap_bl: bool
+            If False, the file is never memory mapped and the 'mmap' strategy, requested or chosen by 'auto', is
+            staged as 'direct'; e.g. for the input files of a stage, since the stage function only gets the file
+            path. The 'mmap' strategy is only useful when the TFileFrom object itself is used, through `TFile.mmap`.
         """
 
-        super(TFileFrom, self).__init__(fileP_str, tmp_dirP_str, base_dirP_str, do_nothing_bl = do_nothing_bl)
+        super(TFileFrom, self).__init__(fileP_str, tmp_dirP_str, base_dirP_str, do_nothing_bl = do_nothing_bl,
+                                        archive_str = archive_str)
         self.return_file_bl = return_file_bl
+        self.skip_unchanged_bl = skip_unchanged_bl
+        self.digest_bl = digest_bl
+
+        if cache_obj is None:
+            cache_obj = get_tfile_cache()
+        self.cache_obj = cache_obj
+
+        if strategy_str is None:
+            strategy_str = os.getenv(STRATEGY_ENV_NAME_STR, 'copy')
+        if strategy_str not in STRATEGY_STR_LST:
+            err_str = 'The strategy "{:s}" is not one of {:s}.'
+            raise ValueError(err_str.format(str(strategy_str), str(STRATEGY_STR_LST)))
+        if access_str not in ACCESS_STR_LST:
+            err_str = 'The access pattern "{:s}" is not one of {:s}.'
+            raise ValueError(err_str.format(str(access_str), str(ACCESS_STR_LST)))
+        self.access_str = access_str
+        self.direct_threshold_bytes_int = direct_threshold_bytes_int
+        self.mmap_bl = mmap_bl
+
+        # The strategy has to be known before the context is entered, since it determines `local_fileP_str`
+        if (do_nothing_bl is False) and (strategy_str != 'copy'):
+            self.strategy_str = self.choose_strategy(strategy_str)
+            if self.strategy_str != 'copy':
+                self.local_fileP_str = self.transcended_fileP_str
+
+        if scratch_obj is None:
+            scratch_obj = get_scratch_accountant()
+        self.scratch_obj = scratch_obj
+
+        self.scratch_wait_sec_flt = scratch_wait_sec_flt
+        self.scratch_pending_bl = (do_nothing_bl is False) and (self.strategy_str == 'copy') \
+            and (scratch_obj is not None) and (os.path.isfile(self.transcended_fileP_str) is True)
+        if (self.scratch_pending_bl is True) and (defer_scratch_bl is False):
+            self.reserve_scratch(scratch_wait_sec_flt)
+
+    def reserve_scratch(self, wait_sec_flt: float = None):
+        """Reserve the size of the remote file with the scratch accountant; see `reserve_scratch_all`.
+
+        Parameters
+        ----------
+        wait_sec_flt: float
+            The maximum number of seconds to wait; see `TFileFrom`."""
+
+        reserve_scratch_all([self], wait_sec_flt)
+
+    def choose_strategy(self, strategy_str: str = 'auto') -> str:
+        """Choose how the file is staged. Directories, directory archives and files that are copied back are
+        always copied. For the 'auto' strategy, files smaller than `direct_threshold_bytes_int` are copied. Larger
+        files are accessed directly if only a part of the file is read, and memory mapped if the file is read at
+        random offsets. Files that are read fully are copied, unless they take more than half of the free space
+        of the temporary location, in which case they are accessed directly.
+
+        Parameters
+        ----------
+        strategy_str: str
+            The requested strategy; see `TFileFrom`.
+
+        Returns
+        -------
+        str:
+            Either 'copy', 'direct' or 'mmap'; 'mmap' only if `mmap_bl` is True and the file is not empty, otherwise
+            'direct' instead."""
+
+        if (self.return_file_bl is True) or (os.path.isfile(self.transcended_fileP_str) is False):
+            chosen_str = 'copy'
+            size_int = -1
+        else:
+            size_int = os.stat(self.transcended_fileP_str).st_size
+
+            if strategy_str != 'auto':
+                chosen_str = strategy_str
+            elif size_int < self.direct_threshold_bytes_int:
+                chosen_str = 'copy'
+            elif self.access_str == 'partial':
+                chosen_str = 'direct'
+            elif self.access_str == 'random':
+                chosen_str = 'mmap'
+            elif size_int > DEFAULT_SCRATCH_FRACTION_FLT * shutil.disk_usage(self.temp_dirP_str).free:
+                chosen_str = 'direct'
+            else:
+                chosen_str = 'copy'
+
+            if (chosen_str != 'copy') and (self.archive_str is not None):
+                chosen_str = 'copy'
+
+            # An empty file cannot be memory mapped
+            if (chosen_str == 'mmap') and ((self.mmap_bl is False) or (size_int == 0)):
+                chosen_str = 'direct'
+
+        log_obj.info('Staging "{:s}" with the "{:s}" strategy (requested "{:s}", {:d} bytes, access "{:s}")'.format(
+            self.transcended_fileP_str, chosen_str, strategy_str, size_int, self.access_str))
+
+        return chosen_str
 
     def _enter(self):
-        self.copyfrom()
+        if self.strategy_str == 'direct':
+            pass
+        elif self.strategy_str == 'mmap':
+            mmap_obj = self.mmap()
+            if (self.access_str == 'random') and (hasattr(mmap, 'MADV_RANDOM') is True):
+                mmap_obj.madvise(mmap.MADV_RANDOM)
+        elif (self.cache_obj is not None) and (self.return_file_bl is False) and (self.do_nothing_bl is False) \
+                and (os.path.isfile(self.transcended_fileP_str) is True):
+            os.makedirs(os.path.dirname(self.local_fileP_str), exist_ok = True)
+            start_sec_flt = time.perf_counter()
+            self.cache_obj.fetch(self.transcended_fileP_str, self.local_fileP_str)
+            self._mark_scratch_written()
+            get_io_stats().add('cachefetch', self.transcended_fileP_str, self.local_fileP_str,
+                               get_path_size(self.local_fileP_str), time.perf_counter() - start_sec_flt)
+
+            # A cached directory archive is extracted in place of the local copy
+            if self.archive_str is not None:
+                archive_fileP_str = self.local_fileP_str + '.archive'
+                os.replace(self.local_fileP_str, archive_fileP_str)
+                try:
+                    self.unpack_archive(archive_fileP_str)
+                finally:
+                    os.remove(archive_fileP_str)
+        else:
+            self.copyfrom()
+            self._mark_scratch_written()
+            if (self.return_file_bl is True) and (self.skip_unchanged_bl is True):
+                self.record_snapshot(digest_bl=self.digest_bl)
+
         return self
 
+    def _mark_scratch_written(self):
+        if self.scratch_token_str is not None:
+            self.scratch_obj.mark_written(self.scratch_token_str)
+
     def __enter__(self):
         return self._enter()
 
     def _exit(self):
         if self.return_file_bl is True:
-            self.copyto()
+            self.copyback()
         self.cleanup()
 
     def __exit__(self, exception_type_obj, exception_value_obj, traceback_obj):
         return self._exit()
 
 
+def reserve_scratch_all(tfile_obj_lst: List[TFile], wait_sec_flt: float = None):
+    """Reserve the sizes of the remote files of TFileFrom objects with their scratch accountant, all at once or none
+    of them, so that a process never holds a part of its reservations while it waits for the rest. If the
+    reservations are not admitted in time, or exceed the budget, the files are accessed directly instead of copied;
+    files that are copied back (`return_file_bl` is True) are copied without a reservation instead. Objects without
+    a pending reservation are skipped.
+
+    Parameters
+    ----------
+    tfile_obj_lst: list of TFile
+        The TFile objects.
+    wait_sec_flt: float
+        The maximum number of seconds to wait; by default the `scratch_wait_sec_flt` of the first object, or the
+        environmental variable CLUSTERLIB_SCRATCH_WAIT_SEC, or 600 seconds."""
+
+    pending_tfile_obj_lst = [tfile_obj for tfile_obj in tfile_obj_lst if tfile_obj.scratch_pending_bl is True]
+    if len(pending_tfile_obj_lst) == 0:
+        return
+
+    if wait_sec_flt is None:
+        wait_sec_flt = pending_tfile_obj_lst[0].scratch_wait_sec_flt
+    if wait_sec_flt is None:
+        wait_sec_flt = float(os.getenv(SCRATCH_WAIT_ENV_NAME_STR, DEFAULT_SCRATCH_WAIT_SEC_FLT))
+
+    # The files are reserved per scratch accountant; usually there is only the process wide accountant
+    tfile_obj_lst_dct = dict()
+    for tfile_obj in pending_tfile_obj_lst:
+        tfile_obj_lst_dct.setdefault(id(tfile_obj.scratch_obj), []).append(tfile_obj)
+
+    for _tfile_obj_lst in tfile_obj_lst_dct.values():
+        size_int_lst = [os.stat(tfile_obj.transcended_fileP_str).st_size for tfile_obj in _tfile_obj_lst]
+        token_str_lst = _tfile_obj_lst[0].scratch_obj.reserve_lst(size_int_lst, wait_sec_flt)
+
+        for idx, tfile_obj in enumerate(_tfile_obj_lst):
+            tfile_obj.scratch_pending_bl = False
+            if token_str_lst is not None:
+                tfile_obj.scratch_token_str = token_str_lst[idx]
+
+            elif tfile_obj.return_file_bl is True:
+                log_obj.warning('Staging "{:s}" without a scratch reservation, since it is copied back'.format(
+                    tfile_obj.transcended_fileP_str))
+
+            else:
+                log_obj.info('Staging "{:s}" with the "direct" strategy, since the scratch budget is '
+                             'exhausted'.format(tfile_obj.transcended_fileP_str))
+                tfile_obj.strategy_str = 'direct'
+                tfile_obj.local_fileP_str = tfile_obj.transcended_fileP_str
+
+
 class TFileTo(TFile):
-    def __init__(self, fileP_str: str, tmp_dirP_str: str = None, base_dirP_str: str = None, do_nothing_bl: bool = False):
+    def __init__(self, fileP_str: str, tmp_dirP_str: str = None, base_dirP_str: str = None, do_nothing_bl: bool = False,
+                 write_behind_bl: bool = None, archive_str: str = None):
         """
 
         Parameters
@@ -210,9 +1724,23 @@ class TFileTo(TFile):
             find the temporary file when debugging the software.
         do_nothing_bl: bool
             If True, no files are copied or deleted.
+        write_behind_bl: bool
+            If True, the file is copied to its destination by a background thread once the context closes, so
+            that the process can continue with other work; `flush_write_behind` waits for the copies to finish.
+            The copies that are still pending are flushed when the process exits, and the process exits with
+            status 1 if any of them failed. By default, write-behind is enabled if the environmental variable CLUSTERLIB_TFILE_WRITE_BEHIND is
+            set to a non-empty value other than "0".
+        archive_str: str
+            If either 'tar' or 'tar.gz' and the local file is a directory, it is written to `fileP_str` as a single
+            archive file; see `write_dir_archive`.
         """
 
-        super(TFileTo, self).__init__(fileP_str, tmp_dirP_str, base_dirP_str, do_nothing_bl = do_nothing_bl)
+        super(TFileTo, self).__init__(fileP_str, tmp_dirP_str, base_dirP_str, do_nothing_bl = do_nothing_bl,
+                                      archive_str = archive_str)
+
+        if write_behind_bl is None:
+            write_behind_bl = os.getenv(WRITE_BEHIND_ENV_NAME_STR, '') not in ('', '0')
+        self.write_behind_bl = write_behind_bl
 
     def _enter(self):
         return self
@@ -220,9 +1748,18 @@ class TFileTo(TFile):
     def __enter__(self):
         return self._enter()
 
+    def _copyto_cleanup(self):
+        try:
+            self.copyto()
+        finally:
+            self.cleanup()
+
     def _exit(self):
-        self.copyto()
-        self.cleanup()
+        if self.write_behind_bl is True:
+            get_write_behind_uploader().submit(self)
+        else:
+            self.copyto()
+            self.cleanup()
 
     def __exit__(self, exception_type_obj, exception_value_obj, traceback_obj):
         return self._exit()
@@ -233,7 +1770,8 @@ class TFileToOrFrom(TFile):
     behaves likes TFileTo."""
 
     def __init__(self, fileP_str: str, return_file_bl: bool = False, tmp_dirP_str: str = None,
-                 base_dirP_str: str = None, do_nothing_bl: bool = False):
+                 base_dirP_str: str = None, do_nothing_bl: bool = False, skip_unchanged_bl: bool = True,
+                 digest_bl: bool = False, archive_str: str = None):
         """
 
         Parameters
@@ -251,43 +1789,239 @@ class TFileToOrFrom(TFile):
             find the temporary file when debugging the software.
         do_nothing_bl: bool
             If True, no files are copied or deleted.
+        skip_unchanged_bl: bool
+            If True and the file is copied from the remote system with `return_file_bl` True, only what changed
+            is copied back; see `TFile.copyback`.
+        digest_bl: bool
+            If True, the content digests are also used to detect the changes; see `snapshot_path`.
+        archive_str: str
+            Either 'tar' or 'tar.gz' to copy a directory as an archive, and to extract the remote file as a
+            directory archive; see `TFile`. The archive type is not detected from the file.
         """
 
-        super(TFileToOrFrom, self).__init__(fileP_str, tmp_dirP_str, base_dirP_str, do_nothing_bl = do_nothing_bl)
+        super(TFileToOrFrom, self).__init__(fileP_str, tmp_dirP_str, base_dirP_str, do_nothing_bl = do_nothing_bl,
+                                            archive_str = archive_str)
         self.return_file_bl = return_file_bl
+        self.skip_unchanged_bl = skip_unchanged_bl
+        self.digest_bl = digest_bl
 
         if os.path.exists(fileP_str) is True:
             self.behave_like_TFileTo_bl = False  # Behave like TFileFrom
         else:
             self.behave_like_TFileTo_bl = True  # Behave like TFileTo
 
-    def __enter__(self):
-        if self.behave_like_TFileTo_bl is True:
-            return self
-        else:
+    def _enter(self):
+        if self.behave_like_TFileTo_bl is False:
             self.copyfrom()
-            return self
+            if (self.return_file_bl is True) and (self.skip_unchanged_bl is True):
+                self.record_snapshot(digest_bl=self.digest_bl)
 
-    def __exit__(self, exception_type_obj, exception_value_obj, traceback_obj):
+        return self
+
+    def __enter__(self):
+        return self._enter()
+
+    def _exit(self):
         if self.behave_like_TFileTo_bl is True:
             self.copyto()
-            self.cleanup()
-        else:
-            if self.return_file_bl is True:
-                self.copyto()
-            self.cleanup()
+        elif self.return_file_bl is True:
+            self.copyback()
+        self.cleanup()
+
+    def __exit__(self, exception_type_obj, exception_value_obj, traceback_obj):
+        return self._exit()
+
+
+class TFileCollectionError(Exception):
+    """One or more of the files of a TFileCollection failed to stage in or out."""
+
+    def __init__(self, err_tpl_lst: List[Tuple[TFile, BaseException]]):
+        """
+
+        Parameters
+        ----------
+        err_tpl_lst: list of tuple
+            The TFile objects that failed and their exceptions.
+        """
+
+        self.err_tpl_lst = err_tpl_lst
+
+        err_str = '{:d} file(s) failed to stage:'.format(len(err_tpl_lst))
+        for tfile_obj, exception_obj in err_tpl_lst:
+            err_str += '\n  "{:s}": {:s}: {:s}'.format(tfile_obj.transcended_fileP_str,
+                                                      type(exception_obj).__name__,
+                                                      str(exception_obj))
+
+        super(TFileCollectionError, self).__init__(err_str)
 
 
 class TFileCollection:
-    def __init__(self, tfile_obj_lst: List[Union[TFileFrom, TFileTo]]):
+    """Stage a collection of TFile objects in and out concurrently through a bounded thread pool."""
+
+    def __init__(self, tfile_obj_lst: List[Union[TFileFrom, TFileTo, TFileToOrFrom]],
+                 max_workers_int: int = DEFAULT_MAX_WORKERS_INT):
+        """
+
+        Parameters
+        ----------
+        tfile_obj_lst: list of TFile
+            The TFile objects of the collection.
+        max_workers_int: int
+            The maximum number of files that are staged concurrently; if 1, then the files are staged one after
+            the other.
+        """
+
         self.tfile_obj_lst = tfile_obj_lst
+        self.max_workers_int = max(1, max_workers_int)
+
+        # The deferred scratch reservations of the collection are made at once
+        reserve_scratch_all(tfile_obj_lst)
+
+    def _map(self, func_obj: Callable[[TFile], object]) -> List[Tuple[TFile, BaseException]]:
+        """Call a function on all the TFile objects and return the TFile objects that failed with their
+        exceptions."""
+
+        err_tpl_lst = []
+
+        if (self.max_workers_int == 1) or (len(self.tfile_obj_lst) <= 1):
+            for tfile_obj in self.tfile_obj_lst:
+                try:
+                    func_obj(tfile_obj)
+                except Exception as exception_obj:
+                    err_tpl_lst.append((tfile_obj, exception_obj))
+
+            return err_tpl_lst
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers_int, len(self.tfile_obj_lst))) as executor_obj:
+            future_tpl_lst = [(tfile_obj, executor_obj.submit(func_obj, tfile_obj))
+                              for tfile_obj in self.tfile_obj_lst]
+
+            for tfile_obj, future_obj in future_tpl_lst:
+                exception_obj = future_obj.exception()
+                if exception_obj is not None:
+                    err_tpl_lst.append((tfile_obj, exception_obj))
+
+        return err_tpl_lst
+
+    @staticmethod
+    def _cleanup(tfile_obj: TFile):
+        tfile_obj.cleanup()
+
+    @staticmethod
+    def _enter_tfile(tfile_obj: TFile):
+        tfile_obj._enter()
+
+    @staticmethod
+    def _exit_tfile(tfile_obj: TFile):
+        try:
+            tfile_obj._exit()
+
+        except Exception:
+            # Make sure that the temporary files are removed even if the copy failed
+            tfile_obj.cleanup()
+            raise
 
     def __enter__(self):
-        for tfile_obj in self.tfile_obj_lst:
-            tfile_obj._enter()
+        err_tpl_lst = self._map(self._enter_tfile)
+
+        if len(err_tpl_lst) > 0:
+            # Remove the temporary files of all the files, since __exit__ will not be called
+            self._map(self._cleanup)
+            raise TFileCollectionError(err_tpl_lst)
 
         return self
 
     def __exit__(self, exception_type_obj, exception_value_obj, traceback_obj):
-        for tfile_obj in self.tfile_obj_lst:
-            tfile_obj._exit()
+        err_tpl_lst = self._map(self._exit_tfile)
+
+        if len(err_tpl_lst) > 0:
+            raise TFileCollectionError(err_tpl_lst)
+
+
+class WriteBehindUploader:
+    """Copy TFileTo files to their destination in background threads; refer to `get_write_behind_uploader`."""
+
+    def __init__(self, max_workers_int: int = DEFAULT_MAX_WORKERS_INT):
+        """
+
+        Parameters
+        ----------
+        max_workers_int: int
+            The maximum number of files that are copied concurrently.
+        """
+
+        self._executor_obj = ThreadPoolExecutor(max_workers=max(1, max_workers_int))
+        self._future_tpl_lst = []
+        self._lock_obj = threading.Lock()
+
+    def submit(self, tfile_obj: TFileTo):
+        """Start to copy the file to its destination and remove the temporary file afterwards."""
+
+        log_obj.debug('Queueing write-behind copy to "{:s}"'.format(tfile_obj.transcended_fileP_str))
+
+        with self._lock_obj:
+            self._future_tpl_lst.append((tfile_obj, self._executor_obj.submit(tfile_obj._copyto_cleanup)))
+
+    def flush(self):
+        """Wait until all the submitted files have been copied.
+
+        Raises
+        ------
+        TFileCollectionError:
+            If any of the copies failed."""
+
+        with self._lock_obj:
+            future_tpl_lst = self._future_tpl_lst
+            self._future_tpl_lst = []
+
+        err_tpl_lst = []
+        for tfile_obj, future_obj in future_tpl_lst:
+            exception_obj = future_obj.exception()
+            if exception_obj is not None:
+                err_tpl_lst.append((tfile_obj, exception_obj))
+
+        if len(err_tpl_lst) > 0:
+            raise TFileCollectionError(err_tpl_lst)
+
+
+_write_behind_uploader_obj = None
+
+
+def get_write_behind_uploader() -> WriteBehindUploader:
+    """Get the process wide write-behind uploader; the uploader is flushed when the process exits, and the process
+    exits with status 1 if any of the copies failed, so that a missing output is never reported as a success."""
+
+    global _write_behind_uploader_obj
+
+    if _write_behind_uploader_obj is None:
+        _write_behind_uploader_obj = WriteBehindUploader()
+        atexit.register(_flush_write_behind_at_exit)
+
+    return _write_behind_uploader_obj
+
+
+def flush_write_behind():
+    """Wait until all the write-behind copies of the process have finished; this is the flush barrier of the
+    write-behind TFileTo objects.
+
+    Raises
+    ------
+    TFileCollectionError:
+        If any of the copies failed."""
+
+    if _write_behind_uploader_obj is not None:
+        _write_behind_uploader_obj.flush()
+
+
+def _flush_write_behind_at_exit():
+    try:
+        flush_write_behind()
+    except TFileCollectionError as exception_obj:
+        log_obj.error(str(exception_obj))
+
+        # An exit handler cannot change the exit status of the interpreter; the process is ended with status 1
+        # instead, after the log messages have been written
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
@@ -3,7 +3,14 @@ https://ccl.cse.nd.edu/software/manuals/makeflow.html. The classes produce JX fo
 the specifications of the JX format is defined
 in: https://ccl.cse.nd.edu/software/manuals/jx.html."""
 
-from typing import List, Union
+import re
+from typing import List, Tuple, Union
+
+
+RANGE_LETTER_STR = 'N'
+INTEGER_RE_OBJ = re.compile(r'([0-9]+)')
+# The name of the category that the rules with a range share, by the number of cores and the memory in MB
+RANGE_CATEGORY_NAME_FORMAT_STR = 'range_{:d}cores_{:d}MB'
 
 
 class Category:
@@ -64,7 +71,7 @@ class Rule:
     https://ccl.cse.nd.edu/software/manuals/makeflow.html#rescat."""
 
     def __init__(self, range_letter_str: str = None, range_start_int: int = None, range_end_int: int = None,
-                 category_obj: Category = None):
+                 category_obj: Category = None, priority_int: int = None, local_job_bl: bool = False):
         """
         Parameters
         ----------
@@ -77,6 +84,13 @@ class Rule:
             The last number of the range.
         category_obj: Category
             The resources category associated with this rule.
+        priority_int: int
+            The priority hint of the rule; rules with a larger value should be dispatched first. If
+            `priority_int` is None, then no priority is set in the Makeflow JX file. Only set this for
+            Makeflow versions that accept the "priority" rule key.
+        local_job_bl: bool
+            If True, the rule is executed on the machine that runs makeflow instead of being submitted
+            to the batch system.
         """
 
         self.range_letter_str = range_letter_str
@@ -94,6 +108,8 @@ class Rule:
             self.range_end_int = range_end_int
 
         self.category_obj = category_obj
+        self.priority_int = priority_int
+        self.local_job_bl = local_job_bl
 
         self.cmd_str = None
         self.input_fileP_str_lst = None
@@ -177,12 +193,21 @@ class Rule:
             out_format_kwargs_dct['outputs_str'] = outputs_str
 
         if isinstance(self.category_obj, Category) is True:
-            category_str = '"{:s}"'.format(self.category_obj.category_name_str)
+            category_str = self._replace_range_letter(self.category_obj.category_name_str)
 
             out_format_str += """,
     "category": {category_str}"""
             out_format_kwargs_dct['category_str'] = category_str
 
+        if isinstance(self.priority_int, int) is True:
+            out_format_str += """,
+    "priority": {priority_int:d}"""
+            out_format_kwargs_dct['priority_int'] = self.priority_int
+
+        if self.local_job_bl is True:
+            out_format_str += """,
+    "local_job": true"""
+
         out_format_str += """
 }}"""
 
@@ -196,8 +221,23 @@ class Rule:
 class JxMakeflow:
     """Create JX formatted makeflow strings."""
 
-    def __init__(self):
+    def __init__(self, compress_ranges_bl: bool = True, min_range_length_int: int = 2):
+        """
+        Parameters
+        ----------
+        compress_ranges_bl: bool
+            If True, consecutive rules that only differ by an integer that increments by one from rule to
+            rule, are collapsed into a single rule with a range; e.g. `out_foo_17.p`, `out_foo_18.p`, ...
+        min_range_length_int: int
+            The minimum number of consecutive rules that are collapsed into a single rule with a range.
+        """
+
+        self.compress_ranges_bl = compress_ranges_bl
+        self.min_range_length_int = min_range_length_int
+
         self.environment_obj_lst = []
+        # The categories that are added with `add_category`; the categories of the rules are added when the JX
+        # string is created, since collapsed rules share a category
         self.category_obj_lst = []
         self.rule_obj_lst = []
 
@@ -215,11 +255,184 @@ class JxMakeflow:
     def add_rule(self, rule_obj: Rule):
         """Add a Makeflow rule."""
 
-        if rule_obj.category_obj is not None:
-            self.category_obj_lst.append(rule_obj.category_obj)
-
         self.rule_obj_lst.append(rule_obj)
 
+    @staticmethod
+    def _tokenize_rule(rule_obj: Rule) -> Union[Tuple[tuple, List[str]], None]:
+        """Split the strings of a rule into the text between the integers and the integers.
+
+        Returns
+        -------
+        tuple:
+            The template of the rule, which is equal for rules that only differ by their integers.
+        list of str:
+            The integers of the rule strings.
+        None:
+            If the rule cannot be collapsed into a range."""
+
+        if (rule_obj.range_letter_str is not None) or (rule_obj.cmd_str is None):
+            return None
+
+        str_lst = [rule_obj.cmd_str]
+        if rule_obj.input_fileP_str_lst is not None:
+            str_lst += rule_obj.input_fileP_str_lst
+        if rule_obj.output_fileP_str_lst is not None:
+            str_lst += rule_obj.output_fileP_str_lst
+
+        # The category names of the rules of a run may only differ by their integers, e.g. the default category
+        # of every stage of a sweep; the run then shares a category with the same resources
+        template_lst = [
+            None if rule_obj.input_fileP_str_lst is None else len(rule_obj.input_fileP_str_lst),
+            None if rule_obj.output_fileP_str_lst is None else len(rule_obj.output_fileP_str_lst),
+            None if rule_obj.category_obj is None else (INTEGER_RE_OBJ.sub('', rule_obj.category_obj.category_name_str),
+                                                        rule_obj.category_obj.cores_int,
+                                                        rule_obj.category_obj.mem_MB_int),
+            rule_obj.priority_int,
+            rule_obj.local_job_bl
+        ]
+        number_str_lst = []
+        range_marker_str = '+' + RANGE_LETTER_STR + '+'
+        for _str in str_lst:
+            if range_marker_str in _str:
+                return None
+
+            part_str_lst = INTEGER_RE_OBJ.split(_str)
+            template_lst.append(tuple(part_str_lst[0::2]))
+            number_str_lst += part_str_lst[1::2]
+
+        return tuple(template_lst), number_str_lst
+
+    @staticmethod
+    def _crt_range_rule(rule_obj: Rule, range_idx_lst: List[int], range_start_int: int,
+                        range_end_int: int, shared_category_bl: bool = False) -> Rule:
+        """Create a rule with a range from the first rule of a run of homogeneous rules.
+
+        Parameters
+        ----------
+        rule_obj: Rule
+            The first rule of the run.
+        range_idx_lst: list of int
+            The indices of the integers, in the order of `_tokenize_rule`, that are replaced by the range letter.
+        range_start_int: int
+            The starting number of the range.
+        range_end_int: int
+            The end of the range, which is excluded.
+        shared_category_bl: bool
+            If True, the rules of the run have different categories, and the range rule gets the category with
+            the same resources that the range rules share; refer to `RANGE_CATEGORY_NAME_FORMAT_STR`."""
+
+        range_idx_set = set(range_idx_lst)
+        number_idx_lst = [0]
+
+        def _replace_numbers(_str: str) -> str:
+            _part_str_lst = INTEGER_RE_OBJ.split(_str)
+            for _idx in range(1, len(_part_str_lst), 2):
+                if number_idx_lst[0] in range_idx_set:
+                    _part_str_lst[_idx] = '+' + RANGE_LETTER_STR + '+'
+                number_idx_lst[0] += 1
+
+            return ''.join(_part_str_lst)
+
+        cmd_str = _replace_numbers(rule_obj.cmd_str)
+
+        input_fileP_str_lst = None
+        if rule_obj.input_fileP_str_lst is not None:
+            input_fileP_str_lst = [_replace_numbers(_str) for _str in rule_obj.input_fileP_str_lst]
+
+        output_fileP_str_lst = None
+        if rule_obj.output_fileP_str_lst is not None:
+            output_fileP_str_lst = [_replace_numbers(_str) for _str in rule_obj.output_fileP_str_lst]
+
+        category_obj = rule_obj.category_obj
+        if (category_obj is not None) and (shared_category_bl is True):
+            category_obj = Category(category_name_str=RANGE_CATEGORY_NAME_FORMAT_STR.format(category_obj.cores_int,
+                                                                                            category_obj.mem_MB_int),
+                                    cores_int=category_obj.cores_int,
+                                    mem_MB_int=category_obj.mem_MB_int)
+
+        range_rule_obj = Rule(range_letter_str=RANGE_LETTER_STR,
+                              range_start_int=range_start_int,
+                              range_end_int=range_end_int,
+                              category_obj=category_obj,
+                              priority_int=rule_obj.priority_int,
+                              local_job_bl=rule_obj.local_job_bl)
+        range_rule_obj.set_command(cmd_str, input_fileP_str_lst, output_fileP_str_lst)
+
+        return range_rule_obj
+
+    def _compress_rules(self) -> List[Rule]:
+        """Collapse the runs of consecutive rules that only differ by an integer, which increments by one from
+        rule to rule, into rules with a range."""
+
+        token_tpl_lst = [self._tokenize_rule(rule_obj) for rule_obj in self.rule_obj_lst]
+
+        rule_obj_lst = []
+        rule_idx = 0
+        while rule_idx < len(self.rule_obj_lst):
+            run_length_int = 1
+            range_idx_lst = []
+            range_start_int = None
+
+            if (token_tpl_lst[rule_idx] is not None) and (rule_idx + 1 < len(self.rule_obj_lst)) \
+                    and (token_tpl_lst[rule_idx + 1] is not None) \
+                    and (token_tpl_lst[rule_idx][0] == token_tpl_lst[rule_idx + 1][0]):
+                template_tpl, number_str_lst = token_tpl_lst[rule_idx]
+                next_number_str_lst = token_tpl_lst[rule_idx + 1][1]
+
+                # The integers that differ between the first two rules have to be the same number, which
+                # has to increment by one
+                range_idx_lst = [idx for idx, number_str in enumerate(number_str_lst)
+                                 if number_str != next_number_str_lst[idx]]
+                if len(range_idx_lst) > 0:
+                    start_str = number_str_lst[range_idx_lst[0]]
+                    if start_str == str(int(start_str)):
+                        range_start_int = int(start_str)
+                    for idx in range_idx_lst:
+                        if (range_start_int is None) or (number_str_lst[idx] != start_str) \
+                                or (next_number_str_lst[idx] != str(range_start_int + 1)):
+                            range_start_int = None
+                            break
+
+                if range_start_int is not None:
+                    range_idx_set = set(range_idx_lst)
+                    while rule_idx + run_length_int < len(self.rule_obj_lst):
+                        next_token_tpl = token_tpl_lst[rule_idx + run_length_int]
+                        if (next_token_tpl is None) or (next_token_tpl[0] != template_tpl):
+                            break
+
+                        range_number_str = str(range_start_int + run_length_int)
+                        homogeneous_bl = True
+                        for idx, number_str in enumerate(next_token_tpl[1]):
+                            if idx in range_idx_set:
+                                homogeneous_bl = number_str == range_number_str
+                            else:
+                                homogeneous_bl = number_str == number_str_lst[idx]
+
+                            if homogeneous_bl is False:
+                                break
+
+                        if homogeneous_bl is False:
+                            break
+
+                        run_length_int += 1
+
+            if (range_start_int is not None) and (run_length_int >= max(self.min_range_length_int, 2)):
+                category_name_str_set = {None if _rule_obj.category_obj is None
+                                         else _rule_obj.category_obj.category_name_str
+                                         for _rule_obj in self.rule_obj_lst[rule_idx:rule_idx + run_length_int]}
+                rule_obj_lst.append(self._crt_range_rule(self.rule_obj_lst[rule_idx],
+                                                         range_idx_lst,
+                                                         range_start_int,
+                                                         range_start_int + run_length_int,
+                                                         len(category_name_str_set) > 1))
+            else:
+                run_length_int = 1
+                rule_obj_lst.append(self.rule_obj_lst[rule_idx])
+
+            rule_idx += run_length_int
+
+        return rule_obj_lst
+
     @staticmethod
     def _indent_lines(str_str, nr_spacesers_int = 0, spacer_str = ' '):
         indent_str = spacer_str * nr_spacesers_int
@@ -232,12 +445,25 @@ class JxMakeflow:
         if len(self.rule_obj_lst) == 0:
             return ''
 
+        if self.compress_ranges_bl is True:
+            rule_obj_lst = self._compress_rules()
+        else:
+            rule_obj_lst = self.rule_obj_lst
+
+        # The same category is added for every rule that uses it
+        category_obj_dct = dict()
+        for category_obj in self.category_obj_lst + [rule_obj.category_obj for rule_obj in rule_obj_lst
+                                                     if rule_obj.category_obj is not None]:
+            if category_obj.category_name_str not in category_obj_dct:
+                category_obj_dct[category_obj.category_name_str] = category_obj
+        category_obj_lst = list(category_obj_dct.values())
+
         out_str = '{'
-        if len(self.category_obj_lst) > 0:
+        if len(category_obj_lst) > 0:
             out_str += self._indent_lines('\n"categories": {', tab_size_int)
-            out_str += self._indent_lines('\n' + str(self.category_obj_lst[0]), 2 * tab_size_int)
+            out_str += self._indent_lines('\n' + str(category_obj_lst[0]), 2 * tab_size_int)
 
-            for category_obj in self.category_obj_lst[1:]:
+            for category_obj in category_obj_lst[1:]:
                 out_str += ','
                 out_str += self._indent_lines('\n' + str(category_obj), 2 * tab_size_int)
 
@@ -254,8 +480,8 @@ class JxMakeflow:
             out_str += self._indent_lines('\n},', tab_size_int)
 
         out_str += self._indent_lines('\n"rules": [', tab_size_int)
-        out_str += self._indent_lines('\n' + str(self.rule_obj_lst[0]), 2 * tab_size_int)
-        for rule_obj in self.rule_obj_lst[1:]:
+        out_str += self._indent_lines('\n' + str(rule_obj_lst[0]), 2 * tab_size_int)
+        for rule_obj in rule_obj_lst[1:]:
             out_str += ','
             out_str += self._indent_lines('\n' + str(rule_obj), 2 * tab_size_int)
 
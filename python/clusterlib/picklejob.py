@@ -2,17 +2,16 @@ import os
 import re
 import copy
 import json
-import secrets
 import cloudpickle
 from inspect import signature
 import clusterlib.file as TFile
 from collections import OrderedDict
 from typing import Any, Callable, Dict, List, Tuple, Union
+from clusterlib.picklerun import PickleVariable, PickleVariableJSONEncoder, pickle_job_execute
 from clusterlib.executor import StageAbstract, Stage, StageInputFile, StageOutputFile, StageAbstractCollection_type, \
-    MakeflowFromStages
+    MakeflowFromStages, StageGraph, read_io_summaries, get_graph_stage
 
 
-HASH_STRING_BYTES_INT = 32
 LIMIT_NUMBER_RECORDED_PICKLES_INT = 1024
 
 
@@ -38,196 +37,6 @@ class PickleJobAbstract:
         raise NotImplementedError()
 
 
-# ---------------------------------------------------------------------------------------------------------------------
-# -------------------------------------------------- PickleVariable  --------------------------------------------------
-# -------------------------------------------------       BEGIN       -------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
-class PickleVariable:
-    def __init__(self, pickle_job_obj: PickleJobAbstract, pckl_parm_fileP_str: str, tpl_idx: Union[int, None] = None,
-                 hash_key_str: str = None):
-        """
-        Parameters
-        ----------
-        pickle_job_obj: PickleJobAbstract
-            The pickle job that create the output parameter associated with the pickle variable.
-        pckl_parm_fileP_str: str
-            The file location where output parameters are pickeled.
-        tpl_idx: int
-            The tuple output number that is selected.
-        hash_key_str: str
-            The hash key of this variable.
-        """
-
-        self.pickle_job_obj = pickle_job_obj
-        self.pckl_parm_fileP_str = pckl_parm_fileP_str
-        self.tpl_idx = tpl_idx
-        self.hash_key_str = hash_key_str
-
-    def to_json(self):
-        return_dct = {
-            'pickle_job_obj': None,
-            'pckl_parm_fileP_str': self.pckl_parm_fileP_str,
-            'tpl_idx': self.tpl_idx,
-            'hash_key_str': self.hash_key_str
-        }
-
-        return return_dct
-
-    @staticmethod
-    def from_json(kwargs):
-        return PickleVariable(**kwargs)
-
-    def _assert_hash_key(self):
-        if self.hash_key_str is None:
-            err_str = 'The hash key has to be set first before using the PickleVariable.'
-            raise ValueError(err_str)
-
-    def set_hash_key(self, hash_str: str = None):
-        # if self.hash_key_str is not None:
-        #     err_str = 'The has key has already been set.'
-        #     raise ValueError(err_str)
-
-        # if hash_str is None:
-        #     hash_str = secrets.token_hex(HASH_STRING_BYTES_INT)
-
-        hash_str = secrets.token_hex(HASH_STRING_BYTES_INT)
-
-        self.hash_key_str = hash_str
-
-    def get_hash_key(self):
-        self._assert_hash_key()
-
-        return self.hash_key_str
-
-    def get_pickle_job_obj(self) -> PickleJobAbstract:
-        self._assert_hash_key()
-
-        return self.pickle_job_obj
-
-    def get_fileP_str(self) -> str:
-        self._assert_hash_key()
-
-        return self.pckl_parm_fileP_str
-
-    def get_tpl_index(self) -> Union[int, None]:
-        self._assert_hash_key()
-
-        return self.tpl_idx
-
-    def __str__(self):
-        return self.get_hash_key()
-
-    @staticmethod
-    def expand_pickle_variables(var_obj, stage_input_file_obj_dct, index_tuple_dct, depend_pickle_job_obj_lst):
-        """For a given list, dictionary or object, if the object is a PickleVariable,
-        set the has key and create a StageInputFile object and tuple mapping.
-
-        TODO: Write up better documentation."""
-
-        if isinstance(var_obj, PickleVariable) is True:
-            var_obj.set_hash_key()
-            hash_key_str = str(var_obj)
-
-            if hash_key_str in stage_input_file_obj_dct:
-                err_str = f'Random hash key "{hash_key_str}" is already present in stage input file dictionary.'
-                raise ValueError(err_str)
-
-            stage_input_file_obj_dct[hash_key_str] = StageInputFile(var_obj.get_fileP_str())
-            index_tuple_dct[hash_key_str] = var_obj.get_tpl_index()
-            depend_pickle_job_obj_lst.append(var_obj.get_pickle_job_obj())
-
-        elif isinstance(var_obj, list) is True:
-            for _var_obj in var_obj:
-                PickleVariable.expand_pickle_variables(_var_obj,
-                                                       stage_input_file_obj_dct,
-                                                       index_tuple_dct,
-                                                       depend_pickle_job_obj_lst)
-
-        elif isinstance(var_obj, tuple) is True:
-            for _var_obj in var_obj:
-                PickleVariable.expand_pickle_variables(_var_obj,
-                                                       stage_input_file_obj_dct,
-                                                       index_tuple_dct,
-                                                       depend_pickle_job_obj_lst)
-
-        elif isinstance(var_obj, dict) is True:
-            for _var_obj in var_obj.values():
-                PickleVariable.expand_pickle_variables(_var_obj,
-                                                       stage_input_file_obj_dct,
-                                                       index_tuple_dct,
-                                                       depend_pickle_job_obj_lst)
-
-    @staticmethod
-    def contract_pickle_variables(var_obj, stage_input_file_obj_dct, index_tuple_dct):
-        """Opposite of `expand_pickle_variables`.
-
-        TODO: Write up better documentation."""
-
-        return_obj = None
-
-        if isinstance(var_obj, PickleVariable) is True:
-            # Get the has key
-            hash_key_str = var_obj.get_hash_key()
-
-            # Load the pickle file
-            with open(stage_input_file_obj_dct[hash_key_str], 'rb') as file_obj:
-                data_tpl = cloudpickle.load(file_obj)
-
-            if index_tuple_dct[hash_key_str] is None:
-                return_obj = data_tpl
-            elif isinstance(data_tpl, tuple):
-                return_obj = data_tpl[index_tuple_dct[hash_key_str]]
-            else:
-                return_obj = data_tpl
-
-        elif isinstance(var_obj, list) is True:
-            return_obj = []
-            for _var_obj in var_obj:
-                return_obj.append(PickleVariable.contract_pickle_variables(_var_obj,
-                                                                           stage_input_file_obj_dct,
-                                                                           index_tuple_dct))
-
-        elif isinstance(var_obj, tuple) is True:
-            return_obj = []
-            for _var_obj in var_obj:
-                return_obj.append(PickleVariable.contract_pickle_variables(_var_obj,
-                                                                           stage_input_file_obj_dct,
-                                                                           index_tuple_dct))
-            return_obj = tuple(return_obj)
-
-        elif isinstance(var_obj, dict) is True:
-            return_obj = dict()
-            for key_str, _var_obj in var_obj.items():
-                return_obj[key_str] = PickleVariable.contract_pickle_variables(_var_obj,
-                                                                               stage_input_file_obj_dct,
-                                                                               index_tuple_dct)
-
-        else:
-            return_obj = var_obj
-
-        return return_obj
-
-
-# ---------------------------------------------------------------------------------------------------------------------
-# --------------------------------------------------- JSON Encoder  ---------------------------------------------------
-# -------------------------------------------------       BEGIN       -------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
-class PickleVariableJSONEncoder(json.JSONEncoder):
-    def default(self, obj):  # pylint: disable=method-hidden
-        if isinstance(obj, PickleVariable) is True:
-            return dict(PickleVariable=obj.to_json())
-
-        # Let the base class default method raise the TypeError
-        return json.JSONEncoder.default(self, obj)
-
-    @classmethod
-    def decode(cls, dct):
-        if 'PickleVariable' in dct:
-            return PickleVariable.from_json(dct['PickleVariable'])
-
-        return dct
-
-
 # ---------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------ PickleJobOrganizer  ------------------------------------------------
 # -------------------------------------------------       BEGIN       -------------------------------------------------
@@ -439,8 +248,9 @@ class PickleJob(PickleJobAbstract):
         else:
             self._depend_pickle_job_obj_lst: Union[List[PickleJobAbstract], None] = depend_pickle_job_obj_lst
 
-        # Create the stage object place holder
-        self._stage_obj: Union[Stage, None] = None
+        # The stage graph of the stage; the stage itself is only kept by the graph, which can spill it to disk
+        self._graph_stage_dct: Union[Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]], StageGraph,
+                                     None] = None
 
     def __check_input_parm_signature(self):
         """Check if the keyword arguments of the given callable object matches with the
@@ -564,7 +374,8 @@ class PickleJob(PickleJobAbstract):
         # Check the extention of the file; if the extention is json, then we serialize with json otherwise with pickle
         json_bl = pickle_fileP_str.split('.')[-1].lower() == 'json'
 
-        with TFile.TFileTo(pickle_fileP_str) as tfile_obj:
+        # The job files have to exist before the makeflow file is submitted, so they are never written behind
+        with TFile.TFileTo(pickle_fileP_str, write_behind_bl=False) as tfile_obj:
             if json_bl is False:
                 with open(tfile_obj.local_fileP_str, 'wb') as file_obj:
                     cloudpickle.dump(pickle_obj, file_obj)
@@ -636,7 +447,8 @@ class PickleJob(PickleJobAbstract):
             return return_obj
 
     def check_done(self):
-        """Get the processing status of this pickle job.
+        """Get the processing status of this pickle job. The existence of the output file is sufficient, since
+        `clusterlib.file.TFileTo` publishes the output file atomically once it is completely written.
 
         Raises
         ------
@@ -652,7 +464,7 @@ class PickleJob(PickleJobAbstract):
         return True
 
     def create_stage(self,
-                     graph_stage_dct: Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]],
+                     graph_stage_dct: Union[Dict[str, Tuple[StageAbstract, StageAbstractCollection_type]], StageGraph],
                      log_fileN_str: Union[str, None]):
         """Create a stage object.
 
@@ -675,11 +487,13 @@ class PickleJob(PickleJobAbstract):
         This function MUST only be called by the class PickleJarofJobs.
         """
 
-        # Create the list of input stages that this stage depends on
+        # Create the list of input stages that this stage depends on; the graph only needs their names, so the
+        # input stages are not loaded from the graph
         if self._depend_pickle_job_obj_lst is not None:
             input_stage_obj_lst = []
             for depend_pickle_job_obj in self._depend_pickle_job_obj_lst:
-                input_stage_obj_lst.append(depend_pickle_job_obj.get_stage())
+                depend_pickle_job_obj._assert_stage()
+                input_stage_obj_lst.append(StageAbstract(depend_pickle_job_obj.name_str))
         else:
             input_stage_obj_lst = None
 
@@ -691,15 +505,25 @@ class PickleJob(PickleJobAbstract):
         stage_kwargs_dct['log_fileN_str'] = log_fileN_str
         stage_kwargs_dct['input_stage_obj'] = input_stage_obj_lst
 
-        # Create the stage
-        self._stage_obj = Stage(**stage_kwargs_dct)
+        # Create the stage; only the graph keeps it
+        Stage(**stage_kwargs_dct)
+        self._graph_stage_dct = graph_stage_dct
 
-    def get_stage(self) -> Stage:
-        if self._stage_obj is None:
+        # The keyword arguments are now part of the stage
+        self._Stage_kwargs_dct = None
+        self._call_kwargs = None
+
+    def _assert_stage(self):
+        if self._graph_stage_dct is None:
             err_str = 'This job pickle object has not been passed to the method PickleJarofJobs.add.'
             raise ValueError(err_str)
 
-        return self._stage_obj
+    def get_stage(self) -> Stage:
+        """Get the stage of the job; a spilled stage is loaded from the stage graph."""
+
+        self._assert_stage()
+
+        return get_graph_stage(self._graph_stage_dct, self.name_str)
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -709,7 +533,7 @@ class PickleJob(PickleJobAbstract):
 class PickleJarOfJobs:
     """A jar full of pickle jobs to be executed."""
 
-    def __init__(self, pickle_job_fgen_obj: PickleJobOrganizer):
+    def __init__(self, pickle_job_fgen_obj: PickleJobOrganizer, stage_spill_dirP_str: str = None):
         """
 
         Parameters
@@ -718,6 +542,9 @@ class PickleJarOfJobs:
             The name of the pickle jar.
         pickle_jar_dirP_str: str
             The directory location where to archive the support files of the job pickel files.
+        stage_spill_dirP_str: str
+            If set, the stages of the stage graph are pickled to a temporary file in this directory instead
+            of being kept in memory; optional.
         """
 
         self.pickle_job_fgen_obj = pickle_job_fgen_obj
@@ -725,7 +552,7 @@ class PickleJarOfJobs:
         self.jar_name_str = pickle_job_fgen_obj.pickle_jar_name_str
         self.pickle_jar_dirP_str = pickle_job_fgen_obj.pickle_jar_dirP_str
 
-        self._graph_stage_dct = dict()
+        self._graph_stage_dct = StageGraph(spill_dirP_str=stage_spill_dirP_str)
 
     def add(self, pickle_job_obj: PickleJob):
         """Add a pickle job to the pickle jar.
@@ -750,7 +577,7 @@ class PickleJarOfJobs:
     def create_makeflow_stages(self,
                                wrapper_bash_scrpt_fileP_str: str,
                                yaml_cfg_dct: dict = None) -> MakeflowFromStages:
-        """Create the makeflow file.
+        """Create the makeflow file; close the jar with `close` once `MakeflowFromStages.create` has written it.
 
         Parameters
         ----------
@@ -790,61 +617,30 @@ class PickleJarOfJobs:
 
         return makeflow_obj
 
+    def read_io_summaries(self, top_int: int = 10) -> dict:
+        """Aggregate the I/O summaries of the TFile operations of the executed jobs from their log files; refer to
+        `clusterlib.executor.read_io_summaries`.
 
-# ---------------------------------------------------------------------------------------------------------------------
-# ------------------------------------------------ pickle_job_execute  ------------------------------------------------
-# -------------------------------------------------       BEGIN       -------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
-def pickle_job_execute(pickle_call_fileP_str: str,
-                       pickle_call_kwargs_fileP_str: str,
-                       pickle_out_fileP_str: str,
-                       stage_input_file_obj_dct: Union[Dict[str, str], None] = None,
-                       index_tuple_dct: Union[Dict[str, int], None] = None):
-    """Execute a pickled job.
-
-    Parameters
-    ----------
-    pickle_call_fileP_str: str
-        The file path to the pickeled function/class that will be called.
-    pickle_call_kwargs_fileP_str: dict
-        TODO
-    pickle_out_fileP_str: str
-        The output file path of where to pickle the results.
-    stage_input_file_obj_dct: list of tuples
-        TODO The file paths to the outputs of other pickled jobs, which is optional.
-    index_tuple_dct: tuple
-        TODO Each list element MUST consists of a two element tuple, where each tuple
-        corresponding to to each file path listed in the parameter
-        "input_pckl_fileP_str"; there MUST be a one-to-one mapping. The first
-        tuple element is the tuple element that should be selected from the pickeled
-        file and the last tuple element is the keyword name that should be used to
-        pass the selected tuple element. If the first tuple element is None,
-        then the whole variable in the pickle fill will be passed via the
-        keyword name.
-    """
-
-    # Load the pickled callable object
-    with open(pickle_call_fileP_str, 'rb') as file_obj:
-        call_obj = cloudpickle.load(file_obj)
-
-    # Load the pickled kwargs dictionary for the callable object; first check the extention of the file: if the
-    # extention is json, then we de-serialize with json otherwise with pickle
-    json_bl = pickle_call_kwargs_fileP_str.split('.')[-1].lower() == 'json'
-    if json_bl is True:
-        with open(pickle_call_kwargs_fileP_str, 'r') as file_obj:
-            call_input_kwargs_dct = json.load(file_obj, object_hook=PickleVariableJSONEncoder.decode)
-    else:
-        with open(pickle_call_kwargs_fileP_str, 'rb') as file_obj:
-            call_input_kwargs_dct = cloudpickle.load(file_obj)
-
-    # Replace the PickleVariable object inside of "call_input_kwargs_dct" with loaded pickled values
-    call_input_kwargs_dct = PickleVariable.contract_pickle_variables(call_input_kwargs_dct,
-                                                                     stage_input_file_obj_dct,
-                                                                     index_tuple_dct)
-
-    # Call the callable object and get the output
-    output_tpl = call_obj(**call_input_kwargs_dct)
-
-    # Pickle the output
-    with open(pickle_out_fileP_str, 'wb') as file_obj:
-        cloudpickle.dump(output_tpl, file_obj)
+        Parameters
+        ----------
+        top_int: int
+            The number of largest transfers that are kept.
+
+        Returns
+        -------
+        dict:
+            The aggregated summary."""
+
+        return read_io_summaries(self._graph_stage_dct, top_int=top_int)
+
+    def close(self):
+        """Remove the spill file of the stage graph, if any; call it once the makeflow file has been created. The
+        stages of the jar cannot be used afterwards."""
+
+        self._graph_stage_dct.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type_obj, exception_value_obj, traceback_obj):
+        self.close()
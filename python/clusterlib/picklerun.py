@@ -0,0 +1,263 @@
+"""Execution of pickle jobs on the compute nodes. The stage of every pickle job calls `pickle_job_execute`, so this
+module only imports cloudpickle and the standard library; the pickle jobs are created with `clusterlib.picklejob`,
+which imports the stage and makeflow modules."""
+
+import json
+import secrets
+import cloudpickle
+from typing import Dict, Union
+
+
+HASH_STRING_BYTES_INT = 32
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# -------------------------------------------------- PickleVariable  --------------------------------------------------
+# -------------------------------------------------       BEGIN       -------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+class PickleVariable:
+    def __init__(self, pickle_job_obj: 'PickleJobAbstract', pckl_parm_fileP_str: str, tpl_idx: Union[int, None] = None,
+                 hash_key_str: str = None):
+        """
+        Parameters
+        ----------
+        pickle_job_obj: PickleJobAbstract
+            The pickle job that create the output parameter associated with the pickle variable.
+        pckl_parm_fileP_str: str
+            The file location where output parameters are pickeled.
+        tpl_idx: int
+            The tuple output number that is selected.
+        hash_key_str: str
+            The hash key of this variable.
+        """
+
+        self.pickle_job_obj = pickle_job_obj
+        self.pckl_parm_fileP_str = pckl_parm_fileP_str
+        self.tpl_idx = tpl_idx
+        self.hash_key_str = hash_key_str
+
+    def to_json(self):
+        return_dct = {
+            'pickle_job_obj': None,
+            'pckl_parm_fileP_str': self.pckl_parm_fileP_str,
+            'tpl_idx': self.tpl_idx,
+            'hash_key_str': self.hash_key_str
+        }
+
+        return return_dct
+
+    @staticmethod
+    def from_json(kwargs):
+        return PickleVariable(**kwargs)
+
+    def _assert_hash_key(self):
+        if self.hash_key_str is None:
+            err_str = 'The hash key has to be set first before using the PickleVariable.'
+            raise ValueError(err_str)
+
+    def set_hash_key(self, hash_str: str = None):
+        # if self.hash_key_str is not None:
+        #     err_str = 'The has key has already been set.'
+        #     raise ValueError(err_str)
+
+        # if hash_str is None:
+        #     hash_str = secrets.token_hex(HASH_STRING_BYTES_INT)
+
+        hash_str = secrets.token_hex(HASH_STRING_BYTES_INT)
+
+        self.hash_key_str = hash_str
+
+    def get_hash_key(self):
+        self._assert_hash_key()
+
+        return self.hash_key_str
+
+    def get_pickle_job_obj(self) -> 'PickleJobAbstract':
+        self._assert_hash_key()
+
+        return self.pickle_job_obj
+
+    def get_fileP_str(self) -> str:
+        self._assert_hash_key()
+
+        return self.pckl_parm_fileP_str
+
+    def get_tpl_index(self) -> Union[int, None]:
+        self._assert_hash_key()
+
+        return self.tpl_idx
+
+    def __str__(self):
+        return self.get_hash_key()
+
+    @staticmethod
+    def expand_pickle_variables(var_obj, stage_input_file_obj_dct, index_tuple_dct, depend_pickle_job_obj_lst):
+        """For a given list, dictionary or object, if the object is a PickleVariable,
+        set the has key and create a StageInputFile object and tuple mapping.
+
+        TODO: Write up better documentation."""
+
+        # Only used when the jobs are created, so the stage module is not imported by the jobs
+        from clusterlib.executor import StageInputFile
+
+        if isinstance(var_obj, PickleVariable) is True:
+            var_obj.set_hash_key()
+            hash_key_str = str(var_obj)
+
+            if hash_key_str in stage_input_file_obj_dct:
+                err_str = f'Random hash key "{hash_key_str}" is already present in stage input file dictionary.'
+                raise ValueError(err_str)
+
+            stage_input_file_obj_dct[hash_key_str] = StageInputFile(var_obj.get_fileP_str())
+            index_tuple_dct[hash_key_str] = var_obj.get_tpl_index()
+            depend_pickle_job_obj_lst.append(var_obj.get_pickle_job_obj())
+
+        elif isinstance(var_obj, list) is True:
+            for _var_obj in var_obj:
+                PickleVariable.expand_pickle_variables(_var_obj,
+                                                       stage_input_file_obj_dct,
+                                                       index_tuple_dct,
+                                                       depend_pickle_job_obj_lst)
+
+        elif isinstance(var_obj, tuple) is True:
+            for _var_obj in var_obj:
+                PickleVariable.expand_pickle_variables(_var_obj,
+                                                       stage_input_file_obj_dct,
+                                                       index_tuple_dct,
+                                                       depend_pickle_job_obj_lst)
+
+        elif isinstance(var_obj, dict) is True:
+            for _var_obj in var_obj.values():
+                PickleVariable.expand_pickle_variables(_var_obj,
+                                                       stage_input_file_obj_dct,
+                                                       index_tuple_dct,
+                                                       depend_pickle_job_obj_lst)
+
+    @staticmethod
+    def contract_pickle_variables(var_obj, stage_input_file_obj_dct, index_tuple_dct):
+        """Opposite of `expand_pickle_variables`.
+
+        TODO: Write up better documentation."""
+
+        return_obj = None
+
+        if isinstance(var_obj, PickleVariable) is True:
+            # Get the has key
+            hash_key_str = var_obj.get_hash_key()
+
+            # Load the pickle file
+            with open(stage_input_file_obj_dct[hash_key_str], 'rb') as file_obj:
+                data_tpl = cloudpickle.load(file_obj)
+
+            if index_tuple_dct[hash_key_str] is None:
+                return_obj = data_tpl
+            elif isinstance(data_tpl, tuple):
+                return_obj = data_tpl[index_tuple_dct[hash_key_str]]
+            else:
+                return_obj = data_tpl
+
+        elif isinstance(var_obj, list) is True:
+            return_obj = []
+            for _var_obj in var_obj:
+                return_obj.append(PickleVariable.contract_pickle_variables(_var_obj,
+                                                                           stage_input_file_obj_dct,
+                                                                           index_tuple_dct))
+
+        elif isinstance(var_obj, tuple) is True:
+            return_obj = []
+            for _var_obj in var_obj:
+                return_obj.append(PickleVariable.contract_pickle_variables(_var_obj,
+                                                                           stage_input_file_obj_dct,
+                                                                           index_tuple_dct))
+            return_obj = tuple(return_obj)
+
+        elif isinstance(var_obj, dict) is True:
+            return_obj = dict()
+            for key_str, _var_obj in var_obj.items():
+                return_obj[key_str] = PickleVariable.contract_pickle_variables(_var_obj,
+                                                                               stage_input_file_obj_dct,
+                                                                               index_tuple_dct)
+
+        else:
+            return_obj = var_obj
+
+        return return_obj
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# --------------------------------------------------- JSON Encoder  ---------------------------------------------------
+# -------------------------------------------------       BEGIN       -------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+class PickleVariableJSONEncoder(json.JSONEncoder):
+    def default(self, obj):  # pylint: disable=method-hidden
+        if isinstance(obj, PickleVariable) is True:
+            return dict(PickleVariable=obj.to_json())
+
+        # Let the base class default method raise the TypeError
+        return json.JSONEncoder.default(self, obj)
+
+    @classmethod
+    def decode(cls, dct):
+        if 'PickleVariable' in dct:
+            return PickleVariable.from_json(dct['PickleVariable'])
+
+        return dct
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------ pickle_job_execute  ------------------------------------------------
+# -------------------------------------------------       BEGIN       -------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+def pickle_job_execute(pickle_call_fileP_str: str,
+                       pickle_call_kwargs_fileP_str: str,
+                       pickle_out_fileP_str: str,
+                       stage_input_file_obj_dct: Union[Dict[str, str], None] = None,
+                       index_tuple_dct: Union[Dict[str, int], None] = None):
+    """Execute a pickled job.
+
+    Parameters
+    ----------
+    pickle_call_fileP_str: str
+        The file path to the pickeled function/class that will be called.
+    pickle_call_kwargs_fileP_str: dict
+        TODO
+    pickle_out_fileP_str: str
+        The output file path of where to pickle the results.
+    stage_input_file_obj_dct: list of tuples
+        TODO The file paths to the outputs of other pickled jobs, which is optional.
+    index_tuple_dct: tuple
+        TODO Each list element MUST consists of a two element tuple, where each tuple
+        corresponding to to each file path listed in the parameter
+        "input_pckl_fileP_str"; there MUST be a one-to-one mapping. The first
+        tuple element is the tuple element that should be selected from the pickeled
+        file and the last tuple element is the keyword name that should be used to
+        pass the selected tuple element. If the first tuple element is None,
+        then the whole variable in the pickle fill will be passed via the
+        keyword name.
+    """
+
+    # Load the pickled callable object
+    with open(pickle_call_fileP_str, 'rb') as file_obj:
+        call_obj = cloudpickle.load(file_obj)
+
+    # Load the pickled kwargs dictionary for the callable object; first check the extention of the file: if the
+    # extention is json, then we de-serialize with json otherwise with pickle
+    json_bl = pickle_call_kwargs_fileP_str.split('.')[-1].lower() == 'json'
+    if json_bl is True:
+        with open(pickle_call_kwargs_fileP_str, 'r') as file_obj:
+            call_input_kwargs_dct = json.load(file_obj, object_hook=PickleVariableJSONEncoder.decode)
+    else:
+        with open(pickle_call_kwargs_fileP_str, 'rb') as file_obj:
+            call_input_kwargs_dct = cloudpickle.load(file_obj)
+
+    # Replace the PickleVariable object inside of "call_input_kwargs_dct" with loaded pickled values
+    call_input_kwargs_dct = PickleVariable.contract_pickle_variables(call_input_kwargs_dct,
+                                                                     stage_input_file_obj_dct,
+                                                                     index_tuple_dct)
+
+    # Call the callable object and get the output
+    output_tpl = call_obj(**call_input_kwargs_dct)
+
+    # Pickle the output
+    with open(pickle_out_fileP_str, 'wb') as file_obj:
+        cloudpickle.dump(output_tpl, file_obj)
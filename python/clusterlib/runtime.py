@@ -0,0 +1,278 @@
+"""Minimal task-runtime entry point. This module is imported by the generated python caller script of every
+makeflow rule, so it only imports the standard library at module level; everything else is imported when it is
+needed. Modules such as `clusterlib.matlab` (h5py, numpy) or `clusterlib.wrapexe` (jinja2) must never be imported
+from here.
+
+Setting the environmental variable CLUSTERLIB_IMPORTTIME to a non-empty value (other than "0") prints a
+`python -X importtime` formatted report of the imports that were done during the task execution to stderr.
+
+When the task is launched by a wrapper script, which sets CLUSTERLIB_PHASE_FILEP_STR and
+CLUSTERLIB_PYTHON_START_EPOCH, the start-up time of the interpreter and the time of the stage are added to the
+phase timings of the wrapper script; refer to `clusterlib.wrapexe.read_phase_timings`."""
+
+import os
+import sys
+import copy
+import time
+import importlib
+from typing import List
+
+IMPORTTIME_ENV_NAME_STR = 'CLUSTERLIB_IMPORTTIME'
+PHASE_FILE_ENV_NAME_STR = 'CLUSTERLIB_PHASE_FILEP_STR'
+PYTHON_START_ENV_NAME_STR = 'CLUSTERLIB_PYTHON_START_EPOCH'
+
+# The time at which the interpreter has started and imported this module
+_import_epoch_flt = time.time()
+
+
+class _TimedLoader:
+    """Proxy of a module loader that measures the time that it takes to execute the module."""
+
+    def __init__(self, import_timer_obj, loader_obj):
+        self._import_timer_obj = import_timer_obj
+        self._loader_obj = loader_obj
+
+    def __getattr__(self, name_str: str):
+        return getattr(self._loader_obj, name_str)
+
+    def create_module(self, spec_obj):
+        return self._loader_obj.create_module(spec_obj)
+
+    def exec_module(self, module_obj):
+        self._import_timer_obj._push()
+        try:
+            self._loader_obj.exec_module(module_obj)
+        finally:
+            self._import_timer_obj._pop(module_obj.__name__)
+
+
+class ImportTimer:
+    """Record the self and cumulative time of every module import, similar to `python -X importtime`."""
+
+    def __init__(self):
+        # Stack of [start time, accumulated time of the nested imports]
+        self._stack_lst = []
+        # List of (module name, self time in us, cumulative time in us, nesting level)
+        self.record_tpl_lst = []
+        self._installed_bl = False
+
+    def install(self):
+        """Insert the timer at the front of `sys.meta_path`."""
+
+        if self._installed_bl is False:
+            sys.meta_path.insert(0, self)
+            self._installed_bl = True
+
+    def uninstall(self):
+        """Remove the timer from `sys.meta_path`."""
+
+        if self._installed_bl is True:
+            sys.meta_path.remove(self)
+            self._installed_bl = False
+
+    def find_spec(self, fullname_str: str, path_obj=None, target_obj=None):
+        for finder_obj in sys.meta_path:
+            if (finder_obj is self) or (hasattr(finder_obj, 'find_spec') is False):
+                continue
+
+            spec_obj = finder_obj.find_spec(fullname_str, path_obj, target_obj)
+            if spec_obj is None:
+                continue
+
+            if (spec_obj.loader is not None) and (hasattr(spec_obj.loader, 'exec_module') is True):
+                spec_obj.loader = _TimedLoader(self, spec_obj.loader)
+
+            return spec_obj
+
+        return None
+
+    def _push(self):
+        self._stack_lst.append([time.perf_counter(), 0.0])
+
+    def _pop(self, module_name_str: str):
+        start_flt, nested_flt = self._stack_lst.pop()
+        cumulative_flt = time.perf_counter() - start_flt
+
+        if len(self._stack_lst) > 0:
+            self._stack_lst[-1][1] += cumulative_flt
+
+        self.record_tpl_lst.append((module_name_str,
+                                    int(1e6 * (cumulative_flt - nested_flt)),
+                                    int(1e6 * cumulative_flt),
+                                    len(self._stack_lst)))
+
+    def get_total_us(self) -> int:
+        """The total time in micro seconds that has been spent on top level imports."""
+
+        return sum([record_tpl[2] for record_tpl in self.record_tpl_lst if record_tpl[3] == 0])
+
+    def report(self) -> str:
+        """Create the import time report string."""
+
+        out_str_lst = ['import time: self [us] | cumulative | imported package']
+        for module_name_str, self_us_int, cumulative_us_int, level_int in self.record_tpl_lst:
+            out_str_lst.append('import time: {:>9d} | {:>10d} | {:s}{:s}'.format(self_us_int,
+                                                                                 cumulative_us_int,
+                                                                                 '  ' * level_int,
+                                                                                 module_name_str))
+        out_str_lst.append('import time: total {:d} us in {:d} modules'.format(self.get_total_us(),
+                                                                                len(self.record_tpl_lst)))
+
+        return '\n'.join(out_str_lst)
+
+
+def execute_stage(parm_fileP_str: str):
+    """Execute the function of a stage as described by the stage YAML parameter file.
+
+    Parameters
+    ----------
+    parm_fileP_str: str
+        The file path of the YAML parameter file that was created by `executor.Stage.crt_makeflow_rule`."""
+
+    import yaml
+    import clusterlib.file as Tfile
+
+    # Load the yaml parameter config file
+    param_dct = None
+    with Tfile.TFileFrom(fileP_str=parm_fileP_str) as tfile_obj:
+        with open(tfile_obj.local_fileP_str, 'r') as file_obj:
+            param_dct = yaml.load(stream=file_obj, Loader=yaml.FullLoader)
+
+    # Load the appropriate module
+    module_obj = importlib.import_module(param_dct['module_path'])
+
+    # Get the function object
+    func_obj = getattr(module_obj, param_dct['function'])
+
+    # Create the yaml parameter config file that has the local file paths
+    local_kwargs_param_dct = copy.deepcopy(param_dct['function_kwargs'])
+
+    # The extra TFile keyword arguments per file path; e.g. the archive type of a directory output
+    tfile_kwargs_dct = param_dct.get('tfile_kwargs_dct', dict())
+
+    def tfile_from_flatten_list_dict(_itr_obj):
+        _tfile_obj_lst = []
+
+        if isinstance(_itr_obj, dict) is True:
+            _rtn_itr_obj = dict()
+            for _key_str, _value_obj in _itr_obj.items():
+                _new_value_obj, __tfile_obj_lst = \
+                    tfile_from_flatten_list_dict(_value_obj)
+
+                _rtn_itr_obj[_key_str] = _new_value_obj
+                _tfile_obj_lst += __tfile_obj_lst
+
+            return _rtn_itr_obj, _tfile_obj_lst
+
+        elif isinstance(_itr_obj, list) is True:
+            _rtn_itr_obj = list()
+            for __itr_obj in _itr_obj:
+                _new_itr_obj, __tfile_obj_lst = \
+                    tfile_from_flatten_list_dict(__itr_obj)
+
+                _rtn_itr_obj.append(_new_itr_obj)
+                _tfile_obj_lst += __tfile_obj_lst
+
+            return _rtn_itr_obj, _tfile_obj_lst
+
+        elif isinstance(_itr_obj, str) is True:
+            # The scratch space of all the inputs is reserved at once, below
+            # The stage function only gets the file path, so the file is not memory mapped
+            _tfile_obj = Tfile.TFileFrom(fileP_str=_itr_obj, defer_scratch_bl=True, mmap_bl=False,
+                                         **tfile_kwargs_dct.get(_itr_obj, dict()))
+
+            _tfile_obj_lst = [_tfile_obj]
+
+            return _tfile_obj, _tfile_obj_lst
+
+        else:
+            err_str = 'The given object has to be either a str, lst or dict.'
+            raise ValueError(err_str)
+
+    def local_fileP_from_tfile(_itr_obj):
+        if isinstance(_itr_obj, dict) is True:
+            return {_key_str: local_fileP_from_tfile(_value_obj) for _key_str, _value_obj in _itr_obj.items()}
+        elif isinstance(_itr_obj, list) is True:
+            return [local_fileP_from_tfile(__itr_obj) for __itr_obj in _itr_obj]
+        else:
+            return _itr_obj.local_fileP_str
+
+    input_tfile_obj_dct, in_tfile_obj_lst = tfile_from_flatten_list_dict(param_dct['input_fileP_str_dct'])
+
+    # The local file paths are only final after the reservations; an input that was not admitted is read directly
+    Tfile.reserve_scratch_all(in_tfile_obj_lst)
+    input_fileP_str_dct = local_fileP_from_tfile(input_tfile_obj_dct)
+    for key_str, value_obj in input_fileP_str_dct.items():
+        local_kwargs_param_dct[key_str] = value_obj
+
+    # Create a list of transcended output files
+    out_tfile_obj_lst = []
+    for name_str, output_fileP_str in param_dct['output_fileP_str_dct'].items():
+        tfile_obj = Tfile.TFileTo(fileP_str=output_fileP_str, **tfile_kwargs_dct.get(output_fileP_str, dict()))
+        out_tfile_obj_lst.append(tfile_obj)
+
+        if name_str in local_kwargs_param_dct:
+            local_kwargs_param_dct[name_str] = tfile_obj.local_fileP_str
+
+    try:
+        # Call the function
+        with Tfile.TFileCollection(in_tfile_obj_lst):
+            with Tfile.TFileCollection(out_tfile_obj_lst):
+                func_obj(**local_kwargs_param_dct)
+
+        # Wait for the write-behind copies of the outputs, if any
+        Tfile.flush_write_behind()
+
+    finally:
+        if Tfile.get_tfile_cache() is not None:
+            Tfile.get_tfile_cache().log_stats()
+
+        # The summary of the staging I/O in the job log; refer to `clusterlib.executor.read_io_summaries`
+        Tfile.get_io_stats().dump(sys.stdout)
+
+
+def _write_phase_timings(end_epoch_flt: float):
+    """Append the start-up time of the interpreter and the time of the stage to the phase file of the wrapper
+    script, as "name start end" lines."""
+
+    phase_fileP_str = os.getenv(PHASE_FILE_ENV_NAME_STR, '')
+    python_start_epoch_str = os.getenv(PYTHON_START_ENV_NAME_STR, '')
+    if (phase_fileP_str == '') or (python_start_epoch_str == ''):
+        return
+
+    try:
+        with open(phase_fileP_str, 'a') as file_obj:
+            file_obj.write('interpreter_start {:s} {:.6f}\n'.format(python_start_epoch_str, _import_epoch_flt))
+            file_obj.write('stage {:.6f} {:.6f}\n'.format(_import_epoch_flt, end_epoch_flt))
+    except OSError:
+        pass
+
+
+def main(arg_str_lst: List[str] = None):
+    """Entry point of the python caller script; the first argument is the stage YAML parameter file path."""
+
+    if arg_str_lst is None:
+        arg_str_lst = sys.argv[1:]
+
+    if len(arg_str_lst) != 1:
+        err_str = f'Expected exactly one argument, the stage parameter file path, but got {arg_str_lst}.'
+        raise ValueError(err_str)
+
+    import_timer_obj = None
+    if os.getenv(IMPORTTIME_ENV_NAME_STR, '') not in ('', '0'):
+        import_timer_obj = ImportTimer()
+        import_timer_obj.install()
+
+    try:
+        execute_stage(arg_str_lst[0])
+
+    finally:
+        _write_phase_timings(time.time())
+
+        if import_timer_obj is not None:
+            import_timer_obj.uninstall()
+            sys.stderr.write(import_timer_obj.report() + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Local harness that simulates many concurrent task launches through the Iris wrapper script, e.g. the first wave of
+tasks on a node. The harness creates a stand-in conda package, whose `bin/python` executes the current python
+interpreter, and a small python package; it then launches waves of concurrent wrapper scripts and reports the
+wall clock times of the launches. For example,
+
+    python -m clusterlib.wrapbench --tasks 64 --waves 3
+
+The first wave extracts the packages; the following waves are warm starts. Use `--change` to re-package the
+python package before every wave, so that every wave has to extract it again. Use `--phases` to also report the
+percentiles of the phase timings that the wrapper scripts write to their logs, e.g. the time spent waiting for the
+lock or extracting the packages.
+
+With `--import-src`, the harness instead measures the cold-start import time of a python package, as packaged
+from source, byte-compiled, and zipped; e.g.
+
+    python -m clusterlib.wrapbench --import-src ~/src/mypackage --import-module mypackage
+"""
+
+import os
+import sys
+import time
+import tarfile
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List
+from clusterlib.wrapexe import IrisWrapperExecute, PackageManifest, read_log_dir_phase_timings
+
+IMPORT_CONFIG_TPL_LST = [
+    # Name, byte-compiled, zipped
+    ('source', False, False),
+    ('precompiled', True, False),
+    ('zip', False, True),
+    ('zip precompiled', True, True)
+]
+
+
+def create_bench_environment(base_dirP_str: str) -> IrisWrapperExecute:
+    """Create the stand-in conda package, a python package and the Iris wrapper script in a directory.
+
+    Parameters
+    ----------
+    base_dirP_str: str
+        The directory; the subdirectory "remote" stands in for the Lustre file system and "node" for the scratch
+        directory of the node.
+
+    Returns
+    -------
+    IrisWrapperExecute:
+        The wrapper script creator; the wrapper script is "wrap.bash" in the directory."""
+
+    remote_dirP_str = os.path.join(base_dirP_str, 'remote')
+    node_dirP_str = os.path.join(base_dirP_str, 'node')
+    build_dirP_str = os.path.join(base_dirP_str, 'build')
+    os.makedirs(remote_dirP_str, exist_ok=True)
+
+    # The stand-in conda package
+    conda_bin_dirP_str = os.path.join(build_dirP_str, 'miniconda3', 'bin')
+    os.makedirs(conda_bin_dirP_str, exist_ok=True)
+    python_fileP_str = os.path.join(conda_bin_dirP_str, 'python')
+    with open(python_fileP_str, 'w') as file_obj:
+        file_obj.write(f'#!/bin/bash\nexec {sys.executable} "$@"\n')
+    os.chmod(python_fileP_str, 0o755)
+
+    conda_tar_fileP_str = os.path.join(remote_dirP_str, 'miniconda3.tar')
+    with tarfile.open(conda_tar_fileP_str, 'w') as tar_obj:
+        tar_obj.add(os.path.join(build_dirP_str, 'miniconda3'), arcname='miniconda3')
+
+    # The python package
+    pckg_dirP_str = os.path.join(build_dirP_str, 'benchpkg')
+    os.makedirs(pckg_dirP_str, exist_ok=True)
+    with open(os.path.join(pckg_dirP_str, '__init__.py'), 'w') as file_obj:
+        file_obj.write(f'VERSION_FLT = {time.time()!r}\n')
+
+    conda_pckg_manifest_obj = PackageManifest(name_str='conda',
+                                              dst_tar_fileP_str=conda_tar_fileP_str,
+                                              dst_dirP_str=os.path.join(node_dirP_str, 'miniconda3'),
+                                              checksum_fileP_str=os.path.join(node_dirP_str, 'miniconda3.txt'))
+    pckg_manifest_obj = PackageManifest(name_str='benchpkg',
+                                        src_dirP_str=pckg_dirP_str,
+                                        dst_tar_fileP_str=os.path.join(remote_dirP_str, 'benchpkg.tar'),
+                                        dst_dirP_str=os.path.join(node_dirP_str, 'benchpkg'),
+                                        checksum_fileP_str=os.path.join(node_dirP_str, 'benchpkg.txt'))
+
+    iris_wrap_exe_obj = IrisWrapperExecute(conda_pckg_manifest_obj=conda_pckg_manifest_obj,
+                                           pckg_manifest_obj_lst=[pckg_manifest_obj],
+                                           env_dct={'PYTHONPATH': node_dirP_str})
+    iris_wrap_exe_obj.package()
+
+    wrapper_fileP_str = os.path.join(base_dirP_str, 'wrap.bash')
+    wrapper_str = iris_wrap_exe_obj.create()
+    with open(wrapper_fileP_str, 'w') as file_obj:
+        file_obj.write(wrapper_str)
+
+    with open(os.path.join(base_dirP_str, 'task.py'), 'w') as file_obj:
+        file_obj.write('import benchpkg\n')
+
+    return iris_wrap_exe_obj
+
+
+def launch_wave(base_dirP_str: str, nr_tasks_int: int, log_dirP_str: str = None) -> Dict[str, float]:
+    """Launch the wrapper script concurrently.
+
+    Parameters
+    ----------
+    base_dirP_str: str
+        The directory of `create_bench_environment`.
+    nr_tasks_int: int
+        The number of concurrent launches.
+    log_dirP_str: str
+        If not None, the directory to which the log of every launch is written.
+
+    Returns
+    -------
+    dict of float:
+        The wall clock time of the wave and the median and maximum wall clock time of a launch in seconds, and
+        the number of failed launches."""
+
+    wrapper_fileP_str = os.path.join(base_dirP_str, 'wrap.bash')
+    task_fileP_str = os.path.join(base_dirP_str, 'task.py')
+
+    start_sec_flt = time.perf_counter()
+    process_tpl_lst = []
+    for task_int in range(nr_tasks_int):
+        if log_dirP_str is None:
+            stdout_obj = subprocess.DEVNULL
+        else:
+            stdout_obj = open(os.path.join(log_dirP_str, f'task_{task_int:d}.log'), 'w')
+        process_obj = subprocess.Popen(['/bin/bash', wrapper_fileP_str, task_fileP_str],
+                                       stdout=stdout_obj, stderr=subprocess.STDOUT)
+        if log_dirP_str is not None:
+            stdout_obj.close()
+        process_tpl_lst.append((time.perf_counter(), process_obj))
+
+    launch_sec_flt_lst = []
+    nr_failed_int = 0
+    for launch_start_sec_flt, process_obj in process_tpl_lst:
+        if process_obj.wait() != 0:
+            nr_failed_int += 1
+        launch_sec_flt_lst.append(time.perf_counter() - launch_start_sec_flt)
+
+    return {
+        'wave_sec_flt': time.perf_counter() - start_sec_flt,
+        'median_sec_flt': statistics.median(launch_sec_flt_lst),
+        'max_sec_flt': max(launch_sec_flt_lst),
+        'nr_failed_int': nr_failed_int
+    }
+
+
+def write_phase_report(log_dirP_str: str):
+    """Write the percentiles of the phase timings of the logs in a directory to stdout."""
+
+    aggr_phase_dct = read_log_dir_phase_timings(log_dirP_str)
+    for name_str, stats_dct in aggr_phase_dct['phase_dct'].items():
+        sys.stdout.write('      {:<18s} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>6.1f}%\n'.format(
+            name_str, stats_dct['mean_flt'], stats_dct['p50'], stats_dct['p90'], stats_dct['p99'],
+            100 * stats_dct['fraction_flt']))
+
+
+def _time_python(python_exe_str: str,
+                 code_str: str,
+                 env_dct: Dict[str, str],
+                 repeat_int: int,
+                 cwd_dirP_str: str) -> float:
+    # The interpreter runs in `cwd_dirP_str`, since the working directory is on the path of `python -c` and could
+    # shadow the packaged copy of the package
+    duration_sec_flt_lst = []
+    for _ in range(repeat_int):
+        start_sec_flt = time.perf_counter()
+        subprocess.run([python_exe_str, '-c', code_str], env=env_dct, cwd=cwd_dirP_str, check=True)
+        duration_sec_flt_lst.append(time.perf_counter() - start_sec_flt)
+
+    return statistics.median(duration_sec_flt_lst)
+
+
+def benchmark_cold_import(src_dirP_str: str,
+                          module_str: str,
+                          python_exe_str: str = None,
+                          repeat_int: int = 5) -> List[Dict[str, object]]:
+    """Measure the cold-start import time of a python package as it is packaged from source, byte-compiled, and
+    zipped; every import runs in a new interpreter that does not write byte-compiled files, like the first import
+    on a compute node.
+
+    Parameters
+    ----------
+    src_dirP_str: str
+        The source directory of the python package.
+    module_str: str
+        The module that is imported.
+    python_exe_str: str
+        The python interpreter; by default the current interpreter.
+    repeat_int: int
+        The number of imports; the median import time is reported.
+
+    Returns
+    -------
+    list of dict:
+        For each configuration, the name and the import time in seconds, without the start-up time of the
+        interpreter."""
+
+    if python_exe_str is None:
+        python_exe_str = sys.executable
+
+    result_dct_lst = []
+    with tempfile.TemporaryDirectory() as base_dirP_str:
+        env_dct = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+        env_dct.pop('PYTHONPATH', None)
+        start_up_sec_flt = _time_python(python_exe_str, 'pass', env_dct, repeat_int, base_dirP_str)
+
+        for config_str, precompile_bl, zip_bl in IMPORT_CONFIG_TPL_LST:
+            config_dirP_str = os.path.join(base_dirP_str, config_str.replace(' ', '_'))
+            node_dirP_str = os.path.join(config_dirP_str, 'node')
+            os.makedirs(node_dirP_str)
+
+            pckg_manifest_obj = PackageManifest(name_str='pckg',
+                                                src_dirP_str=src_dirP_str,
+                                                dst_tar_fileP_str=os.path.join(config_dirP_str, 'pckg.tar'),
+                                                dst_dirP_str=os.path.join(node_dirP_str,
+                                                                          os.path.basename(src_dirP_str)),
+                                                precompile_bl=precompile_bl,
+                                                python_exe_str=python_exe_str,
+                                                zip_bl=zip_bl)
+            pckg_manifest_obj.package()
+
+            if zip_bl is True:
+                python_path_str = pckg_manifest_obj.read_manifest()['zip']
+            else:
+                with tarfile.open(pckg_manifest_obj.dst_tar_fileP_str, 'r') as tar_obj:
+                    tar_obj.extractall(node_dirP_str, filter='data')
+                python_path_str = node_dirP_str
+
+            import_sec_flt = _time_python(python_exe_str, f'import {module_str}',
+                                          dict(env_dct, PYTHONPATH=python_path_str), repeat_int, base_dirP_str)
+            result_dct_lst.append({
+                'config_str': config_str,
+                'import_sec_flt': max(import_sec_flt - start_up_sec_flt, 0.0)
+            })
+
+    return result_dct_lst
+
+
+def main(arg_str_lst: List[str] = None):
+    parser_obj = argparse.ArgumentParser(description='Simulate concurrent task launches through the Iris wrapper.')
+    parser_obj.add_argument('--tasks', dest='nr_tasks_int', type=int, default=32)
+    parser_obj.add_argument('--waves', dest='nr_waves_int', type=int, default=3)
+    parser_obj.add_argument('--change', dest='change_bl', action='store_true',
+                            help='Re-package the python package before every wave.')
+    parser_obj.add_argument('--phases', dest='phases_bl', action='store_true',
+                            help='Report the percentiles of the phase timings of every wave.')
+    parser_obj.add_argument('--dir', dest='base_dirP_str', default=None,
+                            help='The directory of the simulation; by default a temporary directory.')
+    parser_obj.add_argument('--import-src', dest='import_src_dirP_str', default=None,
+                            help='Measure the cold-start import time of the python package in this directory.')
+    parser_obj.add_argument('--import-module', dest='import_module_str', default=None,
+                            help='The module that is imported; by default the name of the --import-src directory.')
+    args_obj = parser_obj.parse_args(arg_str_lst)
+
+    if args_obj.import_src_dirP_str is not None:
+        import_module_str = args_obj.import_module_str
+        if import_module_str is None:
+            import_module_str = os.path.basename(os.path.normpath(args_obj.import_src_dirP_str))
+
+        sys.stdout.write('{:<16s} {:>10s}\n'.format('configuration', 'import s'))
+        for result_dct in benchmark_cold_import(args_obj.import_src_dirP_str, import_module_str):
+            sys.stdout.write('{:<16s} {:>10.3f}\n'.format(result_dct['config_str'], result_dct['import_sec_flt']))
+        return
+
+    with tempfile.TemporaryDirectory(dir=args_obj.base_dirP_str) as base_dirP_str:
+        iris_wrap_exe_obj = create_bench_environment(base_dirP_str)
+
+        sys.stdout.write('{:>5s} {:>10s} {:>10s} {:>10s} {:>7s}\n'.format('wave', 'wave s', 'median s', 'max s',
+                                                                           'failed'))
+        for wave_int in range(args_obj.nr_waves_int):
+            if (args_obj.change_bl is True) and (wave_int > 0):
+                pckg_manifest_obj = iris_wrap_exe_obj.pckg_manifest_obj_lst[0]
+                with open(os.path.join(pckg_manifest_obj.src_dirP_str, '__init__.py'), 'w') as file_obj:
+                    file_obj.write(f'VERSION_FLT = {time.time()!r}\n')
+                iris_wrap_exe_obj.package()
+
+            log_dirP_str = None
+            if args_obj.phases_bl is True:
+                log_dirP_str = os.path.join(base_dirP_str, 'logging', f'wave_{wave_int:d}')
+                os.makedirs(log_dirP_str)
+
+            result_dct = launch_wave(base_dirP_str, args_obj.nr_tasks_int, log_dirP_str=log_dirP_str)
+            sys.stdout.write('{:>5d} {:>10.3f} {:>10.3f} {:>10.3f} {:>7d}\n'.format(wave_int,
+                                                                                   result_dct['wave_sec_flt'],
+                                                                                   result_dct['median_sec_flt'],
+                                                                                   result_dct['max_sec_flt'],
+                                                                                   result_dct['nr_failed_int']))
+            if log_dirP_str is not None:
+                sys.stdout.write('      {:<18s} {:>9s} {:>9s} {:>9s} {:>9s} {:>7s}\n'.format('phase', 'mean s', 'p50 s',
+                                                                                       'p90 s', 'p99 s', 'share'))
+                write_phase_report(log_dirP_str)
+
+
+if __name__ == '__main__':
+    main()
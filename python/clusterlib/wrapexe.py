@@ -1,15 +1,555 @@
 import os
+import re
+import sys
+import glob
+import gzip
+import json
+import time
+import stat
 import jinja2
 import shutil
+import socket
+import fnmatch
+import hashlib
 import logging
 import tarfile
+import zipfile
 import tempfile
+import threading
+import subprocess
 from collections import namedtuple
-from typing import Dict, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Set, Tuple, Union
 from clusterlib.utilities import get_dirP_of__file__
 
 log_obj = logging.getLogger(__name__)
 
+MANIFEST_SUFFIX_STR = '.manifest'
+DIGEST_BUFFER_BYTES_INT = 8 * 1024 ** 2
+DEFAULT_KEEP_VERSIONS_INT = 3
+IGNORE_PATTERN_STR_LST = ['.git', '.*', '__pycache__', '*.pyc']
+LAYER_INDEX_SUFFIX_STR = '.layers.json'
+DEFAULT_MAX_DELTA_FRACTION_FLT = 0.25
+DIR_DIGEST_STR = 'dir'
+COMPRESSION_STR_LST = ['gz', 'zst']
+COMPRESSION_MAGIC_BYTES_DCT = {'gz': b'\x1f\x8b', 'zst': b'\x28\xb5\x2f\xfd'}
+GZIP_LEVEL_INT = 6
+ZSTD_LEVEL_INT = 3
+ACTIVATION_SUFFIX_STR = '.activate.sh'
+ZIP_SUFFIX_STR = '.zip'
+ZIP_DATE_TIME_TPL = (1980, 1, 1, 0, 0, 0)
+PHASES_MARKER_STR = 'CLUSTERLIB_PHASES '
+DEFAULT_PERCENTILE_INT_LST = [50, 90, 99]
+ACTIVATION_PATH_MARKER_STR = '__CLUSTERLIB_PATH__'
+
+
+class _HashWriter:
+    """File-like object that computes the SHA-256 digest and size of the written bytes, and optionally passes the
+    bytes on to a file."""
+
+    def __init__(self, file_obj=None):
+        self._file_obj = file_obj
+        self.hash_obj = hashlib.sha256()
+        self.size_int = 0
+
+    def write(self, buffer_bytes: bytes) -> int:
+        self.hash_obj.update(buffer_bytes)
+        self.size_int += len(buffer_bytes)
+        if self._file_obj is not None:
+            self._file_obj.write(buffer_bytes)
+
+        return len(buffer_bytes)
+
+
+def get_compression_str(fileP_str: str) -> Union[str, None]:
+    """The compression of an archive, from its magic bytes: one of `COMPRESSION_STR_LST`, or None if the archive
+    is not compressed."""
+
+    with open(fileP_str, 'rb') as file_obj:
+        magic_bytes = file_obj.read(4)
+
+    for compression_str, compression_magic_bytes in COMPRESSION_MAGIC_BYTES_DCT.items():
+        if magic_bytes.startswith(compression_magic_bytes) is True:
+            return compression_str
+
+    return None
+
+
+def _get_compress_cmd_str_lst(compression_str: str) -> Union[List[str], None]:
+    """The command of the parallel compressor, or None if Python has to compress."""
+
+    if compression_str == 'gz':
+        if shutil.which('pigz') is not None:
+            return ['pigz', '-n', f'-{GZIP_LEVEL_INT}', '-c']
+        return None
+
+    if shutil.which('zstd') is None:
+        err_str = 'The program "zstd" is required for zstd compressed packages, but it was not found.'
+        raise FileNotFoundError(err_str)
+
+    return ['zstd', '-q', '-T0', f'-{ZSTD_LEVEL_INT}', '-c']
+
+
+def _get_decompress_cmd_str_lst(compression_str: str) -> List[str]:
+    """The command that decompresses an archive to stdout; the same programs as in the wrapper script."""
+
+    if compression_str == 'gz':
+        if shutil.which('pigz') is not None:
+            return ['pigz', '-dc']
+        return ['gzip', '-dc']
+
+    return ['zstd', '-q', '-dc']
+
+
+class _CompressWriter:
+    """File-like object that compresses the written bytes to a file, with pigz or zstd if available and otherwise
+    with the gzip module."""
+
+    def __init__(self, compression_str: str, file_obj):
+        cmd_str_lst = _get_compress_cmd_str_lst(compression_str)
+
+        self._process_obj = None
+        self._thread_obj = None
+        if cmd_str_lst is None:
+            # No name and no time stamp in the header, so that the compressed archive is reproducible
+            self._gzip_obj = gzip.GzipFile(fileobj=file_obj, mode='wb', compresslevel=GZIP_LEVEL_INT, mtime=0)
+        else:
+            self._gzip_obj = None
+            self._process_obj = subprocess.Popen(cmd_str_lst, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+            def _copy_output():
+                for buffer_bytes in iter(lambda: self._process_obj.stdout.read(DIGEST_BUFFER_BYTES_INT), b''):
+                    file_obj.write(buffer_bytes)
+
+            self._thread_obj = threading.Thread(target=_copy_output, daemon=True)
+            self._thread_obj.start()
+
+    def write(self, buffer_bytes: bytes) -> int:
+        if self._gzip_obj is not None:
+            return self._gzip_obj.write(buffer_bytes)
+
+        self._process_obj.stdin.write(buffer_bytes)
+        return len(buffer_bytes)
+
+    def close(self):
+        if self._gzip_obj is not None:
+            self._gzip_obj.close()
+            return
+
+        self._process_obj.stdin.close()
+        self._thread_obj.join()
+        if self._process_obj.wait() != 0:
+            err_str = f'The compressor "{self._process_obj.args[0]}" failed with exit code ' \
+                + f'{self._process_obj.returncode}.'
+            raise RuntimeError(err_str)
+
+
+def measure_decompression(fileP_str: str, compression_str: str) -> Tuple[int, float]:
+    """Measure the decompression of an archive, with the same decompressor as the wrapper script.
+
+    Parameters
+    ----------
+    fileP_str: str
+        The file path of the compressed archive.
+    compression_str: str
+        The compression; one of `COMPRESSION_STR_LST`.
+
+    Returns
+    -------
+    tuple:
+        The size of the decompressed archive and the decompression throughput in MB/s of decompressed data."""
+
+    start_sec_flt = time.perf_counter()
+    size_int = 0
+    process_obj = subprocess.Popen(_get_decompress_cmd_str_lst(compression_str) + [fileP_str],
+                                   stdout=subprocess.PIPE)
+    for buffer_bytes in iter(lambda: process_obj.stdout.read(DIGEST_BUFFER_BYTES_INT), b''):
+        size_int += len(buffer_bytes)
+    if process_obj.wait() != 0:
+        err_str = f'Could not decompress "{fileP_str}".'
+        raise RuntimeError(err_str)
+
+    duration_sec_flt = max(time.perf_counter() - start_sec_flt, 1e-9)
+    return size_int, size_int / 1e6 / duration_sec_flt
+
+
+def _is_ignored(name_str: str) -> bool:
+    for pattern_str in IGNORE_PATTERN_STR_LST:
+        if fnmatch.fnmatch(name_str, pattern_str) is True:
+            return True
+
+    return False
+
+
+def _iter_src_entries(src_dirP_str: str, pycache_dirP_str: str = None) -> Iterator[Tuple[str, str]]:
+    """Iterate over the entries of a source directory that are packaged, in sorted order, with the directories
+    before their content; the entries in `IGNORE_PATTERN_STR_LST` are skipped and symbolic links are followed.
+
+    Parameters
+    ----------
+    src_dirP_str: str
+        The source directory.
+    pycache_dirP_str: str
+        The `python -X pycache_prefix` directory of the byte-compiled source directory, if any; the compiled
+        files of a directory are added to its "__pycache__" directory in the archive.
+
+    Yields
+    ------
+    tuple of str:
+        The path of the entry and its name in the archive."""
+
+    src_dirP_str = os.path.abspath(src_dirP_str)
+    base_dirN_str = os.path.basename(src_dirP_str)
+
+    for dirP_str, dirN_str_lst, fileN_str_lst in os.walk(src_dirP_str, followlinks=True):
+        dirN_str_lst[:] = sorted([dirN_str for dirN_str in dirN_str_lst if _is_ignored(dirN_str) is False])
+
+        rel_dirP_str = os.path.relpath(dirP_str, src_dirP_str)
+        if rel_dirP_str == '.':
+            arc_dirP_str = base_dirN_str
+        else:
+            arc_dirP_str = os.path.join(base_dirN_str, rel_dirP_str)
+        yield dirP_str, arc_dirP_str
+
+        for fileN_str in sorted(fileN_str_lst):
+            if _is_ignored(fileN_str) is False:
+                yield os.path.join(dirP_str, fileN_str), os.path.join(arc_dirP_str, fileN_str)
+
+        if pycache_dirP_str is None:
+            continue
+
+        # The pycache prefix directory mirrors the absolute path of the source directory
+        pyc_dirP_str = os.path.join(pycache_dirP_str, dirP_str.lstrip(os.sep))
+        if os.path.isdir(pyc_dirP_str) is False:
+            continue
+
+        pyc_fileN_str_lst = sorted([fileN_str for fileN_str in os.listdir(pyc_dirP_str)
+                                    if (fileN_str.endswith('.pyc') is True)
+                                    and (os.path.isfile(os.path.join(pyc_dirP_str, fileN_str)) is True)])
+        if len(pyc_fileN_str_lst) > 0:
+            yield pyc_dirP_str, os.path.join(arc_dirP_str, '__pycache__')
+            for fileN_str in pyc_fileN_str_lst:
+                yield os.path.join(pyc_dirP_str, fileN_str), os.path.join(arc_dirP_str, '__pycache__', fileN_str)
+
+
+def _get_src_entry_dct(src_dirP_str: str, pycache_dirP_str: str = None) -> Dict[str, Tuple[str, int]]:
+    """The SHA-256 digest and size of every file of a source directory that is packaged.
+
+    Returns
+    -------
+    dict of tuple:
+        For each name in the archive, the digest and size; the digest of a directory is `DIR_DIGEST_STR`."""
+
+    entry_dct = dict()
+    for fileP_str, arcname_str in _iter_src_entries(src_dirP_str, pycache_dirP_str):
+        if os.path.isdir(fileP_str) is True:
+            entry_dct[arcname_str] = (DIR_DIGEST_STR, 0)
+            continue
+
+        hash_obj = hashlib.sha256()
+        with open(fileP_str, 'rb') as file_obj:
+            for buffer_bytes in iter(lambda: file_obj.read(DIGEST_BUFFER_BYTES_INT), b''):
+                hash_obj.update(buffer_bytes)
+        entry_dct[arcname_str] = (hash_obj.hexdigest(), os.stat(fileP_str).st_size)
+
+    return entry_dct
+
+
+def _write_src_tar(src_dirP_str: str,
+                   file_obj,
+                   arcname_str_set: Set[str] = None,
+                   compression_str: str = None,
+                   pycache_dirP_str: str = None) -> Dict[str, object]:
+    """Stream a reproducible tar archive of a source directory: the entries are sorted and their modification
+    time, owner and group are normalized, so that the same content always gives the same archive.
+
+    Parameters
+    ----------
+    src_dirP_str: str
+        The source directory; it is the top directory in the archive.
+    file_obj: file object
+        The file to which the archive is written; if None, only the digest is computed.
+    arcname_str_set: set of str
+        If given, only the entries with these names in the archive are written, e.g. the files of a delta layer.
+    compression_str: str
+        The compression of the archive; one of `COMPRESSION_STR_LST`, or None.
+    pycache_dirP_str: str
+        The pycache prefix directory of the byte-compiled source directory; refer to `_iter_src_entries`.
+
+    Returns
+    -------
+    dict:
+        The SHA-256 digest (hex string) and the size of the written archive, "digest" and "size", and of the
+        uncompressed archive, "content_digest" and "content_size"."""
+
+    hash_writer_obj = _HashWriter(file_obj)
+    if compression_str is None:
+        compress_writer_obj = None
+        content_writer_obj = hash_writer_obj
+    else:
+        compress_writer_obj = _CompressWriter(compression_str, hash_writer_obj)
+        content_writer_obj = _HashWriter(compress_writer_obj)
+
+    with tarfile.open(fileobj=content_writer_obj, mode='w|', dereference=True, format=tarfile.PAX_FORMAT) as tar_obj:
+        for fileP_str, arcname_str in _iter_src_entries(src_dirP_str, pycache_dirP_str):
+            if (arcname_str_set is not None) and (arcname_str not in arcname_str_set):
+                continue
+
+            tarinfo_obj = tar_obj.gettarinfo(fileP_str, arcname=arcname_str)
+            if tarinfo_obj is None:
+                # E.g. a socket
+                continue
+
+            tarinfo_obj.mtime = 0
+            tarinfo_obj.uid = 0
+            tarinfo_obj.gid = 0
+            tarinfo_obj.uname = ''
+            tarinfo_obj.gname = ''
+
+            if tarinfo_obj.isreg() is True:
+                with open(fileP_str, 'rb') as src_file_obj:
+                    tar_obj.addfile(tarinfo_obj, src_file_obj)
+            else:
+                tar_obj.addfile(tarinfo_obj)
+
+    if compress_writer_obj is not None:
+        compress_writer_obj.close()
+
+    return {
+        'digest': hash_writer_obj.hash_obj.hexdigest(),
+        'size': hash_writer_obj.size_int,
+        'content_digest': content_writer_obj.hash_obj.hexdigest(),
+        'content_size': content_writer_obj.size_int
+    }
+
+
+def _write_src_zip(src_dirP_str: str, dst_fileP_str: str, pycache_dirP_str: str = None) -> str:
+    """Write a reproducible, uncompressed, zip file of a source directory that can be imported from with
+    `zipimport`; a byte-compiled file is stored next to its source file as "name.pyc", where `zipimport` finds
+    it. Since `zipimport` reopens the zip file for every import, a published zip file must never change: the zip
+    file is named after its digest, `dst_fileP_str` with the suffix ".<digest>.zip".
+
+    Returns
+    -------
+    str:
+        The file path of the zip file."""
+
+    tmp_fileP_str = '{:s}.{:s}-{:d}-{:d}.tmp'.format(dst_fileP_str, socket.gethostname(), os.getpid(),
+                                                     threading.get_ident())
+    try:
+        with zipfile.ZipFile(tmp_fileP_str, 'w', compression=zipfile.ZIP_STORED) as zip_obj:
+            for fileP_str, arcname_str in _iter_src_entries(src_dirP_str, pycache_dirP_str):
+                if os.path.isdir(fileP_str) is True:
+                    # `zipimport` needs the directory entries to find the namespace packages, i.e. the directories
+                    # without an "__init__.py"; the compiled files are moved out of "__pycache__"
+                    if os.path.basename(arcname_str) != '__pycache__':
+                        zipinfo_obj = zipfile.ZipInfo(arcname_str + '/', date_time=ZIP_DATE_TIME_TPL)
+                        zipinfo_obj.external_attr = ((stat.S_IFDIR | 0o755) << 16) | 0x10
+                        zip_obj.writestr(zipinfo_obj, b'')
+                    continue
+
+                arc_dirP_str, arc_fileN_str = os.path.split(arcname_str)
+                if os.path.basename(arc_dirP_str) == '__pycache__':
+                    # E.g. "__pycache__/mod.cpython-311.pyc" to "mod.pyc"
+                    arcname_str = os.path.join(os.path.dirname(arc_dirP_str), arc_fileN_str.split('.')[0] + '.pyc')
+
+                zipinfo_obj = zipfile.ZipInfo(arcname_str, date_time=ZIP_DATE_TIME_TPL)
+                zipinfo_obj.external_attr = (os.stat(fileP_str).st_mode & 0xFFFF) << 16
+                with open(fileP_str, 'rb') as file_obj:
+                    zip_obj.writestr(zipinfo_obj, file_obj.read())
+
+        hash_obj = hashlib.sha256()
+        with open(tmp_fileP_str, 'rb') as file_obj:
+            for buffer_bytes in iter(lambda: file_obj.read(DIGEST_BUFFER_BYTES_INT), b''):
+                hash_obj.update(buffer_bytes)
+
+        zip_fileP_str = '{:s}.{:s}{:s}'.format(dst_fileP_str, hash_obj.hexdigest()[:16], ZIP_SUFFIX_STR)
+        os.replace(tmp_fileP_str, zip_fileP_str)
+
+    finally:
+        if os.path.exists(tmp_fileP_str) is True:
+            os.remove(tmp_fileP_str)
+
+    return zip_fileP_str
+
+
+def _quote_activation_value_str(value_str: str, prefix_dirP_str: str) -> str:
+    """Double-quote a value of the activation script, with the conda prefix replaced by ${CONDA_PCKG_DIRP_STR} and
+    the marker of the original PATH by ${PATH}."""
+
+    for char_str in ('\\', '"', '`', '$'):
+        value_str = value_str.replace(char_str, '\\' + char_str)
+    value_str = value_str.replace(prefix_dirP_str, '${CONDA_PCKG_DIRP_STR}')
+    value_str = value_str.replace(ACTIVATION_PATH_MARKER_STR, '${PATH}')
+
+    return f'"{value_str}"'
+
+
+def capture_activation_str_lst(prefix_dirP_str: str) -> List[str]:
+    """Capture the activation of the base environment of a local conda installation with
+    `conda shell.posix activate`; the exported variables are returned with the prefix of the installation replaced
+    by ${CONDA_PCKG_DIRP_STR}. The scripts in "etc/conda/activate.d" are not part of the returned lines.
+
+    Parameters
+    ----------
+    prefix_dirP_str: str
+        The directory of the local conda installation, of which the conda tar file was made.
+
+    Returns
+    -------
+    list of str:
+        The export and unset lines of the activation."""
+
+    prefix_dirP_str = os.path.normpath(prefix_dirP_str)
+
+    # Activate from a clean environment; the original PATH is replaced by a marker
+    env_dct = {key_str: value_str for key_str, value_str in os.environ.items()
+               if key_str.startswith(('CONDA', '_CE_', '_CONDA')) is False}
+    env_dct['PATH'] = ACTIVATION_PATH_MARKER_STR
+    cmd_str_lst = [os.path.join(prefix_dirP_str, 'bin', 'conda'), 'shell.posix', 'activate', prefix_dirP_str]
+    out_str = subprocess.run(cmd_str_lst, env=env_dct, capture_output=True, text=True, check=True).stdout
+
+    activation_str_lst = []
+    for line_str in out_str.splitlines():
+        match_obj = re.match(r"^export (\w+)='(.*)'$", line_str)
+        if match_obj is not None:
+            value_str = match_obj.group(2).replace("'\\''", "'")
+            activation_str_lst.append('export {:s}={:s}'.format(match_obj.group(1),
+                                                                _quote_activation_value_str(value_str,
+                                                                                            prefix_dirP_str)))
+        elif re.match(r'^unset \w+$', line_str) is not None:
+            activation_str_lst.append(line_str)
+
+    if len([line_str for line_str in activation_str_lst if line_str.startswith('export PATH=')]) == 0:
+        err_str = f'Could not capture the activation of the conda installation "{prefix_dirP_str}".'
+        raise RuntimeError(err_str)
+
+    return activation_str_lst
+
+
+def read_phase_timings(log_fileP_str: str) -> Union[dict, None]:
+    """Read the phase timings that a wrapper script wrote to a job log file, as a single JSON line prefixed by
+    `PHASES_MARKER_STR`: the wall clock time of the phases of the task in "phase_sec_dct", e.g. "lock_wait",
+    "check", "extract", "activate", "python", and, for a stage, "interpreter_start" and "stage"; the total wall
+    clock time of the wrapper script in "total_sec"; and the resource usage of `/usr/bin/time` in "resource_dct".
+
+    Parameters
+    ----------
+    log_fileP_str: str
+        The log file path.
+
+    Returns
+    -------
+    dict or None:
+        The last phase timings of the log file, or None if the log file has none."""
+
+    phase_dct = None
+    with open(log_fileP_str, 'r', errors='replace') as file_obj:
+        for line_str in file_obj:
+            if line_str.startswith(PHASES_MARKER_STR) is True:
+                try:
+                    phase_dct = json.loads(line_str[len(PHASES_MARKER_STR):])
+                except ValueError:
+                    pass
+
+    return phase_dct
+
+
+def _get_percentile_flt(sorted_value_flt_lst: List[float], percentile_int: int) -> float:
+    """The percentile of sorted values, with linear interpolation."""
+
+    position_flt = (len(sorted_value_flt_lst) - 1) * percentile_int / 100
+    lower_int = int(position_flt)
+    upper_int = min(lower_int + 1, len(sorted_value_flt_lst) - 1)
+
+    return sorted_value_flt_lst[lower_int] \
+        + (sorted_value_flt_lst[upper_int] - sorted_value_flt_lst[lower_int]) * (position_flt - lower_int)
+
+
+def aggregate_phase_timings(phase_dct_lst: List[dict], percentile_int_lst: List[int] = None) -> dict:
+    """Aggregate the phase timings of tasks into percentiles, e.g. to find where the launch overhead goes.
+
+    Parameters
+    ----------
+    phase_dct_lst: list of dict
+        The phase timings of `read_phase_timings`.
+    percentile_int_lst: list of int
+        The percentiles; by default `DEFAULT_PERCENTILE_INT_LST`.
+
+    Returns
+    -------
+    dict:
+        'nr_tasks_int': the number of tasks;
+        'nr_failed_int': the number of tasks with a non-zero exit code;
+        'phase_dct': for "total" and every phase, the number of tasks with the phase, the mean, the percentiles
+        (e.g. "p50") in seconds, and the fraction of the summed total wall clock time;
+        'resource_dct': for every resource, the number of tasks, the mean and the percentiles."""
+
+    if percentile_int_lst is None:
+        percentile_int_lst = DEFAULT_PERCENTILE_INT_LST
+
+    def _get_stats_dct(_value_flt_lst: List[float]) -> Dict[str, float]:
+        _value_flt_lst = sorted(_value_flt_lst)
+        _stats_dct = {
+            'count_int': len(_value_flt_lst),
+            'mean_flt': sum(_value_flt_lst) / len(_value_flt_lst)
+        }
+        for _percentile_int in percentile_int_lst:
+            _stats_dct[f'p{_percentile_int}'] = _get_percentile_flt(_value_flt_lst, _percentile_int)
+
+        return _stats_dct
+
+    value_flt_lst_dct = {'total': []}
+    resource_flt_lst_dct = dict()
+    for phase_dct in phase_dct_lst:
+        value_flt_lst_dct['total'].append(phase_dct['total_sec'])
+        for name_str, value_flt in phase_dct['phase_sec_dct'].items():
+            value_flt_lst_dct.setdefault(name_str, []).append(value_flt)
+        for name_str, value_flt in phase_dct.get('resource_dct', dict()).items():
+            resource_flt_lst_dct.setdefault(name_str, []).append(value_flt)
+
+    total_sec_flt = max(sum(value_flt_lst_dct['total']), 1e-9)
+    aggr_phase_dct = dict()
+    for name_str, value_flt_lst in value_flt_lst_dct.items():
+        if len(value_flt_lst) == 0:
+            continue
+
+        aggr_phase_dct[name_str] = _get_stats_dct(value_flt_lst)
+        aggr_phase_dct[name_str]['fraction_flt'] = sum(value_flt_lst) / total_sec_flt
+
+    return {
+        'nr_tasks_int': len(phase_dct_lst),
+        'nr_failed_int': len([phase_dct for phase_dct in phase_dct_lst if phase_dct.get('exit_int', 0) != 0]),
+        'phase_dct': aggr_phase_dct,
+        'resource_dct': {name_str: _get_stats_dct(value_flt_lst)
+                         for name_str, value_flt_lst in resource_flt_lst_dct.items()}
+    }
+
+
+def read_log_dir_phase_timings(log_dirP_str: str, percentile_int_lst: List[int] = None) -> dict:
+    """Read and aggregate the phase timings of the log files in a directory, e.g. the "logging" directory of a
+    pickle jar.
+
+    Parameters
+    ----------
+    log_dirP_str: str
+        The directory of the log files, with the suffix ".log".
+    percentile_int_lst: list of int
+        The percentiles; by default `DEFAULT_PERCENTILE_INT_LST`.
+
+    Returns
+    -------
+    dict:
+        The aggregated phase timings; refer to `aggregate_phase_timings`."""
+
+    phase_dct_lst = []
+    for log_fileP_str in sorted(glob.glob(os.path.join(glob.escape(log_dirP_str), '*.log'))):
+        phase_dct = read_phase_timings(log_fileP_str)
+        if phase_dct is not None:
+            phase_dct_lst.append(phase_dct)
+
+    return aggregate_phase_timings(phase_dct_lst, percentile_int_lst=percentile_int_lst)
+
 
 class PackageManifest:
     """Specification of a package manifest; this class is to be used with the class
@@ -20,7 +560,15 @@ class PackageManifest:
                  src_dirP_str: str = None,
                  dst_tar_fileP_str: str = None,
                  dst_dirP_str: str = None,
-                 checksum_fileP_str: str = None):
+                 checksum_fileP_str: str = None,
+                 manifest_fileP_str: str = None,
+                 keep_versions_int: int = DEFAULT_KEEP_VERSIONS_INT,
+                 layered_bl: bool = False,
+                 max_delta_fraction_flt: float = DEFAULT_MAX_DELTA_FRACTION_FLT,
+                 compression_str: str = None,
+                 precompile_bl: bool = False,
+                 python_exe_str: str = None,
+                 zip_bl: bool = False):
         """
 
         Parameters
@@ -36,7 +584,48 @@ class PackageManifest:
         dst_dirP_str: str
             The directory path of wherein the tar package is extracted.
         checksum_dirP_str: str
-            The file path to where the wrapper script should write the MD5 check sum.
+            The node-local file path to where the wrapper script writes the stamp of the extracted package, which
+            is a copy of the manifest file.
+        manifest_fileP_str: str
+            The file path of the sidecar manifest of the tarred package, which holds the digest of the tar file;
+            by default `dst_tar_fileP_str` with the suffix ".manifest". The manifest is written by `package`, so
+            that the wrapper script only has to compare the small manifest file with the node-local stamp,
+            instead of computing the checksum of the tar file for every task.
+        keep_versions_int: int
+            The number of extracted versions of the package that are kept on a node. The wrapper script extracts
+            every version of the package into a directory named after its digest, next to `dst_dirP_str`, and
+            atomically switches the symbolic link `dst_dirP_str` to it; the least recently activated versions are
+            removed, but never the current version. Every task takes a lease on the version it activates, which is
+            held until the task exits, and a leased version is not removed while the task runs.
+        layered_bl: bool
+            If True, the package is distributed in layers: the tar file `dst_tar_fileP_str` is the base layer, and
+            a small delta layer holds the files that changed since the base layer was created, with a list of the
+            deleted files. A node that already has a version of the same base layer only applies the delta layer
+            to a hard-linked copy of that version. The per-file digests of the base layer are kept in the file
+            `dst_tar_fileP_str` with the suffix ".layers.json".
+        max_delta_fraction_flt: float
+            For a layered package, the base layer is recreated, and the delta layer dropped, once the delta layer
+            would be larger than this fraction of the base layer.
+        compression_str: str
+            The compression of the tar file that is created from `src_dirP_str`: "gz", which uses pigz if it is
+            available, or "zst", which requires zstd; the wrapper script decompresses with pigz, or otherwise
+            gzip, and zstd. The compression of an existing tar file, if `src_dirP_str` is None, is detected from
+            the file. The manifest records the compression ratio and the measured decompression throughput.
+        precompile_bl: bool
+            If True, the source directory is byte-compiled with `python_exe_str` when it is packaged, and the
+            compiled files are added to the "__pycache__" directories in the tar file, so that the first import on
+            a node does not compile the package. The files are compiled with the "unchecked-hash" invalidation
+            mode, since the wrapper script changes the modification times of the extracted files, and with the
+            source file paths below `dst_dirP_str`.
+        python_exe_str: str
+            The python interpreter of the compute nodes, which byte-compiles the source directory; by default the
+            interpreter "bin/python" of the source directory, e.g. a conda installation, if it exists, and
+            otherwise the current interpreter.
+        zip_bl: bool
+            If True, the source directory is also written to a zip file, `dst_tar_fileP_str` with the suffix
+            ".<digest>.zip", with the compiled files if `precompile_bl` is True. The wrapper script copies the zip
+            file of the manifest into the node-local directory of the extracted version, and puts that copy first
+            on the PYTHONPATH, so that the python modules are imported from a single node-local file.
         """
 
         if name_str is not None:
@@ -55,36 +644,395 @@ class PackageManifest:
         self.dst_dirP_str = dst_dirP_str
         self.checksum_fileP_str = checksum_fileP_str
 
+        if manifest_fileP_str is None:
+            manifest_fileP_str = dst_tar_fileP_str + MANIFEST_SUFFIX_STR
+        self.manifest_fileP_str = manifest_fileP_str
+
+        if keep_versions_int < 1:
+            err_str = f'The number of versions to keep has to be at least 1, but is {keep_versions_int}.'
+            raise ValueError(err_str)
+        self.keep_versions_int = keep_versions_int
+
+        if (layered_bl is True) and (src_dirP_str is None):
+            err_str = 'A layered package requires the source directory "src_dirP_str".'
+            raise ValueError(err_str)
+        self.layered_bl = layered_bl
+        self.max_delta_fraction_flt = max_delta_fraction_flt
+        self.layer_index_fileP_str = dst_tar_fileP_str + LAYER_INDEX_SUFFIX_STR
+
+        if (compression_str is not None) and (compression_str not in COMPRESSION_STR_LST):
+            err_str = f'The compression "{compression_str}" is not one of {COMPRESSION_STR_LST}.'
+            raise ValueError(err_str)
+        self.compression_str = compression_str
+
+        if (precompile_bl is True) and (src_dirP_str is None):
+            err_str = 'Byte-compiling a package requires the source directory "src_dirP_str".'
+            raise ValueError(err_str)
+        self.precompile_bl = precompile_bl
+
+        if (python_exe_str is None) and (src_dirP_str is not None):
+            python_exe_str = os.path.join(src_dirP_str, 'bin', 'python')
+            if os.path.isfile(python_exe_str) is False:
+                python_exe_str = sys.executable
+        self.python_exe_str = python_exe_str
+
+        if (zip_bl is True) and (src_dirP_str is None):
+            err_str = 'Zipping a package requires the source directory "src_dirP_str".'
+            raise ValueError(err_str)
+        self.zip_bl = zip_bl
+
+        # The pycache prefix directory while the package is packaged
+        self._pycache_dirP_str = None
+
+    def read_manifest(self) -> Union[Dict[str, str], None]:
+        """Read the sidecar manifest file.
+
+        Returns
+        -------
+        dict of str:
+            The manifest fields, or None if the manifest file does not exist."""
+
+        if os.path.isfile(self.manifest_fileP_str) is False:
+            return None
+
+        manifest_dct = dict()
+        with open(self.manifest_fileP_str, 'r') as file_obj:
+            for line_str in file_obj:
+                if '=' in line_str:
+                    key_str, value_str = line_str.rstrip('\n').split('=', 1)
+                    manifest_dct[key_str] = value_str
+
+        return manifest_dct
+
+    def write_manifest(self, manifest_dct: Dict[str, str]):
+        """Write the sidecar manifest file, as "key=value" lines, so that the wrapper script can parse it. The file
+        is written to a temporary file first and then renamed, so that the wrapper script never reads a partial
+        manifest.
+
+        Parameters
+        ----------
+        manifest_dct: dict of str
+            The manifest fields; the field "digest" is required."""
+
+        tmp_fileP_str = '{:s}.{:d}.tmp'.format(self.manifest_fileP_str, os.getpid())
+        with open(tmp_fileP_str, 'w') as file_obj:
+            for key_str, value_obj in manifest_dct.items():
+                file_obj.write(f'{key_str}={value_obj}\n')
+        os.replace(tmp_fileP_str, self.manifest_fileP_str)
+
+    def is_manifest_current(self) -> bool:
+        """Whether the manifest file exists and is at least as new as the tar file, with the same size."""
+
+        manifest_dct = self.read_manifest()
+        if (manifest_dct is None) or (os.path.isfile(self.dst_tar_fileP_str) is False):
+            return False
+
+        tar_stat_obj = os.stat(self.dst_tar_fileP_str)
+        return (manifest_dct.get('size') == str(tar_stat_obj.st_size)) \
+            and (os.stat(self.manifest_fileP_str).st_mtime_ns >= tar_stat_obj.st_mtime_ns)
+
+    def update_manifest(self, force_bl: bool = False):
+        """Compute the SHA-256 digest of the tar file and write it to the manifest file, unless the manifest is
+        current.
+
+        Parameters
+        ----------
+        force_bl: bool
+            If True, the digest is computed even if the manifest is current."""
+
+        if (force_bl is False) and (self.is_manifest_current() is True):
+            return
+
+        hash_obj = hashlib.sha256()
+        with open(self.dst_tar_fileP_str, 'rb') as file_obj:
+            for buffer_bytes in iter(lambda: file_obj.read(DIGEST_BUFFER_BYTES_INT), b''):
+                hash_obj.update(buffer_bytes)
+
+        manifest_dct = {
+            'digest': hash_obj.hexdigest(),
+            'size': os.stat(self.dst_tar_fileP_str).st_size
+        }
+        manifest_dct.update(self._get_compression_dct(self.dst_tar_fileP_str))
+        self.write_manifest(manifest_dct)
+        log_obj.info(f'Wrote the manifest "{self.manifest_fileP_str}"')
+
+    @staticmethod
+    def _get_compression_dct(fileP_str: str) -> Dict[str, object]:
+        """The manifest fields of the compression of an archive: the compression, the compression ratio and the
+        measured decompression throughput in MB/s; empty if the archive is not compressed."""
+
+        compression_str = get_compression_str(fileP_str)
+        if compression_str is None:
+            return dict()
+
+        content_size_int, decompress_MBps_flt = measure_decompression(fileP_str, compression_str)
+        return {
+            'compression': compression_str,
+            'ratio': '{:.2f}'.format(content_size_int / max(os.stat(fileP_str).st_size, 1)),
+            'decompress_MBps': '{:.1f}'.format(decompress_MBps_flt)
+        }
+
+    def get_src_fingerprint_str(self) -> str:
+        """The fingerprint of the source directory: the SHA-256 digest of the relative path, mode, size and
+        modification time of every packaged entry. The fingerprint changes if a file is touched; it is used to
+        decide, without reading any file, that the package does not have to be recreated."""
+
+        hash_obj = hashlib.sha256()
+        for fileP_str, arcname_str in _iter_src_entries(self.src_dirP_str):
+            stat_obj = os.stat(fileP_str)
+            hash_obj.update('{:s}\0{:o}\0{:d}\0{:d}\n'.format(arcname_str, stat_obj.st_mode, stat_obj.st_size,
+                                                              stat_obj.st_mtime_ns).encode())
+
+        return hash_obj.hexdigest()
+
     def package(self, tmp_dirP_str: str = None):
-        """Create the python package."""
+        """Create the python package and its manifest. If the package has no source directory, only the manifest
+        of the existing tar file is updated.
+
+        The tar file is streamed directly from the source directory to a temporary file next to the destination
+        file, which is renamed into place; the archive is reproducible, so that an unchanged source directory
+        gives a byte-identical tar file. Packaging is skipped if the fingerprint of the source directory, or
+        otherwise the digest of the archive, matches the manifest. A layered package is written as a delta layer
+        on top of its base layer; refer to the parameter `layered_bl`.
+
+        Parameters
+        ----------
+        tmp_dirP_str: str
+            Not used; the source directory is no longer copied to a temporary directory."""
 
         if self.src_dirP_str is None:
+            self.update_manifest()
             return
 
-        with tempfile.TemporaryDirectory(dir=tmp_dirP_str) as tmp_dir_obj:
-            # Copy ther python package directory to the temporary directory
-            out_dirN_str = os.path.basename(self.src_dirP_str)
-            out_dirP_str = os.path.join(str(tmp_dir_obj), out_dirN_str)
-            shutil.copytree(self.src_dirP_str,
-                            out_dirP_str,
-                            ignore=shutil.ignore_patterns('.git', '.*', '__pycache__', '*.pyc'))
+        manifest_dct = self.read_manifest()
+        if manifest_dct is None:
+            manifest_dct = dict()
+        is_current_bl = self.is_manifest_current()
+
+        # The source directory did not change since the last time it was packaged
+        src_fingerprint_str = self.get_src_fingerprint_str()
+        if (is_current_bl is True) and (manifest_dct.get('src_fingerprint') == src_fingerprint_str) \
+                and ((self.zip_bl is False) or (os.path.isfile(manifest_dct.get('zip', '')) is True)):
+            log_obj.info(f'The package "{self.name_str}" is up to date')
+            return
 
-            # Change directory to the temporary directory
-            current_dirP_str = os.getcwd()
-            os.chdir(str(tmp_dir_obj))
+        with tempfile.TemporaryDirectory() as pycache_dirP_str:
+            if self.precompile_bl is True:
+                self.compile_bytecode(pycache_dirP_str)
+                self._pycache_dirP_str = pycache_dirP_str
 
-            # Tar the directory
             try:
-                tmp_tar_fileP_str = os.path.join(str(tmp_dir_obj), out_dirN_str + '.tar')
-                with tarfile.open(tmp_tar_fileP_str, 'w') as tar_obj:
-                    tar_obj.add(out_dirN_str)
+                extra_manifest_dct = dict()
+                if self.zip_bl is True:
+                    extra_manifest_dct['zip'] = _write_src_zip(self.src_dirP_str, self.dst_tar_fileP_str,
+                                                               self._pycache_dirP_str)
+                    log_obj.info(f'Wrote the zip file "{extra_manifest_dct["zip"]}"')
 
-                # Copy the tar file to the destination file path
-                shutil.copyfile(tmp_tar_fileP_str, self.dst_tar_fileP_str)
+                self._package(manifest_dct, is_current_bl, src_fingerprint_str, extra_manifest_dct)
 
             finally:
-                # Change back to the orignal directory
-                os.chdir(current_dirP_str)
+                self._pycache_dirP_str = None
+
+            # Remove the zip files of older versions; a node that read the previous manifest may still copy the
+            # previous zip file, but the tasks only import from their node-local copies
+            self._remove_unused_files('.*' + ZIP_SUFFIX_STR, manifest_dct)
+
+    def compile_bytecode(self, pycache_dirP_str: str):
+        """Byte-compile the source directory with `python_exe_str`, with the "unchecked-hash" invalidation mode,
+        into a pycache prefix directory.
+
+        Parameters
+        ----------
+        pycache_dirP_str: str
+            The pycache prefix directory; refer to `python -X pycache_prefix`."""
+
+        cmd_str_lst = [self.python_exe_str, '-X', f'pycache_prefix={pycache_dirP_str}', '-m', 'compileall', '-q',
+                       '-j', '0', '--invalidation-mode', 'unchecked-hash']
+        if self.dst_dirP_str is not None:
+            # The source file paths in the compiled files, e.g. of tracebacks, are the paths on the compute nodes
+            cmd_str_lst += ['-d', self.dst_dirP_str]
+        cmd_str_lst.append(os.path.abspath(self.src_dirP_str))
+
+        process_obj = subprocess.run(cmd_str_lst, capture_output=True, text=True)
+        if process_obj.returncode != 0:
+            log_obj.warning(f'Could not byte-compile every file of the package "{self.name_str}":\n'
+                            + process_obj.stdout + process_obj.stderr)
+
+    def _package(self,
+                 manifest_dct: Dict[str, str],
+                 is_current_bl: bool,
+                 src_fingerprint_str: str,
+                 extra_manifest_dct: Dict[str, str]):
+        """Write the tar file, or the layers, of the source directory and the manifest, with the extra manifest
+        fields."""
+
+        if self.layered_bl is True:
+            self._package_layers(manifest_dct, is_current_bl, src_fingerprint_str, extra_manifest_dct)
+            return
+
+        # Files were touched, but the archive is the same; computing the digest of the uncompressed archive only
+        # reads the source directory, which is cheaper than writing the tar file to the shared file system
+        if (is_current_bl is True) and (manifest_dct.get('content_digest') == _write_src_tar(
+                self.src_dirP_str, None, pycache_dirP_str=self._pycache_dirP_str)['content_digest']):
+            manifest_dct = dict(manifest_dct, src_fingerprint=src_fingerprint_str, **extra_manifest_dct)
+            self.write_manifest(manifest_dct)
+            log_obj.info(f'The content of the package "{self.name_str}" did not change')
+            return
+
+        tar_dct = self._write_tar(self.dst_tar_fileP_str)
+        manifest_dct = dict(tar_dct, src_fingerprint=src_fingerprint_str)
+        manifest_dct.update(self._get_compression_dct(self.dst_tar_fileP_str))
+        manifest_dct.update(extra_manifest_dct)
+        self.write_manifest(manifest_dct)
+        log_obj.info(f'Wrote the package "{self.dst_tar_fileP_str}" and its manifest')
+
+    def _write_tar(self, dst_fileP_str: str, arcname_str_set: Set[str] = None) -> Dict[str, object]:
+        """Write the archive of the source directory to a temporary file next to `dst_fileP_str` and rename it
+        into place; returns the digests and sizes of `_write_src_tar`."""
+
+        tmp_fileP_str = '{:s}.{:s}-{:d}-{:d}.tmp'.format(dst_fileP_str, socket.gethostname(), os.getpid(),
+                                                         threading.get_ident())
+        try:
+            with open(tmp_fileP_str, 'wb') as file_obj:
+                tar_dct = _write_src_tar(self.src_dirP_str, file_obj, arcname_str_set, self.compression_str,
+                                         self._pycache_dirP_str)
+                file_obj.flush()
+                os.fsync(file_obj.fileno())
+
+            os.replace(tmp_fileP_str, dst_fileP_str)
+
+        finally:
+            if os.path.exists(tmp_fileP_str) is True:
+                os.remove(tmp_fileP_str)
+
+        return tar_dct
+
+    def read_layer_index(self) -> Union[dict, None]:
+        """Read the layer index of a layered package: the digest of the base layer, the digest of every entry of
+        the base layer, and the names of the entries that changed since the base layer was created.
+
+        Returns
+        -------
+        dict:
+            The layer index, or None if it does not exist."""
+
+        if os.path.isfile(self.layer_index_fileP_str) is False:
+            return None
+
+        with open(self.layer_index_fileP_str, 'r') as file_obj:
+            return json.load(file_obj)
+
+    def _write_layer_index(self, index_dct: dict):
+        tmp_fileP_str = '{:s}.{:d}.tmp'.format(self.layer_index_fileP_str, os.getpid())
+        with open(tmp_fileP_str, 'w') as file_obj:
+            json.dump(index_dct, file_obj)
+        os.replace(tmp_fileP_str, self.layer_index_fileP_str)
+
+    def _package_layers(self,
+                        manifest_dct: Dict[str, str],
+                        is_current_bl: bool,
+                        src_fingerprint_str: str,
+                        extra_manifest_dct: Dict[str, str]):
+        """Create the delta layer of a layered package, or recreate its base layer."""
+
+        entry_dct = _get_src_entry_dct(self.src_dirP_str, self._pycache_dirP_str)
+        index_dct = self.read_layer_index()
+
+        rebase_bl = (is_current_bl is False) or (index_dct is None) \
+            or (manifest_dct.get('base_digest') != index_dct['base_digest'])
+
+        if rebase_bl is False:
+            # Every entry that changed since the base layer, in this or in a previous delta layer, is part of the
+            # delta layer; the delta layer then brings any previous version of the same base layer up to date
+            base_dct = index_dct['base_dct']
+            changed_str_set = set(index_dct['changed_lst'])
+            for arcname_str, (digest_str, _) in entry_dct.items():
+                if base_dct.get(arcname_str) != digest_str:
+                    changed_str_set.add(arcname_str)
+
+            delta_str_set = changed_str_set.intersection(entry_dct)
+            whiteout_str_lst = sorted(set(base_dct).union(changed_str_set).difference(entry_dct))
+
+            delta_size_int = sum([entry_dct[arcname_str][1] for arcname_str in delta_str_set])
+            base_size_int = int(manifest_dct.get('content_size', manifest_dct['size']))
+            if delta_size_int > self.max_delta_fraction_flt * base_size_int:
+                log_obj.info(f'The delta layer of the package "{self.name_str}" is too large; recreating the base')
+                rebase_bl = True
+
+        if rebase_bl is True:
+            tar_dct = self._write_tar(self.dst_tar_fileP_str)
+            base_digest_str = tar_dct['digest']
+            self._write_layer_index({
+                'base_digest': base_digest_str,
+                'base_dct': {arcname_str: digest_str for arcname_str, (digest_str, _) in entry_dct.items()},
+                'changed_lst': []
+            })
+            new_manifest_dct = dict(tar_dct, base_digest=base_digest_str, src_fingerprint=src_fingerprint_str)
+            new_manifest_dct.update(self._get_compression_dct(self.dst_tar_fileP_str))
+            log_obj.info(f'Wrote the base layer "{self.dst_tar_fileP_str}"')
+
+        else:
+            # The fields of the base layer
+            new_manifest_dct = {key_str: value_str for key_str, value_str in manifest_dct.items()
+                                if key_str not in ('delta', 'delta_size', 'whiteouts')}
+            new_manifest_dct.update({
+                'digest': index_dct['base_digest'],
+                'src_fingerprint': src_fingerprint_str
+            })
+
+            if (len(delta_str_set) > 0) or (len(whiteout_str_lst) > 0):
+                delta_tar_fileP_str = self.dst_tar_fileP_str + '.delta.tmp'
+                delta_tar_dct = self._write_tar(delta_tar_fileP_str, delta_str_set)
+
+                # The version of the package is identified by the base layer, the delta layer and the deleted files
+                hash_obj = hashlib.sha256()
+                hash_obj.update('{:s}\n{:s}\n'.format(index_dct['base_digest'], delta_tar_dct['digest']).encode())
+                hash_obj.update('\n'.join(whiteout_str_lst).encode())
+                digest_str = hash_obj.hexdigest()
+
+                # The layer files are named after the version, so that a published layer never changes
+                layer_fileP_str = '{:s}.delta-{:s}'.format(self.dst_tar_fileP_str, digest_str[:16])
+                delta_suffix_str = '.tar'
+                if self.compression_str is not None:
+                    delta_suffix_str += '.' + self.compression_str
+                os.replace(delta_tar_fileP_str, layer_fileP_str + delta_suffix_str)
+                with open(layer_fileP_str + '.whiteouts', 'w') as file_obj:
+                    for whiteout_str in whiteout_str_lst:
+                        file_obj.write(whiteout_str + '\n')
+
+                new_manifest_dct.update({
+                    'digest': digest_str,
+                    'delta': layer_fileP_str + delta_suffix_str,
+                    'delta_size': delta_tar_dct['size'],
+                    'whiteouts': layer_fileP_str + '.whiteouts'
+                })
+                log_obj.info(f'Wrote the delta layer "{layer_fileP_str}{delta_suffix_str}" with '
+                             + f'{len(delta_str_set)} entries and {len(whiteout_str_lst)} deleted entries')
+
+            self._write_layer_index({
+                'base_digest': index_dct['base_digest'],
+                'base_dct': index_dct['base_dct'],
+                'changed_lst': sorted(changed_str_set)
+            })
+
+        new_manifest_dct.update(extra_manifest_dct)
+        self.write_manifest(new_manifest_dct)
+
+        # Remove the delta layers of older versions; a task that started with the previous manifest may still
+        # read the previous delta layer
+        self._remove_unused_files('.delta-*', manifest_dct)
+
+    def _remove_unused_files(self, pattern_str: str, previous_manifest_dct: Dict[str, str]):
+        """Remove the files next to the tar file, `dst_tar_fileP_str` with a suffix that matches the glob pattern,
+        that are neither referred to by the current manifest nor by the previous manifest."""
+
+        keep_fileP_str_set = set()
+        for manifest_dct in (previous_manifest_dct, self.read_manifest()):
+            keep_fileP_str_set.update(manifest_dct.values())
+
+        for fileP_str in glob.glob(glob.escape(self.dst_tar_fileP_str) + pattern_str):
+            if fileP_str not in keep_fileP_str_set:
+                os.remove(fileP_str)
 
 
 class IrisWrapperExecute:
@@ -96,7 +1044,8 @@ class IrisWrapperExecute:
                  conda_pckg_manifest_obj: PackageManifest = None,
                  pckg_manifest_obj_lst: List[PackageManifest] = None,
                  env_dct: Dict[str, str] = None,
-                 yaml_cfg_dct: dict = None):
+                 yaml_cfg_dct: dict = None,
+                 conda_prefix_dirP_str: str = None):
         """
 
         Parameter
@@ -110,7 +1059,13 @@ class IrisWrapperExecute:
         yaml_cfg_dct: dict
             The yaml config dictionary that has the information regarding `conda_pckg_manifest_obj`,
             `pckg_manifest_obj_lst` and `env_dct` if none of these have been provided; refer to
-            `clusterlib/templates/iris_wrapper_exe_eg.yaml` for an example."""
+            `clusterlib/templates/iris_wrapper_exe_eg.yaml` for an example.
+        conda_prefix_dirP_str: str
+            The directory of the local conda installation of which the conda tar file was made; `package` captures
+            its activation in a static activation script next to the conda tar file, which the wrapper script
+            sources instead of running the conda shell hook. If None, no activation script is written and the
+            wrapper script runs the conda shell hook; the directory can also be given as "conda_prefix_dirP_str"
+            in the "WrapperExecute" section of the yaml config dictionary."""
 
         if (conda_pckg_manifest_obj is None) and (pckg_manifest_obj_lst is None) and (env_dct is None):
             if yaml_cfg_dct is None:
@@ -125,9 +1080,18 @@ class IrisWrapperExecute:
             conda_pckg_manifest_obj, pckg_manifest_obj_lst, env_dct = \
                 self._read_yaml_cfg(yaml_cfg_dct)
 
+            if conda_prefix_dirP_str is None:
+                conda_prefix_dirP_str = yaml_cfg_dct['WrapperExecute'].get('conda_prefix_dirP_str')
+
         self.conda_pckg_manifest_obj = conda_pckg_manifest_obj
         self.pckg_manifest_obj_lst = pckg_manifest_obj_lst
         self.env_dct = env_dct
+        self.conda_prefix_dirP_str = conda_prefix_dirP_str
+
+        # The static activation script of the conda package
+        self.activation_fileP_str = None
+        if conda_pckg_manifest_obj is not None:
+            self.activation_fileP_str = conda_pckg_manifest_obj.dst_tar_fileP_str + ACTIVATION_SUFFIX_STR
 
         # Create to file path to the jinja file
         dirP_str = os.path.join(get_dirP_of__file__(__file__), 'templates')
@@ -151,10 +1115,69 @@ class IrisWrapperExecute:
 
         return conda_pkcg_manifest_obj, pkcg_manifest_obj_lst, env_dct
 
-    def package(self):
-        for pckg_manifest_obj in self.pckg_manifest_obj_lst:
-            log_obj.info(f'Packing for manifest "{pckg_manifest_obj.name_str}"')
-            pckg_manifest_obj.package()
+    def package(self, nr_workers_int: int = None):
+        """Package the python packages and update the manifest of the conda package; the manifests are packaged
+        concurrently.
+
+        Parameters
+        ----------
+        nr_workers_int: int
+            The maximum number of manifests that are packaged concurrently; by default all of them."""
+
+        pckg_manifest_obj_lst = list(self.pckg_manifest_obj_lst)
+        if self.conda_pckg_manifest_obj is not None:
+            pckg_manifest_obj_lst.insert(0, self.conda_pckg_manifest_obj)
+
+        if len(pckg_manifest_obj_lst) == 0:
+            return
+
+        if nr_workers_int is None:
+            nr_workers_int = len(pckg_manifest_obj_lst)
+
+        def _package(_pckg_manifest_obj: PackageManifest):
+            log_obj.info(f'Packing for manifest "{_pckg_manifest_obj.name_str}"')
+            _pckg_manifest_obj.package()
+
+        with ThreadPoolExecutor(max_workers=nr_workers_int) as executor_obj:
+            future_obj_lst = [executor_obj.submit(_package, pckg_manifest_obj)
+                              for pckg_manifest_obj in pckg_manifest_obj_lst]
+
+            # Raise the exception of a failed package, if any
+            for future_obj in future_obj_lst:
+                future_obj.result()
+
+        if self.conda_pckg_manifest_obj is not None:
+            self.write_activation()
+
+    def write_activation(self):
+        """Write the static activation script of the conda package, which the wrapper script sources with
+        CONDA_PCKG_DIRP_STR set to the extracted conda package; it exports the variables of `conda activate`
+        and sources the scripts in "etc/conda/activate.d", so that a task does not have to start a python
+        interpreter for the conda shell hook.
+
+        The activation is only written if it can be captured from the local conda installation,
+        `conda_prefix_dirP_str`; otherwise a previously written activation script is removed, and the wrapper
+        script runs the conda shell hook."""
+
+        if self.conda_prefix_dirP_str is None:
+            if os.path.exists(self.activation_fileP_str) is True:
+                os.remove(self.activation_fileP_str)
+                log_obj.info(f'Removed the activation script "{self.activation_fileP_str}"')
+            return
+
+        activation_str_lst = ['# The activation of the conda package; created by clusterlib.wrapexe, do not edit.'] \
+            + capture_activation_str_lst(self.conda_prefix_dirP_str) + [
+                'for ACTIVATE_FILEP_STR in ${CONDA_PCKG_DIRP_STR}/etc/conda/activate.d/*.sh; do',
+                '    test -f ${ACTIVATE_FILEP_STR} && . ${ACTIVATE_FILEP_STR}',
+                'done',
+                'unset ACTIVATE_FILEP_STR'
+            ]
+
+        tmp_fileP_str = '{:s}.{:d}.tmp'.format(self.activation_fileP_str, os.getpid())
+        with open(tmp_fileP_str, 'w') as file_obj:
+            file_obj.write('\n'.join(activation_str_lst) + '\n')
+        os.replace(tmp_fileP_str, self.activation_fileP_str)
+        log_obj.info(f'Wrote the activation script "{self.activation_fileP_str}"')
 
     def create(self, dst_fileP_str: str = None) -> Union[str, None]:
         """Create the execute wrapper script, to be executed on iris.
@@ -184,6 +1207,7 @@ class IrisWrapperExecute:
         kwargs_dct = {
             'conda_pckg_manifest_obj': self.conda_pckg_manifest_obj,
             'pckg_manifest_obj_lst': self.pckg_manifest_obj_lst,
+            'activation_fileP_str': self.activation_fileP_str,
             'env_obj_lst': env_obj_lst
         }
 